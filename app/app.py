@@ -4,18 +4,28 @@ import json
 import subprocess
 import time
 import re
-from datetime import datetime, timedelta
+from datetime import datetime
 from functools import wraps
-from flask import Flask, render_template, jsonify, request, send_file, session, redirect, url_for
+from flask import Flask, render_template, jsonify, request, session, redirect, url_for, make_response, g
 from flask_cors import CORS
-from elasticsearch import Elasticsearch
-from pymongo import MongoClient
+from elasticsearch import Elasticsearch, ApiError, TransportError
+from elastic_transport import ConnectionError as ESConnectionError, ConnectionTimeout as ESConnectionTimeout
+from pymongo.collection import Collection
+from pymongo.command_cursor import CommandCursor
+from pymongo.cursor import Cursor
+from pymongo.database import Database
+from pymongo.errors import DuplicateKeyError, ConnectionFailure
 import redis
+from redis.client import Pipeline, PubSub
+from redis.commands.core import Script
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
 import uuid
 import io
 from models.user import User
+from services import run_ingest_job, chunked_upload, ingest_queue, dedup, file_formats, file_indices, upload_catalog, local_search, metrics, session_store, rate_limit, database, migrations, log_queries, backends, http_cache, json_codec
+from services.password_hashing import HashingBusy, RETRY_AFTER_SECONDS
+from services.backends import BackendUnavailable
 
 # Load environment variables
 load_dotenv()
@@ -24,6 +34,12 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+# jsonify(), request JSON and the session cookie use orjson when installed
+app.json = json_codec.JSONProvider(app)
+
+# Spool uploads straight into the uploads folder, hashing them as they arrive
+app.request_class = dedup.HashingRequest
+
 # Secret key for session management
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 
@@ -39,85 +55,272 @@ REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 
 # File upload configuration
 UPLOAD_FOLDER = '/app/uploads'
-ALLOWED_EXTENSIONS = {'csv', 'json'}
+ALLOWED_EXTENSIONS = file_formats.ALLOWED_EXTENSIONS  # csv, json, ndjson, *.gz, zip
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB in bytes
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
+# Maximum users in one /api/users/import request; every row costs a bcrypt
+# hash, so keep a full import well inside GUNICORN_TIMEOUT
+USER_IMPORT_MAX_ROWS = int(os.getenv('USER_IMPORT_MAX_ROWS', 500))
+
 # Ensure upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Initialize clients
-es_client = None
-mongo_client = None
-redis_client = None
+# Columnar copies of uploads used by /api/search when Elasticsearch is down
+LOCAL_SEARCH_CACHE_DIR = os.getenv('LOCAL_SEARCH_CACHE_DIR', os.path.join(UPLOAD_FOLDER, '.columns'))
+
+# Elasticsearch request timeout (seconds) for requests users wait on; a dead
+# cluster is cut off by its circuit breaker
+ES_REQUEST_TIMEOUT = float(os.getenv('ELASTICSEARCH_REQUEST_TIMEOUT', 10))
+# Bulk requests of uploads indexed inline (no Redis queue), as in worker.py
+ES_INGEST_REQUEST_TIMEOUT = float(os.getenv('ELASTICSEARCH_INGEST_REQUEST_TIMEOUT', 60))
+
+def connect_elasticsearch():
+    """Elasticsearch client (retries are left to the backend's retry budget)"""
+    return Elasticsearch(
+        [ES_HOST],
+        verify_certs=False,
+        request_timeout=ES_REQUEST_TIMEOUT,
+        max_retries=0
+    )
+
+def setup_elasticsearch(client):
+    # Keyword mapping for the file_id stamped on uploaded documents
+    file_indices.ensure_template(client)
+
+def elasticsearch_failure(error):
+    """Connection errors, timeouts and cluster errors (5xx)"""
+    if isinstance(error, ApiError):
+        return error.status_code >= 500
+    return isinstance(error, (ESConnectionError, ESConnectionTimeout))
 
-def init_elasticsearch():
-    """Initialize Elasticsearch client"""
-    global es_client
+def elasticsearch_retryable(error):
+    if isinstance(error, ApiError):
+        return error.status_code in (502, 503, 504)
+    return isinstance(error, ESConnectionError)
+
+def setup_mongodb(client):
+    # Indexes for users, upload deduplication and the upload catalog
+    migrations.run_once(client[MONGO_DATABASE])
+
+def connect_redis():
+    return redis.Redis(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        decode_responses=True,
+        socket_connect_timeout=5
+    )
+
+def redis_local(method):
+    """Methods that only build objects or queue pipeline commands (until execute())"""
+    if isinstance(getattr(method, '__self__', None), Pipeline):
+        return method.__name__ != 'execute'
+    return method.__name__ in ('pipeline', 'pubsub', 'register_script')
+
+# Clients connect on first use (per process) and fail fast while their backend is down
+es_client = backends.Backend(
+    'elasticsearch',
+    connect_elasticsearch,
+    setup=setup_elasticsearch,
+    is_failure=elasticsearch_failure,
+    is_retryable=elasticsearch_retryable,
+    wrap=lambda value: hasattr(value, 'perform_request')
+)
+mongo_client = backends.Backend(
+    'mongodb',
+    database.get_client,  # shared pool, also used by the User model
+    setup=setup_mongodb,
+    # pymongo already retries reads and writes once
+    is_failure=lambda error: isinstance(error, ConnectionFailure),
+    wrap=lambda value: isinstance(value, (Database, Collection, Cursor, CommandCursor))
+)
+redis_client = backends.Backend(
+    'redis',
+    connect_redis,
+    is_failure=lambda error: isinstance(error, (redis.ConnectionError, redis.TimeoutError)),
+    is_retryable=lambda error: isinstance(error, redis.ConnectionError),
+    # Blocking reads of a subscription (pubsub.listen()) are not guarded:
+    # a half-open trial call must not wait for messages
+    wrap=lambda value: isinstance(value, (Pipeline, Script, PubSub)),
+    # A failed execute() has already cleared the pipeline's commands
+    no_retry=lambda method: isinstance(getattr(method, '__self__', None), Pipeline),
+    local=redis_local
+)
+
+# Users changed in one worker are dropped from every worker's lookup cache
+session_store.on_user_invalidated(User.drop_cached)
+User.broadcast_invalidations(
+    publish=lambda user_id: session_store.invalidate_user(redis_client, user_id),
+    subscribe=lambda: session_store.listen(redis_client)
+)
+
+def init_clients():
+    """
+    Drop this process's Elasticsearch, MongoDB and Redis clients
+    
+    They are created again on first use. Called by gunicorn in every
+    worker forked from a preloaded master, which must not share
+    connection pools or breaker state with its workers.
+    """
+    for backend in (es_client, mongo_client, redis_client):
+        backend.reset()
+
+def start_session(user):
+    """
+    Create the server-side session of a user who just logged in
+    
+    Returns:
+        str: Session ID stored in the Flask cookie
+    """
+    if redis_client:
+        try:
+            session_id, _ = session_store.create(redis_client, user)
+            return session_id
+        except Exception as e:
+            print(f"Redis session creation error: {e}")
+    return str(uuid.uuid4())
+
+def current_session():
+    """
+    Server-side data of the logged-in session, or None
+    
+    Sessions that expired or were revoked clear the Flask cookie. Without
+    Redis (or while it is unreachable) the signed cookie is trusted alone.
+    """
+    if 'user_id' not in session:
+        return None
+    cookie_session = {
+        'user_id': session['user_id'],
+        'username': session.get('username'),
+        'email': session.get('email')
+    }
+    if not redis_client:
+        return cookie_session
+    
     try:
-        es_client = Elasticsearch(
-            [ES_HOST],
-            verify_certs=False,
-            request_timeout=30
-        )
-        return es_client.ping()
+        data = session_store.get(redis_client, session.get('session_id'))
     except Exception as e:
-        print(f"Elasticsearch connection error: {e}")
-        return False
+        print(f"Redis session lookup error: {e}")
+        return cookie_session
+    
+    if not data or data.get('user_id') != session['user_id']:
+        session.clear()
+        return None
+    return data
+
+# Authentication decorator
+def login_required(f):
+    """Decorator to require a live server-side session for protected routes"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_session():
+            return redirect(url_for('login_page'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+@app.errorhandler(BackendUnavailable)
+def backend_unavailable(error):
+    """503 response for calls refused by an open circuit breaker"""
+    response = jsonify({'success': False, 'error': str(error)})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+def busy_response(error):
+    """503 response asking the client to retry when password hashing is saturated"""
+    response = jsonify({'success': False, 'error': str(error)})
+    response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+    return response, 503
 
-def init_mongodb():
-    """Initialize MongoDB client"""
-    global mongo_client
+def rate_limited(buckets):
+    """
+    Check rate limits before doing any expensive work
+    
+    Args:
+        buckets (list): (limit name, identifier) pairs, see rate_limit.LIMITS
+    
+    Returns:
+        A 429 response with Retry-After if a limit is exceeded, else None
+    """
+    if not redis_client:
+        return None
     try:
-        mongo_client = MongoClient(
-            host=MONGO_HOST,
-            port=MONGO_PORT,
-            username=MONGO_USER,
-            password=MONGO_PASSWORD,
-            serverSelectionTimeoutMS=5000
-        )
-        # Test connection
-        mongo_client.admin.command('ping')
-        return True
+        allowed, retry_after = rate_limit.check(redis_client, buckets)
     except Exception as e:
-        print(f"MongoDB connection error: {e}")
-        return False
+        # Fail open: rate limiting must not take logins down with Redis
+        print(f"Rate limit check error: {e}")
+        return None
+    if allowed:
+        return None
+    response = jsonify({
+        'success': False,
+        'error': f'Too many attempts. Please try again in {retry_after} seconds.'
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
 
-def init_redis():
-    """Initialize Redis client"""
-    global redis_client
+def logs_etag():
+    """ETag of the current log endpoint request (None without Redis)"""
+    if not redis_client:
+        return None
     try:
-        redis_client = redis.Redis(
-            host=REDIS_HOST,
-            port=REDIS_PORT,
-            decode_responses=True,
-            socket_connect_timeout=5
-        )
-        redis_client.ping()
-        return True
+        generation = redis_client.get(log_queries.GENERATION_KEY)
     except Exception as e:
-        print(f"Redis connection error: {e}")
-        return False
+        print(f"Redis generation lookup error: {e}")
+        return None
+    return http_cache.etag(generation, request.path, request.query_string.decode('latin-1'))
 
-# Initialize all connections
-init_elasticsearch()
-init_mongodb()
-init_redis()
+def skip_etag():
+    """Leave the current response untagged (degraded or cached data) so polls get it again"""
+    g.skip_etag = True
 
-# Authentication decorator
-def login_required(f):
-    """Decorator to require login for protected routes"""
+def conditional(f):
+    """
+    Answer polls whose ETag still matches with 304 Not Modified, before any query
+    
+    Only 200 responses built from fresh data (see skip_etag) are tagged.
+    """
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return redirect(url_for('login_page'))
-        return f(*args, **kwargs)
+        etag = logs_etag()
+        if etag and http_cache.matches(request.headers.get('If-None-Match'), etag):
+            metrics.increment('http.not_modified')
+            response = app.response_class(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+        response = make_response(f(*args, **kwargs))
+        if etag and response.status_code == 200 and not g.get('skip_etag'):
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
     return decorated_function
 
+@app.after_request
+def compress_response(response):
+    """Compress large JSON and CSV responses (brotli or gzip, as accepted)"""
+    if (response.mimetype not in http_cache.COMPRESSIBLE_TYPES
+            or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.is_streamed
+            or response.direct_passthrough):
+        # Streamed and file responses are passed through as they are
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = http_cache.choose_encoding(request.headers.get('Accept-Encoding'))
+    if not encoding:
+        return response
+    
+    body = response.get_data()
+    if not http_cache.should_compress(response.mimetype, len(body), encoding):
+        return response
+    with metrics.timed('http.compress_time'):
+        response.set_data(http_cache.compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
 def allowed_file(filename):
-    """Check if file extension is allowed"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    """Check if file extension is allowed (including .gz/.zip compression)"""
+    return file_formats.extension_of(filename) in ALLOWED_EXTENSIONS
 
 @app.route('/')
 @login_required
@@ -146,10 +349,74 @@ def register_page():
 def login_page():
     """Render user login page"""
     # If already logged in, redirect to dashboard
-    if 'user_id' in session:
+    if current_session():
         return redirect(url_for('dashboard'))
     return render_template('login.html')
 
+def validate_user_fields(username, email, password, confirm_password):
+    """
+    Validate the fields of a new user
+    
+    Returns:
+        list: {'field', 'error'} dicts, empty when all fields are valid
+    """
+    errors = []
+    
+    # Username validation
+    if not username:
+        errors.append({
+            'field': 'username',
+            'error': 'Username is required'
+        })
+    elif len(username) < 3:
+        errors.append({
+            'field': 'username',
+            'error': 'Username must be at least 3 characters'
+        })
+    elif len(username) > 20:
+        errors.append({
+            'field': 'username',
+            'error': 'Username must not exceed 20 characters'
+        })
+    elif not re.match(r'^[a-zA-Z0-9_]+$', username):
+        errors.append({
+            'field': 'username',
+            'error': 'Username can only contain letters, numbers, and underscores'
+        })
+    
+    # Email validation
+    if not email:
+        errors.append({
+            'field': 'email',
+            'error': 'Email is required'
+        })
+    elif not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email):
+        errors.append({
+            'field': 'email',
+            'error': 'Invalid email format'
+        })
+    
+    # Password validation
+    if not password:
+        errors.append({
+            'field': 'password',
+            'error': 'Password is required'
+        })
+    elif len(password) < 8:
+        errors.append({
+            'field': 'password',
+            'error': 'Password must be at least 8 characters'
+        })
+    
+    # Confirm password validation
+    if password != confirm_password:
+        errors.append({
+            'field': 'confirm_password',
+            'error': 'Passwords do not match'
+        })
+    
+    return errors
+
 @app.route('/api/register', methods=['POST'])
 def register_user():
     """
@@ -177,66 +444,18 @@ def register_user():
                 'error': 'No data provided'
             }), 400
         
+        # Throttle by client IP before validating or hashing anything
+        limited = rate_limited([('register_ip', request.remote_addr)])
+        if limited:
+            return limited
+        
         username = data.get('username', '').strip()
         email = data.get('email', '').strip()
         password = data.get('password', '')
         confirm_password = data.get('confirm_password', '')
         
         # Validation
-        errors = []
-        
-        # Username validation
-        if not username:
-            errors.append({
-                'field': 'username',
-                'error': 'Username is required'
-            })
-        elif len(username) < 3:
-            errors.append({
-                'field': 'username',
-                'error': 'Username must be at least 3 characters'
-            })
-        elif len(username) > 20:
-            errors.append({
-                'field': 'username',
-                'error': 'Username must not exceed 20 characters'
-            })
-        elif not re.match(r'^[a-zA-Z0-9_]+$', username):
-            errors.append({
-                'field': 'username',
-                'error': 'Username can only contain letters, numbers, and underscores'
-            })
-        
-        # Email validation
-        if not email:
-            errors.append({
-                'field': 'email',
-                'error': 'Email is required'
-            })
-        elif not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email):
-            errors.append({
-                'field': 'email',
-                'error': 'Invalid email format'
-            })
-        
-        # Password validation
-        if not password:
-            errors.append({
-                'field': 'password',
-                'error': 'Password is required'
-            })
-        elif len(password) < 8:
-            errors.append({
-                'field': 'password',
-                'error': 'Password must be at least 8 characters'
-            })
-        
-        # Confirm password validation
-        if password != confirm_password:
-            errors.append({
-                'field': 'confirm_password',
-                'error': 'Passwords do not match'
-            })
+        errors = validate_user_fields(username, email, password, confirm_password)
         
         # Return validation errors if any
         if errors:
@@ -250,25 +469,8 @@ def register_user():
         try:
             user_id = User.create(username, email, password)
             
-            # Create session in Redis
-            session_id = str(uuid.uuid4())
-            session_data = {
-                'user_id': user_id,
-                'username': username,
-                'email': email,
-                'login_time': datetime.utcnow().isoformat()
-            }
-            
-            # Store session in Redis (expires in 7 days)
-            if redis_client:
-                try:
-                    redis_client.setex(
-                        f'session:{session_id}',
-                        7 * 24 * 60 * 60,  # 7 days in seconds
-                        json.dumps(session_data)
-                    )
-                except Exception as e:
-                    print(f"Redis session creation error: {e}")
+            # Create server-side session
+            session_id = start_session({'user_id': user_id, 'username': username, 'email': email})
             
             # Set Flask session
             session['user_id'] = user_id
@@ -286,6 +488,9 @@ def register_user():
                 }
             }), 201
             
+        except HashingBusy as e:
+            return busy_response(e)
+        
         except ValueError as e:
             # Handle duplicate username/email
             error_msg = str(e)
@@ -353,8 +558,16 @@ def login_user():
                 'field': 'password'
             }), 400
         
+        # Throttle by client IP and account before any MongoDB query or hashing
+        limited = rate_limited([('login_ip', request.remote_addr), ('login_user', username.lower())])
+        if limited:
+            return limited
+        
         # Authenticate user
-        user = User.authenticate(username, password)
+        try:
+            user = User.authenticate(username, password)
+        except HashingBusy as e:
+            return busy_response(e)
         
         if not user:
             return jsonify({
@@ -362,25 +575,8 @@ def login_user():
                 'error': 'Invalid username or password'
             }), 401
         
-        # Create session in Redis
-        session_id = str(uuid.uuid4())
-        session_data = {
-            'user_id': user['_id'],
-            'username': user['username'],
-            'email': user['email'],
-            'login_time': datetime.utcnow().isoformat()
-        }
-        
-        # Store session in Redis (expires in 7 days)
-        if redis_client:
-            try:
-                redis_client.setex(
-                    f'session:{session_id}',
-                    7 * 24 * 60 * 60,  # 7 days in seconds
-                    json.dumps(session_data)
-                )
-            except Exception as e:
-                print(f"Redis session creation error: {e}")
+        # Create server-side session
+        session_id = start_session({'user_id': user['_id'], 'username': user['username'], 'email': user['email']})
         
         # Set Flask session
         session['user_id'] = user['_id']
@@ -406,6 +602,100 @@ def login_user():
             'error': 'An unexpected error occurred. Please try again.'
         }), 500
 
+def read_user_import():
+    """
+    Rows of a bulk user import: an uploaded CSV/JSON file or a JSON body
+    
+    Raises:
+        ValueError: If the payload cannot be read
+    """
+    if 'file' in request.files:
+        upload = request.files['file']
+        text = upload.read().decode('utf-8-sig')
+        if file_formats.extension_of(upload.filename) == 'csv':
+            return list(csv.DictReader(io.StringIO(text)))
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'Invalid JSON file: {e}')
+    else:
+        data = request.get_json(silent=True)
+    
+    if isinstance(data, dict):
+        data = data.get('users')
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        raise ValueError('Expected a CSV file, or JSON with a list of users')
+    return data
+
+@app.route('/api/users/import', methods=['POST'])
+def import_users():
+    """
+    Create many users at once (admins only)
+    
+    Accepts a CSV file (columns username, email, password) or JSON (a list
+    of users, or {"users": [...]}) as the "file" form field, or as the JSON
+    body. Passwords are hashed in parallel and users inserted in batches.
+    
+    Response JSON:
+        {"success": true, "created": n, "duplicates": n, "invalid": n,
+         "results": [{"row", "username", "status", ...}]}
+    """
+    current = current_session()
+    if not current:
+        return jsonify({'success': False, 'error': 'Authentication required'}), 401
+    user = User.get_by_id(current['user_id'])
+    if not user or user.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin role required'}), 403
+    
+    # Each import hashes up to USER_IMPORT_MAX_ROWS passwords
+    limited = rate_limited([('user_import', current['user_id'])])
+    if limited:
+        return limited
+    
+    try:
+        rows = read_user_import()
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    if not rows:
+        return jsonify({'success': False, 'error': 'No users provided'}), 400
+    if len(rows) > USER_IMPORT_MAX_ROWS:
+        return jsonify({'success': False, 'error': f'At most {USER_IMPORT_MAX_ROWS} users per import, split the file'}), 413
+    
+    # Validate every row like /api/register does
+    results = [None] * len(rows)
+    valid = []
+    for position, row in enumerate(rows):
+        username = str(row.get('username') or '').strip()
+        email = str(row.get('email') or '').strip()
+        password = str(row.get('password') or '')
+        errors = validate_user_fields(username, email, password, password)
+        if errors:
+            results[position] = {'row': position + 1, 'username': username, 'status': 'invalid', 'errors': errors}
+        else:
+            valid.append((position, {'username': username, 'email': email, 'password': password}))
+    
+    try:
+        created = User.create_many([user for _, user in valid])
+    except HashingBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"User import error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to import users. Please try again later.'}), 500
+    
+    for (position, _), result in zip(valid, created):
+        results[position] = {'row': position + 1, **result}
+    
+    counts = {status: sum(1 for result in results if result['status'] == status)
+              for status in ('created', 'duplicate', 'invalid')}
+    return jsonify({
+        'success': True,
+        'created': counts['created'],
+        'duplicates': counts['duplicate'],
+        'invalid': counts['invalid'],
+        'results': results
+    }), 200
+
 @app.route('/api/logout', methods=['POST'])
 def logout_user():
     """
@@ -419,10 +709,10 @@ def logout_user():
         session_id = session.get('session_id')
         username = session.get('username', 'User')
         
-        # Delete session from Redis
+        # Revoke the server-side session in every worker
         if session_id and redis_client:
             try:
-                redis_client.delete(f'session:{session_id}')
+                session_store.revoke(redis_client, session_id)
             except Exception as e:
                 print(f"Redis session deletion error: {e}")
         
@@ -442,6 +732,29 @@ def logout_user():
             'error': 'An error occurred during logout.'
         }), 500
 
+@app.route('/api/sessions', methods=['DELETE'])
+def revoke_sessions():
+    """
+    Log the current user out everywhere by revoking all their sessions
+    
+    Response JSON:
+        {"success": true, "revoked": n, "redirect": "/login"}
+    """
+    current = current_session()
+    if not current:
+        return jsonify({'success': False, 'error': 'Authentication required'}), 401
+    if not redis_client:
+        return jsonify({'success': False, 'error': 'Redis not available'}), 503
+    
+    try:
+        revoked = session_store.revoke_user(redis_client, current['user_id'])
+    except Exception as e:
+        print(f"Redis session revocation error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to revoke sessions'}), 500
+    
+    session.clear()
+    return jsonify({'success': True, 'revoked': revoked, 'redirect': '/login'}), 200
+
 @app.route('/api/health')
 def health_check():
     """Check health of all services"""
@@ -494,6 +807,9 @@ def health_check():
             'error': str(e)
         }
     
+    for name, backend in (('elasticsearch', es_client), ('mongodb', mongo_client), ('redis', redis_client)):
+        health_status['services'][name]['circuit'] = backend.breaker.state
+    
     # Determine overall status
     all_healthy = all(
         service.get('status') == 'healthy' 
@@ -504,182 +820,34 @@ def health_check():
     status_code = 200 if all_healthy else 503
     return jsonify(health_status), status_code
 
+@app.route('/api/metrics')
+def get_metrics():
+    """In-process metrics of this web worker (password hashing pool, ...)"""
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        **metrics.snapshot(),
+        'caches': {'sessions': session_store.cache_stats()}
+    })
+
 @app.route('/api/stats')
+@conditional
 def get_stats():
     """Get comprehensive dashboard statistics"""
-    stats = {
-        'timestamp': datetime.utcnow().isoformat(),
-        'total_logs': 0,
-        'total_logs_24h': 0,
-        'error_rate': 0,
-        'avg_response_time': 0,
-        'top_slowest_endpoints': [],
-        'active_users': 0,
-        'latest_error': None,
-        'files_uploaded': 0,
-        'system_status': {
-            'elasticsearch': 'unknown',
-            'mongodb': 'unknown',
-            'redis': 'unknown',
-            'overall': 'degraded'
-        },
-        'indices': [],
-        'hourly_trends': {
-            'logs': [],
-            'errors': [],
-            'response_times': []
-        },
-        'error': None
-    }
+    stats = log_queries.empty_stats()
     
     try:
         if not es_client:
             raise Exception("Elasticsearch client not initialized")
         
-        # Calculate 24h timestamp
-        now = datetime.utcnow()
-        last_24h = now - timedelta(hours=24)
-        last_24h_str = last_24h.isoformat()
-        
-        # 1. Total logs (all time)
-        count_result = es_client.count(index="saas-logs-*")
-        stats['total_logs'] = count_result.get('count', 0)
-        
-        # 2. Total logs (last 24 hours)
-        count_24h_query = {
-            "query": {
-                "range": {
-                    "timestamp": {
-                        "gte": last_24h_str
-                    }
-                }
-            }
-        }
-        count_24h_result = es_client.count(index="saas-logs-*", body=count_24h_query)
-        stats['total_logs_24h'] = count_24h_result.get('count', 0)
-        
-        # 3. Error rate: (5xx errors / total requests) * 100
-        error_query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"range": {"timestamp": {"gte": last_24h_str}}},
-                        {"range": {"status_code": {"gte": 500, "lt": 600}}}
-                    ]
-                }
-            }
-        }
-        error_count = es_client.count(index="saas-logs-*", body=error_query).get('count', 0)
-        if stats['total_logs_24h'] > 0:
-            stats['error_rate'] = round((error_count / stats['total_logs_24h']) * 100, 2)
-        
-        # 4. Average response time (last 24h)
-        avg_response_query = {
-            "query": {
-                "range": {
-                    "timestamp": {
-                        "gte": last_24h_str
-                    }
-                }
-            },
-            "aggs": {
-                "avg_response": {
-                    "avg": {
-                        "field": "response_time_ms"
-                    }
-                }
-            },
-            "size": 0
-        }
-        avg_response_result = es_client.search(index="saas-logs-*", body=avg_response_query)
-        avg_value = avg_response_result.get('aggregations', {}).get('avg_response', {}).get('value')
-        stats['avg_response_time'] = round(avg_value, 0) if avg_value else 0
-        
-        # 5. Top 3 slowest endpoints
-        slowest_endpoints_query = {
-            "query": {
-                "range": {
-                    "timestamp": {
-                        "gte": last_24h_str
-                    }
-                }
-            },
-            "aggs": {
-                "endpoints": {
-                    "terms": {
-                        "field": "endpoint.keyword",
-                        "size": 3,
-                        "order": {
-                            "avg_response": "desc"
-                        }
-                    },
-                    "aggs": {
-                        "avg_response": {
-                            "avg": {
-                                "field": "response_time_ms"
-                            }
-                        }
-                    }
-                }
-            },
-            "size": 0
+        # Counts and aggregations over all logs and the last 24 hours
+        results = {
+            name: getattr(es_client, method)(index=log_queries.LOG_INDEX, body=body)
+            for name, (method, body) in log_queries.stats_requests().items()
         }
-        slowest_result = es_client.search(index="saas-logs-*", body=slowest_endpoints_query)
-        for bucket in slowest_result.get('aggregations', {}).get('endpoints', {}).get('buckets', []):
-            stats['top_slowest_endpoints'].append({
-                'endpoint': bucket.get('key'),
-                'avg_response_time': round(bucket.get('avg_response', {}).get('value', 0), 0),
-                'count': bucket.get('doc_count', 0)
-            })
+        log_queries.apply_stats_results(stats, results)
         
-        # 6. Active users (unique user_ids, last 24h)
-        active_users_query = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"range": {"timestamp": {"gte": last_24h_str}}},
-                        {"exists": {"field": "user_id"}}
-                    ]
-                }
-            },
-            "aggs": {
-                "unique_users": {
-                    "cardinality": {
-                        "field": "user_id.keyword"
-                    }
-                }
-            },
-            "size": 0
-        }
-        active_users_result = es_client.search(index="saas-logs-*", body=active_users_query)
-        stats['active_users'] = active_users_result.get('aggregations', {}).get('unique_users', {}).get('value', 0)
-        
-        # 7. Latest error (most recent ERROR or CRITICAL log)
-        latest_error_query = {
-            "query": {
-                "bool": {
-                    "should": [
-                        {"term": {"level.keyword": "ERROR"}},
-                        {"term": {"level.keyword": "CRITICAL"}}
-                    ],
-                    "minimum_should_match": 1
-                }
-            },
-            "sort": [{"timestamp": {"order": "desc"}}],
-            "size": 1
-        }
-        latest_error_result = es_client.search(index="saas-logs-*", body=latest_error_query)
-        if latest_error_result['hits']['hits']:
-            error_log = latest_error_result['hits']['hits'][0]['_source']
-            stats['latest_error'] = {
-                'timestamp': error_log.get('timestamp'),
-                'level': error_log.get('level'),
-                'message': error_log.get('message'),
-                'endpoint': error_log.get('endpoint'),
-                'status_code': error_log.get('status_code')
-            }
-        
-        # 8. Files uploaded count (from MongoDB)
+        # Files uploaded count (from MongoDB)
         if mongo_client:
             try:
                 db = mongo_client[MONGO_DATABASE]
@@ -687,56 +855,9 @@ def get_stats():
                 stats['files_uploaded'] = files_collection.count_documents({})
             except Exception as e:
                 print(f"MongoDB files count error: {e}")
+                skip_etag()
         
-        # Get hourly trends for last 24 hours (for sparkline charts)
-        hourly_trends_query = {
-            "query": {
-                "range": {
-                    "timestamp": {
-                        "gte": last_24h_str
-                    }
-                }
-            },
-            "aggs": {
-                "hourly": {
-                    "date_histogram": {
-                        "field": "timestamp",
-                        "fixed_interval": "1h",
-                        "min_doc_count": 0,
-                        "extended_bounds": {
-                            "min": last_24h_str,
-                            "max": now.isoformat()
-                        }
-                    },
-                    "aggs": {
-                        "error_count": {
-                            "filter": {
-                                "range": {
-                                    "status_code": {
-                                        "gte": 500,
-                                        "lt": 600
-                                    }
-                                }
-                            }
-                        },
-                        "avg_response": {
-                            "avg": {
-                                "field": "response_time_ms"
-                            }
-                        }
-                    }
-                }
-            },
-            "size": 0
-        }
-        trends_result = es_client.search(index="saas-logs-*", body=hourly_trends_query)
-        for bucket in trends_result.get('aggregations', {}).get('hourly', {}).get('buckets', []):
-            stats['hourly_trends']['logs'].append(bucket.get('doc_count', 0))
-            stats['hourly_trends']['errors'].append(bucket.get('error_count', {}).get('doc_count', 0))
-            avg_resp = bucket.get('avg_response', {}).get('value')
-            stats['hourly_trends']['response_times'].append(round(avg_resp, 0) if avg_resp else 0)
-        
-        # 9. System status
+        # System status
         stats['system_status']['elasticsearch'] = 'healthy'
         
         # Check MongoDB
@@ -759,45 +880,34 @@ def get_stats():
         else:
             stats['system_status']['redis'] = 'unhealthy'
         
-        # Overall status
-        all_healthy = all(
-            status == 'healthy' 
-            for status in [
-                stats['system_status']['elasticsearch'],
-                stats['system_status']['mongodb'],
-                stats['system_status']['redis']
-            ]
-        )
-        stats['system_status']['overall'] = 'healthy' if all_healthy else 'degraded'
+        log_queries.apply_system_status(stats)
+        if stats['system_status']['overall'] != 'healthy':
+            skip_etag()
         
         # Get index information
-        indices = es_client.cat.indices(index="saas-logs-*", format="json")
-        for index in indices:
-            stats['indices'].append({
-                'name': index.get('index'),
-                'docs_count': index.get('docs.count', 0),
-                'size': index.get('store.size', 'N/A')
-            })
+        indices = es_client.cat.indices(index=log_queries.LOG_INDEX, format="json")
+        stats['indices'] = log_queries.index_summaries(indices)
         
         # Cache result in Redis for 30 seconds
         if redis_client:
             try:
                 redis_client.setex(
-                    'stats:dashboard',
-                    30,
-                    json.dumps(stats)
+                    log_queries.STATS_CACHE_KEY,
+                    log_queries.STATS_CACHE_TTL,
+                    json_codec.dumps(stats)
                 )
             except Exception as e:
                 print(f"Redis cache error: {e}")
     
     except Exception as e:
         stats['error'] = str(e)
+        skip_etag()
         # Try to get cached value from Redis
         if redis_client:
             try:
-                cached_stats = redis_client.get('stats:dashboard')
+                cached_stats = redis_client.get(log_queries.STATS_CACHE_KEY)
                 if cached_stats:
-                    cached_data = json.loads(cached_stats)
+                    cached_data = json_codec.loads(cached_stats)
                     cached_data['cached'] = True
                     cached_data['cache_error'] = str(e)
                     return jsonify(cached_data)
@@ -808,236 +918,253 @@ def get_stats():
 
 @app.route('/api/search', methods=['POST'])
 def comprehensive_search():
-    """Comprehensive search endpoint with filters and pagination"""
+    """
+    Comprehensive search endpoint with filters and pagination
+    
+    Falls back to searching the uploaded files locally when Elasticsearch
+    is unavailable (or when "source": "local" is requested).
+    """
     try:
-        if not es_client:
-            return jsonify({'error': 'Elasticsearch not available'}), 503
-        
         # Get parameters from request
         data = request.get_json() or {}
-        search_query = data.get('q', '').strip()
-        log_level = data.get('level', '')
-        date_from = data.get('date_from', '')
-        date_to = data.get('date_to', '')
-        endpoint_filter = data.get('endpoint', '')
-        status_code = data.get('status_code', '')
-        server = data.get('server', '')
-        page = int(data.get('page', 1))
-        per_page = int(data.get('per_page', 50))
-        sort_field = data.get('sort_field', 'timestamp')
-        sort_order = data.get('sort_order', 'desc')
-        
-        # Build Elasticsearch query
-        must_conditions = []
-        filter_conditions = []
-        
-        # Search query in message field
-        if search_query:
-            must_conditions.append({
-                "multi_match": {
-                    "query": search_query,
-                    "fields": ["message", "endpoint", "user_agent"],
-                    "type": "best_fields",
-                    "operator": "or"
-                }
-            })
-        
-        # Log level filter
-        if log_level and log_level != 'ALL':
-            filter_conditions.append({
-                "term": {"level.keyword": log_level}
-            })
-        
-        # Date range filter
-        if date_from or date_to:
-            date_range = {}
-            if date_from:
-                date_range["gte"] = date_from
-            if date_to:
-                date_range["lte"] = date_to
-            filter_conditions.append({
-                "range": {"timestamp": date_range}
-            })
-        
-        # Endpoint filter
-        if endpoint_filter:
-            filter_conditions.append({
-                "term": {"endpoint.keyword": endpoint_filter}
-            })
-        
-        # Status code filter
-        if status_code:
-            if status_code == '2xx':
-                filter_conditions.append({"range": {"status_code": {"gte": 200, "lt": 300}}})
-            elif status_code == '4xx':
-                filter_conditions.append({"range": {"status_code": {"gte": 400, "lt": 500}}})
-            elif status_code == '5xx':
-                filter_conditions.append({"range": {"status_code": {"gte": 500, "lt": 600}}})
-            else:
-                filter_conditions.append({"term": {"status_code": int(status_code)}})
-        
-        # Server filter
-        if server:
-            filter_conditions.append({
-                "term": {"server.keyword": server}
-            })
-        
-        # Build query
-        if must_conditions or filter_conditions:
-            query = {
-                "query": {
-                    "bool": {
-                        "must": must_conditions if must_conditions else [{"match_all": {}}],
-                        "filter": filter_conditions
-                    }
-                }
-            }
-        else:
-            query = {
-                "query": {"match_all": {}}
-            }
-        
-        # Add sorting
-        sort_mapping = {
-            'timestamp': 'timestamp',
-            'level': 'level.keyword',
-            'endpoint': 'endpoint.keyword',
-            'status_code': 'status_code',
-            'response_time_ms': 'response_time_ms'
-        }
-        sort_es_field = sort_mapping.get(sort_field, 'timestamp')
-        query["sort"] = [{sort_es_field: {"order": sort_order}}]
+        params = log_queries.parse_search_params(data)
         
-        # Add pagination
-        query["from"] = (page - 1) * per_page
-        query["size"] = per_page
+        if not es_client or data.get('source') == 'local':
+            return local_search_response(params)
         
         # Execute search
-        result = es_client.search(index="saas-logs-*", body=query)
-        
-        # Process results
-        results = []
-        for hit in result['hits']['hits']:
-            log_entry = hit['_source']
-            log_entry['_id'] = hit['_id']
-            results.append(log_entry)
-        
-        total = result['hits']['total']['value']
-        total_pages = (total + per_page - 1) // per_page
-        
-        return jsonify({
-            'success': True,
-            'results': results,
-            'total': total,
-            'page': page,
-            'pages': total_pages,
-            'per_page': per_page
-        })
+        try:
+            result = es_client.search(index=log_queries.LOG_INDEX, body=log_queries.search_body(params))
+        except (ApiError, TransportError, BackendUnavailable) as e:
+            if not log_queries.falls_back_to_local(e):
+                raise
+            print(f"Elasticsearch search error, searching uploads locally: {e}")
+            return local_search_response(params)
+        
+        return jsonify(log_queries.search_payload(result, params['page'], params['per_page']))
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def local_search_response(params):
+    """Search the uploaded files with the local column stores"""
+    payload, status = local_search_payload(params)
+    return jsonify(payload), status
+
+def local_search_payload(params):
+    """
+    /api/search response from the local column stores
+    
+    Args:
+        params (dict): Parameters from log_queries.parse_search_params()
+    
+    Returns:
+        tuple: (response dict, HTTP status code)
+    """
+    if not mongo_client:
+        return {'success': False, 'error': 'Elasticsearch and MongoDB not available'}, 503
+    
+    try:
+        filters = local_search.parse_filters(**log_queries.local_search_params(params))
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400
+    
+    page, per_page = params['page'], params['per_page']
+    file_docs = [
+        file_doc for file_doc in mongo_client[MONGO_DATABASE]['files'].find({}, {'file_path': 1, 'file_type': 1})
+        if file_doc.get('file_path') and os.path.exists(file_doc['file_path'])
+    ]
+    result = local_search.search(
+        LOCAL_SEARCH_CACHE_DIR, file_docs, filters, page, per_page, params['sort_field'], params['sort_order']
+    )
+    
+    message = 'Elasticsearch unavailable: showing results from uploaded files only'
+    if result['pending']:
+        message += f" ({result['pending']} not searchable yet, try again shortly)"
+    return {
+        'success': True,
+        'results': result['results'],
+        'total': result['total'],
+        'page': page,
+        'pages': (result['total'] + per_page - 1) // per_page,
+        'per_page': per_page,
+        'source': 'local',
+        'pending_files': result['pending'],
+        'message': message
+    }, 200
+
 @app.route('/api/search/endpoints', methods=['GET'])
+@conditional
 def get_unique_endpoints():
     """Get unique endpoints for filter dropdown"""
     try:
         if not es_client:
             return jsonify({'error': 'Elasticsearch not available'}), 503
         
-        query = {
-            "size": 0,
-            "aggs": {
-                "unique_endpoints": {
-                    "terms": {
-                        "field": "endpoint.keyword",
-                        "size": 100
-                    }
-                }
-            }
-        }
-        
-        result = es_client.search(index="saas-logs-*", body=query)
-        
-        endpoints = []
-        for bucket in result['aggregations']['unique_endpoints']['buckets']:
-            endpoints.append(bucket['key'])
-        
-        return jsonify({
-            'success': True,
-            'endpoints': endpoints
-        })
+        result = es_client.search(index=log_queries.LOG_INDEX, body=log_queries.endpoints_body())
+        return jsonify(log_queries.endpoints_payload(result))
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/logs/recent')
+@conditional
 def get_recent_logs():
     """Get recent logs from Elasticsearch"""
     try:
         if not es_client:
             return jsonify({'error': 'Elasticsearch not available'}), 503
         
-        # Query for recent logs
-        query = {
-            "query": {"match_all": {}},
-            "sort": [{"@timestamp": {"order": "desc"}}],
-            "size": 50
-        }
-        
-        result = es_client.search(index="saas-logs-*", body=query)
-        
-        logs = []
-        for hit in result['hits']['hits']:
-            log_entry = hit['_source']
-            log_entry['_id'] = hit['_id']
-            log_entry['_index'] = hit['_index']
-            logs.append(log_entry)
-        
-        return jsonify({
-            'total': result['hits']['total']['value'],
-            'logs': logs
-        })
+        result = es_client.search(index=log_queries.LOG_INDEX, body=log_queries.recent_logs_body())
+        return jsonify(log_queries.recent_logs_payload(result))
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/logs/stats/by-level')
+@conditional
 def get_logs_by_level():
     """Get log count grouped by level"""
     try:
         if not es_client:
             return jsonify({'error': 'Elasticsearch not available'}), 503
         
-        query = {
-            "size": 0,
-            "aggs": {
-                "levels": {
-                    "terms": {
-                        "field": "level.keyword",
-                        "size": 10
-                    }
-                }
-            }
-        }
+        result = es_client.search(index=log_queries.LOG_INDEX, body=log_queries.levels_body())
+        return jsonify(log_queries.levels_payload(result))
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def index_uploaded_file(file_id, file_path, file_type, priority='normal'):
+    """
+    Queue an uploaded file for ingestion by the worker processes
+    
+    Falls back to indexing inline when the Redis queue is unavailable.
+    
+    Returns:
+        dict: {'status', 'indexed', 'failed'} (counts are 0 while queued)
+    """
+    if redis_client:
+        try:
+            ingest_queue.enqueue(redis_client, file_id, priority)
+            return {'status': 'pending', 'indexed': 0, 'failed': 0}
+        except Exception as e:
+            print(f"Ingestion queue error, indexing inline: {e}")
+    
+    files_collection = mongo_client[MONGO_DATABASE]['files'] if mongo_client else None
+    file_doc = {'_id': file_id, 'file_path': file_path, 'file_type': file_type}
+    if files_collection is not None:
+        file_doc = files_collection.find_one({'_id': file_id}) or file_doc
+    ingest_client = es_client.options(request_timeout=ES_INGEST_REQUEST_TIMEOUT) if es_client else None
+    return run_ingest_job(ingest_client, files_collection, file_doc)
+
+def register_upload(original_filename, saved_filename, file_path, extra_metadata=None, priority='normal',
+                    dedup_mode='exact'):
+    """
+    Record a file saved in the uploads folder and index its contents
+    
+    Args:
+        original_filename (str): Sanitised client filename
+        saved_filename (str): Name of the file in the uploads folder
+        file_path (str): Full path of the saved file
+        extra_metadata (dict): Additional fields stored on the files document
+        priority (str): Ingestion queue priority ('high', 'normal', 'low')
+        dedup_mode (str): 'exact', or 'near' to also detect overlapping uploads
+    
+    Returns:
+        dict: Upload response payload ('duplicate' is set when the content
+              was already uploaded)
+    """
+    # Record format and compression (zip archives are inspected, not extracted)
+    try:
+        file_type = file_formats.detect_file_type(file_path)
+    except ValueError:
+        os.remove(file_path)
+        raise
+    compression = file_formats.compression_of(file_path)
+    
+    # Get file size
+    file_size = os.path.getsize(file_path)
+    
+    # Generate file ID
+    file_id = str(uuid.uuid4())
+    
+    # Fingerprint row ranges to detect near-duplicate uploads
+    near_duplicate = None
+    row_ranges = None
+    if dedup_mode == 'near' and mongo_client:
+        try:
+            row_ranges = dedup.row_range_fingerprints(file_path, file_type)
+            near_duplicate = dedup.find_near_duplicate(mongo_client[MONGO_DATABASE]['files'], row_ranges)
+        except Exception as e:
+            print(f"Near-duplicate detection error: {e}")
+    
+    # Store metadata in MongoDB "files" collection as per requirements
+    if mongo_client:
+        db = mongo_client[MONGO_DATABASE]
+        files_collection = db['files']
         
-        result = es_client.search(index="saas-logs-*", body=query)
+        metadata = {
+            '_id': file_id,
+            'filename': original_filename,
+            'saved_as': saved_filename,
+            'file_type': file_type,
+            'compression': compression,
+            'file_size': file_size,
+            'upload_date': datetime.utcnow().isoformat() + 'Z',
+            # Counted by the ingestion job, off the request path
+            'log_count': None,
+            'status': 'pending',
+            'user': 'admin',
+            'file_path': file_path
+        }
+        metadata.update(extra_metadata or {})
+        if row_ranges is not None:
+            metadata['row_ranges'] = row_ranges
+        if near_duplicate:
+            metadata['near_duplicate_of'] = near_duplicate
         
-        levels = []
-        for bucket in result['aggregations']['levels']['buckets']:
-            levels.append({
-                'level': bucket['key'],
-                'count': bucket['doc_count']
-            })
+        try:
+            files_collection.insert_one(metadata)
+        except DuplicateKeyError:
+            # Same content registered concurrently: keep the first copy
+            # (file_path is unique to this upload, never the winner's file)
+            os.remove(file_path)
+            existing = dedup.find_duplicate(files_collection, metadata.get('content_sha256'))
+            if existing:
+                return dedup.duplicate_response(existing)
+            raise
         
-        return jsonify({'levels': levels})
+        # Dashboard ETags: files_uploaded changed
+        if redis_client:
+            try:
+                log_queries.bump_generation(redis_client)
+            except Exception as e:
+                print(f"Redis cache error: {e}")
     
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    # Queue documents for indexing into Elasticsearch
+    ingest_result = index_uploaded_file(file_id, file_path, file_type, priority)
+    
+    return {
+        'success': True,
+        'duplicate': False,
+        'file_id': file_id,
+        'filename': original_filename,
+        'saved_as': saved_filename,
+        'file_size': file_size,
+        'log_count': ingest_result.get('log_count'),
+        'status': ingest_result['status'],
+        'indexed_count': ingest_result['indexed'],
+        'failed_count': ingest_result['failed'],
+        'near_duplicate_of': near_duplicate
+    }
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    """Upload CSV or JSON file, save to uploads folder and store metadata in MongoDB"""
+    """Upload CSV, JSON or NDJSON file (optionally .gz/.zip compressed), save to uploads folder, store metadata in MongoDB and queue it for indexing"""
     try:
+        files_collection = mongo_client[MONGO_DATABASE]['files'] if mongo_client else None
+        
         # Check if file is in request
         if 'file' not in request.files:
             return jsonify({'success': False, 'error': 'No file part in request'}), 400
@@ -1050,72 +1177,216 @@ def upload_file():
         
         # Check if file type is allowed
         if not allowed_file(file.filename):
-            return jsonify({'success': False, 'error': 'File type not allowed. Only CSV and JSON files are accepted'}), 400
+            return jsonify({'success': False, 'error': 'File type not allowed. Only CSV, JSON and NDJSON files (optionally .gz or .zip compressed) are accepted'}), 400
+        
+        # Ingestion queue priority
+        priority = request.form.get('priority', 'normal')
+        if priority not in ingest_queue.PRIORITIES:
+            return jsonify({'success': False, 'error': 'priority must be high, normal or low'}), 400
         
-        # Generate unique filename with timestamp
+        # Exact duplicate (by the digest of the bytes received, never a client-declared
+        # one): the spooled copy is discarded when the request closes
+        existing = dedup.find_duplicate(files_collection, dedup.uploaded_sha256(file))
+        if existing:
+            return jsonify(dedup.duplicate_response(existing)), 200
+        
+        # Generate unique filename (identical uploads in the same second get their own file)
         timestamp = int(time.time())
         original_filename = secure_filename(file.filename)
-        file_extension = original_filename.rsplit('.', 1)[1].lower()
-        saved_filename = f"{timestamp}_{original_filename}"
+        saved_filename = f"{timestamp}_{uuid.uuid4()}_{original_filename}"
         
         # Save file to uploads folder
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], saved_filename)
-        file.save(file_path)
+        sha256 = dedup.save_upload(file, file_path)
+        
+        try:
+            response = register_upload(
+                original_filename,
+                saved_filename,
+                file_path,
+                {'content_sha256': sha256},
+                priority=priority,
+                dedup_mode=request.form.get('dedup', dedup.DEDUP_MODE)
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if response['duplicate']:
+            return jsonify(response), 200
         
-        # Get file size
-        file_size = os.path.getsize(file_path)
+        response['message'] = 'File uploaded successfully'
+        return jsonify(response), 201
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/uploads/chunked', methods=['POST'])
+def init_chunked_upload():
+    """
+    Start a resumable chunked upload
+    
+    Request JSON:
+        {"filename": "...", "total_size": <bytes>, "sha256": "<optional hex digest>"}
+    
+    Response JSON:
+        {"success": true, "upload_id": "...", "chunk_size": <bytes>, "total_chunks": N}
+    """
+    try:
+        if not redis_client:
+            return jsonify({'success': False, 'error': 'Redis not available'}), 503
         
-        # Count records in file (log_count)
-        log_count = 0
+        data = request.get_json() or {}
+        filename = data.get('filename', '')
+        
+        if not filename or not allowed_file(filename):
+            return jsonify({'success': False, 'error': 'File type not allowed. Only CSV, JSON and NDJSON files (optionally .gz or .zip compressed) are accepted'}), 400
+        
+        # A declared sha256 is only checked once the chunks arrive (finalize); duplicates
+        # are detected on the digest of the received bytes
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                if file_extension == 'csv':
-                    log_count = sum(1 for line in f) - 1  # Subtract header
-                elif file_extension == 'json':
-                    data = json.load(f)
-                    log_count = len(data) if isinstance(data, list) else 1
-        except Exception as e:
-            print(f"Could not count records: {e}")
+            total_size = int(data.get('total_size', 0))
+            session_data = chunked_upload.create_session(
+                redis_client,
+                app.config['UPLOAD_FOLDER'],
+                secure_filename(filename),
+                total_size,
+                data.get('sha256')
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        return jsonify({
+            'success': True,
+            'upload_id': session_data['upload_id'],
+            'chunk_size': session_data['chunk_size'],
+            'total_chunks': session_data['total_chunks']
+        }), 201
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/uploads/chunked/<upload_id>', methods=['GET'])
+def get_chunked_upload(upload_id):
+    """Get chunked upload progress, including missing chunk offsets for resuming"""
+    try:
+        if not redis_client:
+            return jsonify({'success': False, 'error': 'Redis not available'}), 503
+        
+        session_data = chunked_upload.get_session(redis_client, upload_id)
+        if not session_data:
+            return jsonify({'success': False, 'error': 'Upload not found or expired'}), 404
+        
+        upload_status = chunked_upload.status(redis_client, session_data)
+        upload_status['success'] = True
+        return jsonify(upload_status)
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/uploads/chunked/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """Write one chunk of a chunked upload; the raw body is written at ?offset=<bytes>"""
+    try:
+        if not redis_client:
+            return jsonify({'success': False, 'error': 'Redis not available'}), 503
+        
+        session_data = chunked_upload.get_session(redis_client, upload_id)
+        if not session_data:
+            return jsonify({'success': False, 'error': 'Upload not found or expired'}), 404
         
-        # Generate file ID
-        file_id = str(uuid.uuid4())
+        try:
+            offset = int(request.args.get('offset', ''))
+            chunk_index = chunked_upload.write_chunk(
+                redis_client,
+                session_data,
+                offset,
+                request.stream,
+                request.content_length or 0
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        return jsonify({
+            'success': True,
+            'chunk': chunk_index,
+            'offset': offset
+        })
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/uploads/chunked/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """Verify a chunked upload and register it like a regular upload"""
+    try:
+        if not redis_client:
+            return jsonify({'success': False, 'error': 'Redis not available'}), 503
+        
+        session_data = chunked_upload.get_session(redis_client, upload_id)
+        if not session_data:
+            return jsonify({'success': False, 'error': 'Upload not found or expired'}), 404
+        
+        try:
+            sha256 = chunked_upload.finalize(redis_client, session_data)
+        except chunked_upload.CompletionInProgress as e:
+            return jsonify({'success': False, 'error': str(e)}), 409
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        # Store metadata in MongoDB "files" collection as per requirements
         if mongo_client:
-            db = mongo_client[MONGO_DATABASE]
-            files_collection = db['files']
-            
-            metadata = {
-                '_id': file_id,
-                'filename': original_filename,
-                'saved_as': saved_filename,
-                'file_type': file_extension,
-                'file_size': file_size,
-                'upload_date': datetime.utcnow().isoformat() + 'Z',
-                'log_count': log_count,
-                'status': 'completed',
-                'user': 'admin',
-                'file_path': file_path
-            }
-            
-            files_collection.insert_one(metadata)
+            existing = dedup.find_duplicate(mongo_client[MONGO_DATABASE]['files'], sha256)
+            if existing:
+                os.remove(session_data['file_path'])
+                return jsonify(dedup.duplicate_response(existing)), 200
+        
+        data = request.get_json(silent=True) or {}
+        try:
+            response = register_upload(
+                session_data['filename'],
+                session_data['saved_as'],
+                session_data['file_path'],
+                {'content_sha256': sha256, 'upload_method': 'chunked'},
+                dedup_mode=data.get('dedup', dedup.DEDUP_MODE)
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if response['duplicate']:
+            return jsonify(response), 200
+        
+        response['message'] = 'File uploaded successfully'
+        return jsonify(response), 201
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/uploads/chunked/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(upload_id):
+    """Abort a chunked upload and remove the partial file"""
+    try:
+        if not redis_client:
+            return jsonify({'success': False, 'error': 'Redis not available'}), 503
+        
+        session_data = chunked_upload.get_session(redis_client, upload_id)
+        if not session_data:
+            return jsonify({'success': False, 'error': 'Upload not found or expired'}), 404
+        
+        chunked_upload.discard(redis_client, session_data)
         
         return jsonify({
             'success': True,
-            'file_id': file_id,
-            'message': 'File uploaded successfully',
-            'filename': original_filename,
-            'saved_as': saved_filename,
-            'file_size': file_size,
-            'log_count': log_count
-        }), 201
+            'message': 'Upload aborted'
+        })
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/uploads', methods=['GET'])
 def get_uploads():
-    """Get list of uploaded files from MongoDB"""
+    """
+    Get uploaded files from MongoDB, newest first
+    
+    Query params: limit (max 100), cursor (next_cursor of the previous page),
+    status, type ('csv'/'json'), user
+    """
     try:
         if not mongo_client:
             return jsonify({'error': 'MongoDB not available'}), 503
@@ -1123,30 +1394,98 @@ def get_uploads():
         db = mongo_client[MONGO_DATABASE]
         files_collection = db['files']
         
-        # Get last 10 uploads, sorted by upload date (newest first)
-        limit = int(request.args.get('limit', 10))
-        uploads = list(files_collection.find(
-            {},
-            {'file_path': 0}  # Exclude internal file path
-        ).sort('upload_date', -1).limit(limit))
-        
-        # Convert _id to string for JSON serialization
-        for upload in uploads:
-            if '_id' in upload:
-                upload['_id'] = str(upload['_id'])
+        try:
+            uploads, next_cursor = upload_catalog.list_uploads(
+                files_collection,
+                limit=request.args.get('limit', upload_catalog.DEFAULT_PAGE_SIZE),
+                cursor=request.args.get('cursor'),
+                status=request.args.get('status'),
+                file_type=request.args.get('type'),
+                user=request.args.get('user')
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         return jsonify({
             'success': True,
             'count': len(uploads),
-            'uploads': uploads
+            'uploads': uploads,
+            'next_cursor': next_cursor
         })
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/uploads/<file_id>/progress', methods=['GET'])
+def get_upload_progress(file_id):
+    """Get ingestion progress for an uploaded file"""
+    try:
+        if not mongo_client:
+            return jsonify({'success': False, 'error': 'MongoDB not available'}), 503
+        
+        db = mongo_client[MONGO_DATABASE]
+        file_doc = db['files'].find_one(
+            {'_id': file_id},
+            {'status': 1, 'log_count': 1, 'progress': 1, 'indexed_count': 1,
+             'failed_count': 1, 'ingest_errors': 1}
+        )
+        
+        if not file_doc:
+            return jsonify({'success': False, 'error': 'File not found'}), 404
+        
+        queue_position = None
+        if file_doc.get('status') == 'pending' and redis_client:
+            try:
+                queue_position = ingest_queue.queue_position(redis_client, file_id)
+            except Exception as e:
+                print(f"Redis queue position error: {e}")
+        
+        return jsonify({
+            'success': True,
+            'file_id': file_id,
+            'status': file_doc.get('status'),
+            'log_count': file_doc.get('log_count', 0),
+            'queue_position': queue_position,
+            'progress': file_doc.get('progress', {}),
+            'indexed_count': file_doc.get('indexed_count'),
+            'failed_count': file_doc.get('failed_count'),
+            'errors': file_doc.get('ingest_errors', [])
+        })
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/uploads/<file_id>/summary', methods=['GET'])
+def get_upload_summary(file_id):
+    """Get the summary statistics computed while the file was ingested"""
+    try:
+        if not mongo_client:
+            return jsonify({'success': False, 'error': 'MongoDB not available'}), 503
+        
+        db = mongo_client[MONGO_DATABASE]
+        file_doc = db['files'].find_one(
+            {'_id': file_id},
+            {'filename': 1, 'status': 1, 'log_count': 1, 'summary': 1}
+        )
+        
+        if not file_doc:
+            return jsonify({'success': False, 'error': 'File not found'}), 404
+        
+        return jsonify({
+            'success': True,
+            'file_id': file_id,
+            'filename': file_doc.get('filename'),
+            'status': file_doc.get('status'),
+            'log_count': file_doc.get('log_count', 0),
+            'summary': file_doc.get('summary')
+        })
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/uploads/<file_id>', methods=['DELETE'])
 def delete_upload(file_id):
-    """Delete an uploaded file"""
+    """Delete an uploaded file and its indexed documents"""
     try:
         if not mongo_client:
             return jsonify({'success': False, 'error': 'MongoDB not available'}), 503
@@ -1160,110 +1499,84 @@ def delete_upload(file_id):
         if not file_doc:
             return jsonify({'success': False, 'error': 'File not found'}), 404
         
-        # Delete physical file
+        if file_doc.get('status') == 'processing':
+            return jsonify({'success': False, 'error': 'File is being indexed, try again once it has finished'}), 409
+        
+        # A pending job taken off the queue has not indexed anything
+        dequeued = False
+        if file_doc.get('status') == 'pending' and redis_client:
+            try:
+                dequeued = ingest_queue.remove(redis_client, file_id)
+                # Claimed by a worker that has not marked it processing yet
+                if not dequeued and ingest_queue.is_processing(redis_client, file_id):
+                    return jsonify({'success': False, 'error': 'File is being indexed, try again once it has finished'}), 409
+            except Exception as e:
+                print(f"Redis queue error: {e}")
+        
+        # Remove indexed documents (index drop, or async delete-by-query job)
+        documents = None
+        if not dequeued:
+            if not es_client:
+                return jsonify({'success': False, 'error': 'Elasticsearch not available'}), 503
+            documents = file_indices.delete_documents(es_client, db['delete_jobs'], file_doc)
+        
+        # Delete physical file and its local search columns
         file_path = file_doc.get('file_path')
         if file_path and os.path.exists(file_path):
             os.remove(file_path)
+        local_search.discard(LOCAL_SEARCH_CACHE_DIR, file_id)
         
         # Delete metadata from MongoDB
         files_collection.delete_one({'_id': file_id})
         
+        # Dashboard stats and log ETags must not keep counting the deleted logs
+        if redis_client:
+            try:
+                redis_client.delete(log_queries.STATS_CACHE_KEY)
+                log_queries.bump_generation(redis_client)
+            except Exception as e:
+                print(f"Redis cache error: {e}")
+        
         return jsonify({
             'success': True,
-            'message': 'File deleted successfully'
+            'message': 'File deleted successfully',
+            'documents': documents
         })
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/uploads/delete-jobs/<job_id>', methods=['GET'])
+def get_delete_job(job_id):
+    """Get the status of an asynchronous upload document deletion"""
+    try:
+        if not mongo_client:
+            return jsonify({'success': False, 'error': 'MongoDB not available'}), 503
+        
+        jobs_collection = mongo_client[MONGO_DATABASE]['delete_jobs']
+        job = jobs_collection.find_one({'_id': job_id})
+        if not job:
+            return jsonify({'success': False, 'error': 'Delete job not found'}), 404
+        
+        if job.get('status') == 'running' and es_client:
+            job = file_indices.refresh_job(es_client, jobs_collection, job)
+        
+        return jsonify({'success': True, 'job': job})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/logs/search', methods=['GET'])
+@conditional
 def search_logs():
     """Search logs with filters and pagination"""
     try:
         if not es_client:
             return jsonify({'error': 'Elasticsearch not available'}), 503
         
-        # Get query parameters
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 50))
-        log_level = request.args.get('level', '')
-        start_date = request.args.get('start_date', '')
-        end_date = request.args.get('end_date', '')
-        endpoint = request.args.get('endpoint', '')
-        search_text = request.args.get('q', '')
-        
-        # Build Elasticsearch query
-        must_conditions = []
-        
-        # Add log level filter
-        if log_level:
-            must_conditions.append({
-                "term": {"level.keyword": log_level}
-            })
-        
-        # Add endpoint filter
-        if endpoint:
-            must_conditions.append({
-                "match": {"endpoint": endpoint}
-            })
-        
-        # Add date range filter
-        if start_date or end_date:
-            date_range = {}
-            if start_date:
-                date_range["gte"] = start_date
-            if end_date:
-                date_range["lte"] = end_date
-            
-            must_conditions.append({
-                "range": {"@timestamp": date_range}
-            })
-        
-        # Add text search
-        if search_text:
-            must_conditions.append({
-                "multi_match": {
-                    "query": search_text,
-                    "fields": ["message", "endpoint", "user_id"]
-                }
-            })
-        
-        # Build final query
-        query = {
-            "query": {
-                "bool": {
-                    "must": must_conditions if must_conditions else [{"match_all": {}}]
-                }
-            },
-            "sort": [{"@timestamp": {"order": "desc"}}],
-            "from": (page - 1) * per_page,
-            "size": per_page
-        }
-        
-        result = es_client.search(index="saas-logs-*", body=query)
-        
-        logs = []
-        for hit in result['hits']['hits']:
-            log_entry = hit['_source']
-            log_entry['_id'] = hit['_id']
-            log_entry['_index'] = hit['_index']
-            logs.append(log_entry)
-        
-        total = result['hits']['total']['value']
-        total_pages = (total + per_page - 1) // per_page
-        
-        return jsonify({
-            'success': True,
-            'logs': logs,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': total,
-                'total_pages': total_pages,
-                'has_next': page < total_pages,
-                'has_prev': page > 1
-            }
-        })
+        params = log_queries.parse_log_search_args(request.args)
+        result = es_client.search(index=log_queries.LOG_INDEX, body=log_queries.log_search_body(params))
+        return jsonify(log_queries.log_search_payload(result, params['page'], params['per_page']))
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1336,14 +1649,13 @@ def export_logs():
                 log.get('response_time', '')
             ])
         
-        # Prepare file for download
-        output.seek(0)
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'logs_export_{datetime.utcnow().strftime("%Y%m%d_%H%M%S")}.csv'
+        # Built in memory: a plain (compressible) response rather than send_file
+        response = make_response(output.getvalue().encode('utf-8'))
+        response.mimetype = 'text/csv'
+        response.headers['Content-Disposition'] = (
+            f'attachment; filename=logs_export_{datetime.utcnow().strftime("%Y%m%d_%H%M%S")}.csv'
         )
+        return response
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,278 @@
+"""
+ASGI entry point with asyncio views for the read-heavy endpoints
+
+/api/stats, /api/search, /api/search/endpoints and /api/logs/recent,
+/api/logs/stats/by-level and /api/logs/search are served with
+AsyncElasticsearch, redis.asyncio and motor. A worker process waiting on
+Elasticsearch holds a coroutine instead of a thread, so a handful of
+processes can serve thousands of concurrent dashboard and search
+requests. Every other route is the Flask app (app.py), run in a thread
+pool; both return the same JSON (queries are built by
+services.log_queries).
+
+Usage:
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn --config gunicorn.conf.py asgi:app
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+"""
+import os
+import asyncio
+import functools
+import contextlib
+from elasticsearch import AsyncElasticsearch, ApiError, TransportError
+import redis.asyncio as aioredis
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse as StarletteJSONResponse, Response
+from starlette.routing import Route, Mount
+from a2wsgi import WSGIMiddleware
+
+import app as web_app
+from services import log_queries, database, http_cache, metrics, json_codec
+from services.backends import BackendUnavailable
+
+# Threads running the (blocking) Flask routes
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 10))
+
+# Created in each worker's event loop (after fork) by lifespan()
+clients = {'es': None, 'mongo': None, 'redis': None}
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_):
+    """Open the async Elasticsearch, MongoDB and Redis clients for this worker"""
+    # Retries are left to the Elasticsearch backend's retry budget
+    clients['es'] = AsyncElasticsearch(
+        [web_app.ES_HOST], verify_certs=False, request_timeout=web_app.ES_REQUEST_TIMEOUT, max_retries=0
+    )
+    clients['mongo'] = AsyncIOMotorClient(**database.client_options())
+    clients['redis'] = aioredis.Redis(
+        host=web_app.REDIS_HOST,
+        port=web_app.REDIS_PORT,
+        decode_responses=True,
+        socket_connect_timeout=5
+    )
+    try:
+        yield
+    finally:
+        await clients['es'].close()
+        clients['mongo'].close()
+        await clients['redis'].aclose()
+
+
+class JSONResponse(StarletteJSONResponse):
+    """JSONResponse encoded with services.json_codec (orjson when installed)"""
+
+    def render(self, content):
+        return json_codec.dumpb(content)
+
+
+def es_unavailable():
+    return JSONResponse({'error': 'Elasticsearch not available'}, status_code=503)
+
+
+def respond(request, payload, status_code=200):
+    """JSON response, compressed if large and tagged by conditional()"""
+    response = JSONResponse(payload, status_code=status_code)
+    response.headers['Vary'] = 'Accept-Encoding'
+    encoding = http_cache.choose_encoding(request.headers.get('accept-encoding'))
+    if http_cache.should_compress('application/json', len(response.body), encoding):
+        with metrics.timed('http.compress_time'):
+            response.body = http_cache.compress(response.body, encoding)
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Content-Length'] = str(len(response.body))
+    etag = getattr(request.state, 'etag', None)
+    if etag and status_code == 200:
+        response.headers['ETag'] = f'W/"{etag}"'
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def skip_etag(request):
+    """Leave the response untagged (degraded or cached data) so polls get it again"""
+    request.state.etag = None
+
+
+def conditional(view):
+    """
+    Answer polls whose ETag still matches with 304 Not Modified, before any query
+
+    Only 200 responses built from fresh data (see skip_etag) are tagged.
+    """
+    @functools.wraps(view)
+    async def decorated(request):
+        try:
+            generation = await web_app.redis_client.call_async(
+                clients['redis'].get, log_queries.GENERATION_KEY
+            )
+        except Exception as e:
+            print(f"Redis generation lookup error: {e}")
+            return await view(request)
+        etag = http_cache.etag(generation, request.url.path, request.url.query)
+        if http_cache.matches(request.headers.get('if-none-match'), etag):
+            metrics.increment('http.not_modified')
+            return Response(status_code=304, headers={'ETag': f'W/"{etag}"'})
+        request.state.etag = etag
+        return await view(request)
+    return decorated
+
+
+def es_search(body):
+    """Search the log indices through the Elasticsearch circuit breaker"""
+    return web_app.es_client.call_async(clients['es'].search, index=log_queries.LOG_INDEX, body=body)
+
+
+async def _check(backend, method, *args):
+    """'healthy' if the call succeeds, 'unhealthy' otherwise"""
+    try:
+        await backend.call_async(method, *args)
+        return 'healthy'
+    except Exception:
+        return 'unhealthy'
+
+
+async def get_stats(request):
+    """Get comprehensive dashboard statistics (queries run concurrently)"""
+    es, mongo, redis_client = clients['es'], clients['mongo'], clients['redis']
+    es_backend, mongo_backend, redis_backend = web_app.es_client, web_app.mongo_client, web_app.redis_client
+    stats = log_queries.empty_stats()
+
+    try:
+        requests = log_queries.stats_requests()
+        *responses, indices = await asyncio.gather(
+            *(
+                es_backend.call_async(getattr(es, method), index=log_queries.LOG_INDEX, body=body)
+                for method, body in requests.values()
+            ),
+            es_backend.call_async(es.cat.indices, index=log_queries.LOG_INDEX, format="json")
+        )
+        log_queries.apply_stats_results(stats, dict(zip(requests, responses)))
+
+        files_uploaded, mongodb_status, redis_status = await asyncio.gather(
+            mongo_backend.call_async(mongo[database.database_name()]['files'].count_documents, {}),
+            _check(mongo_backend, mongo.admin.command, 'ping'),
+            _check(redis_backend, redis_client.ping),
+            return_exceptions=True
+        )
+        if isinstance(files_uploaded, Exception):
+            print(f"MongoDB files count error: {files_uploaded}")
+            skip_etag(request)
+        else:
+            stats['files_uploaded'] = files_uploaded
+
+        stats['system_status'].update(elasticsearch='healthy', mongodb=mongodb_status, redis=redis_status)
+        log_queries.apply_system_status(stats)
+        if stats['system_status']['overall'] != 'healthy':
+            skip_etag(request)
+        stats['indices'] = log_queries.index_summaries(indices)
+
+        # Cache result in Redis for 30 seconds
+        try:
+            await redis_backend.call_async(
+                redis_client.setex, log_queries.STATS_CACHE_KEY, log_queries.STATS_CACHE_TTL, json_codec.dumps(stats)
+            )
+        except Exception as e:
+            print(f"Redis cache error: {e}")
+
+    except Exception as e:
+        stats['error'] = str(e)
+        skip_etag(request)
+        # Try to get cached value from Redis
+        try:
+            cached_stats = await redis_backend.call_async(redis_client.get, log_queries.STATS_CACHE_KEY)
+            if cached_stats:
+                cached_data = json_codec.loads(cached_stats)
+                cached_data['cached'] = True
+                cached_data['cache_error'] = str(e)
+                return respond(request, cached_data)
+        except Exception:
+            pass
+
+    return respond(request, stats)
+
+
+async def comprehensive_search(request):
+    """
+    Comprehensive search endpoint with filters and pagination
+
+    Falls back to searching the uploaded files locally (in a thread) when
+    Elasticsearch is unavailable or "source": "local" is requested.
+    """
+    try:
+        data = await request.json() or {}
+        params = log_queries.parse_search_params(data)
+
+        if data.get('source') != 'local':
+            try:
+                result = await es_search(log_queries.search_body(params))
+                return respond(request, log_queries.search_payload(result, params['page'], params['per_page']))
+            except (ApiError, TransportError, BackendUnavailable) as e:
+                if not log_queries.falls_back_to_local(e):
+                    raise
+                print(f"Elasticsearch search error, searching uploads locally: {e}")
+
+        payload, status = await run_in_threadpool(web_app.local_search_payload, params)
+        return respond(request, payload, status)
+
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+
+async def get_unique_endpoints(request):
+    """Get unique endpoints for filter dropdown"""
+    try:
+        result = await es_search(log_queries.endpoints_body())
+        return respond(request, log_queries.endpoints_payload(result))
+    except (TransportError, BackendUnavailable):
+        return es_unavailable()
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+
+async def get_recent_logs(request):
+    """Get recent logs from Elasticsearch"""
+    try:
+        result = await es_search(log_queries.recent_logs_body())
+        return respond(request, log_queries.recent_logs_payload(result))
+    except (TransportError, BackendUnavailable):
+        return es_unavailable()
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def get_logs_by_level(request):
+    """Get log count grouped by level"""
+    try:
+        result = await es_search(log_queries.levels_body())
+        return respond(request, log_queries.levels_payload(result))
+    except (TransportError, BackendUnavailable):
+        return es_unavailable()
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def search_logs(request):
+    """Search logs with filters and pagination"""
+    try:
+        params = log_queries.parse_log_search_args(request.query_params)
+        result = await es_search(log_queries.log_search_body(params))
+        return respond(request, log_queries.log_search_payload(result, params['page'], params['per_page']))
+    except (TransportError, BackendUnavailable):
+        return es_unavailable()
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/stats', conditional(get_stats)),
+        Route('/api/search', comprehensive_search, methods=['POST']),
+        Route('/api/search/endpoints', conditional(get_unique_endpoints)),
+        Route('/api/logs/recent', conditional(get_recent_logs)),
+        Route('/api/logs/stats/by-level', conditional(get_logs_by_level)),
+        Route('/api/logs/search', conditional(search_logs)),
+        # Everything else: pages, auth, uploads, exports
+        Mount('/', app=WSGIMiddleware(web_app.app, workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan
+)
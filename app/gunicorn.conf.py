@@ -0,0 +1,73 @@
+"""
+Gunicorn configuration for the web app
+
+Usage:
+    gunicorn --config gunicorn.conf.py app:app
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn --config gunicorn.conf.py asgi:app
+
+Settings come from the environment:
+
+    GUNICORN_BIND              address to listen on (default 0.0.0.0:5000)
+    GUNICORN_WORKERS           worker processes (default 2 x CPU cores + 1)
+    GUNICORN_WORKER_CLASS      sync, gthread or gevent (default gthread); for the
+                               asyncio variant (asgi:app) uvicorn.workers.UvicornWorker
+    GUNICORN_THREADS           threads per gthread worker (default 4)
+    GUNICORN_WORKER_CONNECTIONS  concurrent requests per gevent worker (default 1000)
+    GUNICORN_PRELOAD           import the app once in the master (default true,
+                               except for gevent, which must patch before import)
+    GUNICORN_MAX_REQUESTS      recycle a worker after this many requests (default 1000)
+    GUNICORN_TIMEOUT           seconds before a silent worker is killed (default 120)
+    GUNICORN_GRACEFUL_TIMEOUT  seconds workers get to finish on reload/stop (default 30)
+
+Graceful reload: `kill -HUP <master pid>` starts new workers and lets the
+old ones finish their requests. With preload, the master keeps the code
+it imported; to deploy new code without downtime send USR2 (start a new
+master) and then WINCH and QUIT to the old one.
+"""
+import os
+import sys
+import multiprocessing
+
+
+def _bool(name, default):
+    return os.getenv(name, str(default)).lower() == 'true'
+
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# Importing before gevent's monkey patching leaves blocking sockets and locks
+preload_app = _bool('GUNICORN_PRELOAD', worker_class != 'gevent')
+
+# Recycle workers to bound memory growth; jitter avoids restarting all at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max(1, max_requests // 10) if max_requests else 0
+
+# Uploads are spooled to disk within the request
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """Give each worker its own Elasticsearch, MongoDB and Redis clients"""
+    # Without preload the worker imports the app (and creates its clients) itself
+    web_app = sys.modules.get('app')
+    if web_app is not None and hasattr(web_app, 'init_clients'):
+        web_app.init_clients()
+
+
+def worker_exit(server, worker):
+    """Write pending last_login updates before the worker goes away"""
+    write_behind = sys.modules.get('services.write_behind')
+    if write_behind is not None:
+        try:
+            write_behind.buffer.flush()
+        except Exception as e:
+            print(f"Write-behind flush error on worker exit: {e}")
@@ -2,50 +2,53 @@
 User model for authentication and user management
 """
 import os
-import bcrypt
+import copy
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 from bson.objectid import ObjectId
 
+from services import password_hashing, metrics, write_behind, database, migrations
+from services.password_hashing import HashingBusy
+from services.ttl_cache import TTLCache
+
 
 class User:
     """User model with MongoDB integration"""
     
-    # MongoDB connection settings from environment
-    MONGO_HOST = os.getenv('MONGODB_HOST', 'localhost')
-    MONGO_PORT = int(os.getenv('MONGODB_PORT', 27017))
-    MONGO_USER = os.getenv('MONGODB_USER', 'admin')
-    MONGO_PASSWORD = os.getenv('MONGODB_PASSWORD', 'password123')
-    MONGO_DATABASE = os.getenv('MONGODB_DATABASE', 'saas_logs')
+    # Per-process user lookup cache; changes are broadcast to every process
+    # (see broadcast_invalidations), the TTL bounds staleness if that fails
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+    
+    _cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+    _publish_invalidation = None
+    _subscribe = None
     
-    _client = None
-    _db = None
-    _collection = None
+    @classmethod
+    def broadcast_invalidations(cls, publish, subscribe):
+        """
+        Share cache invalidations between processes
+        
+        Args:
+            publish (callable): publish(user_id) tells every process
+                (this one included) to call drop_cached(user_id)
+            subscribe (callable): Makes sure this process receives them;
+                called before a user is cached
+        """
+        cls._publish_invalidation = staticmethod(publish)
+        cls._subscribe = staticmethod(subscribe)
     
     @classmethod
     def _get_collection(cls):
-        """Get or create MongoDB collection connection"""
-        if cls._collection is None:
-            try:
-                cls._client = MongoClient(
-                    host=cls.MONGO_HOST,
-                    port=cls.MONGO_PORT,
-                    username=cls.MONGO_USER,
-                    password=cls.MONGO_PASSWORD,
-                    serverSelectionTimeoutMS=5000
-                )
-                cls._db = cls._client[cls.MONGO_DATABASE]
-                cls._collection = cls._db['users']
-                
-                # Create unique indexes for username and email
-                cls._collection.create_index('username', unique=True)
-                cls._collection.create_index('email', unique=True)
-                
-            except Exception as e:
-                print(f"MongoDB connection error: {e}")
-                raise
+        """
+        The `users` collection on the shared MongoDB pool
         
-        return cls._collection
+        Its unique username/email indexes are created by the migrations
+        (services.migrations), applied before the first query of a process.
+        """
+        db = database.get_database()
+        migrations.run_once(db)
+        return db['users']
     
     @classmethod
     def create(cls, username, email, password):
@@ -63,6 +66,7 @@ class User:
         
         Raises:
             ValueError: If username or email already exists
+            HashingBusy: If the password hashing pool is saturated
             Exception: For other database errors
         """
         try:
@@ -76,39 +80,104 @@ class User:
             if collection.find_one({'email': email}):
                 raise ValueError('Email already exists')
             
-            # Hash the password with bcrypt
-            password_hash = bcrypt.hashpw(
-                password.encode('utf-8'),
-                bcrypt.gensalt()
-            )
+            # Hash the password with bcrypt (in the hashing pool)
+            password_hash = password_hashing.hash_password(password)
             
             # Create user document
-            user_doc = {
-                'username': username,
-                'email': email,
-                'password_hash': password_hash,
-                'created_at': datetime.utcnow(),
-                'updated_at': datetime.utcnow(),
-                'is_active': True,
-                'last_login': None,
-                'profile': {
-                    'display_name': username,
-                    'avatar_url': None
-                }
-            }
+            user_doc = cls._new_document(username, email, password_hash)
             
             # Insert into MongoDB
             result = collection.insert_one(user_doc)
             
             return str(result.inserted_id)
             
-        except ValueError as e:
-            # Re-raise ValueError for duplicate checks
+        except (ValueError, HashingBusy):
+            # Re-raise duplicate checks and overload for the caller
             raise
         except Exception as e:
             print(f"Error creating user: {e}")
             raise Exception(f"Failed to create user: {str(e)}")
     
+    @classmethod
+    def create_many(cls, users):
+        """
+        Create many users at once (bulk import)
+        
+        Passwords are hashed in parallel across cores and users are inserted
+        with one unordered insert_many; duplicates are reported by the
+        unique username/email indexes.
+        
+        Args:
+            users (list): Dicts with 'username', 'email' and 'password'
+        
+        Returns:
+            list: One dict per user, in order: {'username', 'status', 'id'}
+                  with status 'created', or {'username', 'status': 'duplicate',
+                  'field', 'error'}
+        
+        Raises:
+            HashingBusy: If another import is hashing or the hashing pool is saturated
+            Exception: For database errors other than duplicates
+        """
+        if not users:
+            return []
+        collection = cls._get_collection()
+        
+        password_hashes = password_hashing.hash_passwords([user['password'] for user in users])
+        docs = [
+            cls._new_document(user['username'], user['email'], password_hash)
+            for user, password_hash in zip(users, password_hashes)
+        ]
+        
+        failures = {}
+        try:
+            collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                if error.get('code') != 11000:
+                    raise Exception(f"Failed to create users: {error.get('errmsg')}")
+                failures[error['index']] = error
+        
+        results = []
+        for position, (user, doc) in enumerate(zip(users, docs)):
+            if position in failures:
+                field = cls._duplicate_field(failures[position])
+                results.append({
+                    'username': user['username'],
+                    'status': 'duplicate',
+                    'field': field,
+                    'error': f'{field.capitalize()} already exists'
+                })
+            else:
+                results.append({'username': user['username'], 'status': 'created', 'id': str(doc['_id'])})
+        return results
+    
+    @staticmethod
+    def _new_document(username, email, password_hash):
+        """New user document"""
+        return {
+            'username': username,
+            'email': email,
+            'password_hash': password_hash,
+            'created_at': datetime.utcnow(),
+            'updated_at': datetime.utcnow(),
+            'is_active': True,
+            'role': 'user',
+            'last_login': None,
+            'profile': {
+                'display_name': username,
+                'avatar_url': None
+            }
+        }
+    
+    @staticmethod
+    def _duplicate_field(error):
+        """Field ('username' or 'email') a duplicate key error is about"""
+        key = error.get('keyValue') or error.get('keyPattern') or {}
+        if key:
+            return next(iter(key))
+        return 'email' if 'email' in error.get('errmsg', '') else 'username'
+    
     @classmethod
     def authenticate(cls, username, password):
         """
@@ -118,9 +187,15 @@ class User:
             username (str): Username or email
             password (str): Plain text password
         
+        Passwords hashed with another bcrypt cost than the configured one
+        are rehashed on successful login.
+        
         Returns:
             dict: User document (without password_hash) on success
             None: On authentication failure
+        
+        Raises:
+            HashingBusy: If the password hashing pool is saturated
         """
         try:
             collection = cls._get_collection()
@@ -141,15 +216,17 @@ class User:
                 return None
             
             # Verify password
-            if bcrypt.checkpw(
-                password.encode('utf-8'),
-                user['password_hash']
-            ):
-                # Update last login time
-                collection.update_one(
-                    {'_id': user['_id']},
-                    {'$set': {'last_login': datetime.utcnow()}}
-                )
+            if password_hashing.check_password(password, user['password_hash']):
+                # Update last login time (written behind, within seconds)
+                now = datetime.utcnow()
+                rehashed = cls._rehash(password) if password_hashing.needs_rehash(user['password_hash']) else {}
+                if rehashed:
+                    collection.update_one(
+                        {'_id': user['_id']},
+                        {'$set': {**rehashed, 'last_login': now}}
+                    )
+                else:
+                    write_behind.buffer.update(collection, user['_id'], set_fields={'last_login': now})
                 
                 # Remove password hash from returned document
                 user.pop('password_hash', None)
@@ -159,10 +236,78 @@ class User:
             
             return None
             
+        except HashingBusy:
+            raise
         except Exception as e:
             print(f"Authentication error: {e}")
             return None
     
+    @classmethod
+    def _rehash(cls, password):
+        """Fields replacing a hash made with an outdated bcrypt cost (empty if the pool is busy)"""
+        try:
+            password_hash = password_hashing.hash_password(password)
+        except HashingBusy:
+            # Try again at the next login
+            return {}
+        metrics.increment('password_hash.rehashed')
+        return {'password_hash': password_hash, 'updated_at': datetime.utcnow()}
+    
+    @classmethod
+    def _cache_user(cls, user):
+        """Strip the password hash, cache the user and return a copy"""
+        if cls._subscribe is not None:
+            try:
+                cls._subscribe()
+            except Exception as e:
+                print(f"User cache subscription error: {e}")
+        user.pop('password_hash', None)
+        user['_id'] = str(user['_id'])
+        cls._cache.set(user['_id'], user)
+        cls._cache.set(('username', user['username']), user['_id'])
+        cls._cache.set(('email', user['email']), user['_id'])
+        return copy.deepcopy(user)
+    
+    @classmethod
+    def _cached(cls, field, value):
+        """Cached user whose `field` ('_id', 'username', 'email') is `value`"""
+        user_id = value if field == '_id' else cls._cache.get((field, value))
+        user = cls._cache.get(user_id) if user_id else None
+        # The username / email may have changed since the key was cached
+        if user and user.get(field) == value:
+            return copy.deepcopy(user)
+        return None
+    
+    @classmethod
+    def drop_cached(cls, user_id=None):
+        """Drop a user (all users for None) from this process's lookup cache"""
+        if user_id is None:
+            cls._cache.clear()
+        else:
+            cls._cache.delete(str(user_id))
+    
+    @classmethod
+    def invalidate(cls, user_id):
+        """Drop a changed user from the lookup cache of every process"""
+        cls.drop_cached(user_id)
+        if cls._publish_invalidation is not None:
+            try:
+                cls._publish_invalidation(user_id)
+            except Exception as e:
+                print(f"User cache invalidation error: {e}")
+    
+    @classmethod
+    def _get_by(cls, field, value):
+        """Cached lookup by a unique field, falling back to MongoDB"""
+        user = cls._cached(field, value)
+        if user:
+            return user
+        
+        collection = cls._get_collection()
+        query_value = ObjectId(value) if field == '_id' else value
+        user = collection.find_one({field: query_value})
+        return cls._cache_user(user) if user else None
+    
     @classmethod
     def get_by_username(cls, username):
         """
@@ -175,16 +320,7 @@ class User:
             dict: User document (without password_hash) or None
         """
         try:
-            collection = cls._get_collection()
-            
-            user = collection.find_one({'username': username})
-            
-            if user:
-                user.pop('password_hash', None)
-                user['_id'] = str(user['_id'])
-                return user
-            
-            return None
+            return cls._get_by('username', username)
             
         except Exception as e:
             print(f"Error getting user: {e}")
@@ -202,16 +338,7 @@ class User:
             dict: User document (without password_hash) or None
         """
         try:
-            collection = cls._get_collection()
-            
-            user = collection.find_one({'_id': ObjectId(user_id)})
-            
-            if user:
-                user.pop('password_hash', None)
-                user['_id'] = str(user['_id'])
-                return user
-            
-            return None
+            return cls._get_by('_id', str(user_id))
             
         except Exception as e:
             print(f"Error getting user by ID: {e}")
@@ -229,21 +356,44 @@ class User:
             dict: User document (without password_hash) or None
         """
         try:
-            collection = cls._get_collection()
-            
-            user = collection.find_one({'email': email})
-            
-            if user:
-                user.pop('password_hash', None)
-                user['_id'] = str(user['_id'])
-                return user
-            
-            return None
+            return cls._get_by('email', email)
             
         except Exception as e:
             print(f"Error getting user by email: {e}")
             return None
     
+    @classmethod
+    def get_many(cls, user_ids):
+        """
+        Get many users by ID with at most one MongoDB query
+        
+        Args:
+            user_ids (iterable): User IDs (ObjectId strings); invalid or
+                unknown IDs are left out of the result
+        
+        Returns:
+            dict: User documents (without password_hash) by ID
+        """
+        users = {}
+        missing = set()
+        for user_id in {str(user_id) for user_id in user_ids if user_id}:
+            user = cls._cached('_id', user_id)
+            if user:
+                users[user_id] = user
+            elif ObjectId.is_valid(user_id):
+                missing.add(ObjectId(user_id))
+        
+        if not missing:
+            return users
+        try:
+            collection = cls._get_collection()
+            for user in collection.find({'_id': {'$in': list(missing)}}):
+                user = cls._cache_user(user)
+                users[user['_id']] = user
+        except Exception as e:
+            print(f"Error getting users: {e}")
+        return users
+    
     @classmethod
     def update(cls, user_id, update_data):
         """
@@ -260,7 +410,7 @@ class User:
             collection = cls._get_collection()
             
             # Don't allow updating sensitive fields directly
-            forbidden_fields = ['password_hash', '_id', 'created_at']
+            forbidden_fields = ['password_hash', '_id', 'created_at', 'role']
             for field in forbidden_fields:
                 update_data.pop(field, None)
             
@@ -271,6 +421,7 @@ class User:
                 {'_id': ObjectId(user_id)},
                 {'$set': update_data}
             )
+            cls.invalidate(user_id)
             
             return result.modified_count > 0
             
@@ -290,6 +441,9 @@ class User:
         
         Returns:
             bool: True on success, False on failure
+        
+        Raises:
+            HashingBusy: If the password hashing pool is saturated
         """
         try:
             collection = cls._get_collection()
@@ -301,17 +455,11 @@ class User:
                 return False
             
             # Verify old password
-            if not bcrypt.checkpw(
-                old_password.encode('utf-8'),
-                user['password_hash']
-            ):
+            if not password_hashing.check_password(old_password, user['password_hash']):
                 return False
             
             # Hash new password
-            new_password_hash = bcrypt.hashpw(
-                new_password.encode('utf-8'),
-                bcrypt.gensalt()
-            )
+            new_password_hash = password_hashing.hash_password(new_password)
             
             # Update password
             result = collection.update_one(
@@ -323,9 +471,12 @@ class User:
                     }
                 }
             )
+            cls.invalidate(user_id)
             
             return result.modified_count > 0
             
+        except HashingBusy:
+            raise
         except Exception as e:
             print(f"Error changing password: {e}")
             return False
@@ -353,6 +504,7 @@ class User:
                     }
                 }
             )
+            cls.invalidate(user_id)
             
             return result.modified_count > 0
             
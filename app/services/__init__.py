@@ -0,0 +1,24 @@
+"""Services package for SaaS Monitoring Platform"""
+from .ingestion import ingest_file, count_records
+from .ingest_jobs import run_ingest_job
+from . import chunked_upload
+from . import ingest_queue
+from . import dedup
+from . import file_formats
+from . import bulk_load
+from . import file_indices
+from . import upload_catalog
+from . import local_search
+from . import metrics
+from . import password_hashing
+from . import session_store
+from . import write_behind
+from . import rate_limit
+from . import database
+from . import migrations
+from . import log_queries
+from . import backends
+from . import http_cache
+from . import json_codec
+
+__all__ = ['ingest_file', 'count_records', 'run_ingest_job', 'chunked_upload', 'ingest_queue', 'dedup', 'file_formats', 'bulk_load', 'file_indices', 'upload_catalog', 'local_search', 'metrics', 'password_hashing', 'session_store', 'write_behind', 'rate_limit', 'database', 'migrations', 'log_queries', 'backends', 'http_cache', 'json_codec']
@@ -0,0 +1,387 @@
+"""
+Lazily connected backends with circuit breakers and retry budgets
+
+A Backend stands in for an Elasticsearch, MongoDB or Redis client. The
+client is created on first use in each process, so importing the app
+never waits on a backend. Every call made through it (also on namespaced
+clients, databases, collections, cursors, pipelines and scripts) goes
+through a circuit breaker:
+
+- closed: calls go through; BREAKER_FAILURE_THRESHOLD consecutive
+  connection failures or timeouts open the circuit
+- open: calls fail at once with BackendUnavailable, and the Backend is
+  falsy, so `if not es_client:` checks answer without waiting on a dead
+  service; after BREAKER_RESET_TIMEOUT seconds the circuit is half-open
+- half-open: one trial call goes through; success closes the circuit,
+  failure opens it again
+
+Transient failures are retried (at most BACKEND_MAX_RETRIES times) only
+within a retry budget: RETRY_BUDGET_RATIO of the calls of the last
+RETRY_BUDGET_WINDOW seconds, plus RETRY_BUDGET_MIN_PER_SECOND, so that
+retries cannot multiply the load on a struggling backend. Iterating a
+guarded cursor fetches ITER_BATCH items per call; such calls, and calls
+flagged by `no_retry` (e.g. a pipeline's execute(), whose command stack
+is cleared when it fails), are never retried. Methods flagged by `local`
+(e.g. queueing a pipeline command) do not reach the backend and bypass
+the breaker.
+"""
+import os
+import math
+import time
+import random
+import itertools
+import threading
+
+from . import metrics
+
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', 30))
+BACKEND_MAX_RETRIES = int(os.getenv('BACKEND_MAX_RETRIES', 2))
+RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', 0.1))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('RETRY_BUDGET_MIN_PER_SECOND', 1))
+RETRY_BUDGET_WINDOW = 10  # seconds
+RETRY_BACKOFF = 0.05  # seconds before the first retry, doubled for each next one
+ITER_BATCH = 100  # items fetched per call when iterating a guarded cursor
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+# Values of the circuit.<name>.state gauge
+_STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class BackendUnavailable(Exception):
+    """Raised instead of calling a backend whose circuit is open"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f'{name} unavailable, retry in {retry_after}s')
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed / open / half-open state of one backend (thread-safe)"""
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or BREAKER_FAILURE_THRESHOLD
+        self.reset_timeout = BREAKER_RESET_TIMEOUT if reset_timeout is None else reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False  # a half-open trial call is in flight
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def available(self):
+        """Whether a call would be let through now"""
+        with self._lock:
+            state = self._current_state()
+            return state == CLOSED or (state == HALF_OPEN and not self._trial)
+
+    def retry_after(self):
+        """Seconds until the circuit lets a call through again"""
+        with self._lock:
+            if self._current_state() != OPEN:
+                return 1
+            return max(1, math.ceil(self.reset_timeout - (time.monotonic() - self._opened_at)))
+
+    def allow(self):
+        """
+        Take permission for one call
+
+        Raises:
+            BackendUnavailable: If the circuit is open, or half-open with
+                its trial call still in flight
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and not self._trial:
+                self._set_state(HALF_OPEN)
+                self._trial = True
+                return
+        metrics.increment(f'circuit.{self.name}.rejected')
+        raise BackendUnavailable(self.name, self.retry_after())
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state != CLOSED:
+                print(f"Circuit for {self.name} closed")
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                print(f"Circuit for {self.name} opened after {self._failures} failure(s)")
+                metrics.increment(f'circuit.{self.name}.opened')
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def _set_state(self, state):
+        self._state = state
+        self._trial = False
+        metrics.set_gauge(f'circuit.{self.name}.state', _STATE_GAUGE[state])
+
+
+class RetryBudget:
+    """Caps retries to a share of recent calls (thread-safe)"""
+
+    def __init__(self, ratio=None, min_per_second=None, window=None):
+        self.ratio = RETRY_BUDGET_RATIO if ratio is None else ratio
+        self.min_per_second = RETRY_BUDGET_MIN_PER_SECOND if min_per_second is None else min_per_second
+        self.window = window or RETRY_BUDGET_WINDOW
+        self._lock = threading.Lock()
+        self._calls = {}  # second -> calls
+        self._retries = {}  # second -> retries
+
+    def _prune(self, now):
+        oldest = now - self.window
+        for counts in (self._calls, self._retries):
+            for second in [second for second in counts if second <= oldest]:
+                del counts[second]
+
+    def record_call(self):
+        now = int(time.monotonic())
+        with self._lock:
+            if now not in self._calls:
+                self._prune(now)
+            self._calls[now] = self._calls.get(now, 0) + 1
+
+    def can_retry(self):
+        """Take one retry from the budget if any is left"""
+        now = int(time.monotonic())
+        with self._lock:
+            self._prune(now)
+            allowed = self.min_per_second * self.window + self.ratio * sum(self._calls.values())
+            if sum(self._retries.values()) >= allowed:
+                return False
+            self._retries[now] = self._retries.get(now, 0) + 1
+            return True
+
+
+def _backoff(attempt):
+    return RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+class Backend:
+    """
+    Lazily created client guarded by a circuit breaker and a retry budget
+
+    Args:
+        name (str): Service name used in errors and metrics
+        connect (callable): Creates the client; called once per process
+        setup (callable): Run with the client before its first call in each
+            process (index templates, migrations); retried while it fails
+            with a backend failure
+        is_failure (callable): Whether an exception means the backend is
+            unreachable or failing (counts against the breaker)
+        is_retryable (callable): Whether such a failure may be retried
+        wrap (callable): Whether an attribute or return value (namespaced
+            client, database, collection, cursor, pipeline) should be
+            guarded as well
+        no_retry (callable): Whether a guarded method must not be retried
+        local (callable): Whether a guarded method does not reach the
+            backend (e.g. queues a pipeline command) and so bypasses the
+            breaker, which would otherwise count it as a success
+    """
+
+    def __init__(self, name, connect, setup=None, is_failure=None, is_retryable=None, wrap=None,
+                 no_retry=None, local=None):
+        self.name = name
+        self._connect = connect
+        self._setup = setup
+        self._is_failure = is_failure or (lambda error: False)
+        self._is_retryable = is_retryable or (lambda error: False)
+        self._wrap = wrap or (lambda value: False)
+        self._no_retry = no_retry or (lambda method: False)
+        self._local = local or (lambda method: False)
+        self._lock = threading.Lock()
+        self._setup_lock = threading.Lock()
+        self._client = None
+        self._pid = None
+        self._setup_done = False
+        self.breaker = CircuitBreaker(name)
+        self.retry_budget = RetryBudget()
+
+    def reset(self):
+        """Drop this process's client and breaker state; the next call connects again"""
+        with self._lock:
+            self._client = None
+            self._pid = None
+            self._setup_done = False
+            self.breaker = CircuitBreaker(self.name)
+            self.retry_budget = RetryBudget()
+
+    @property
+    def client(self):
+        """The underlying client, created on first use in this process"""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._client = self._connect()
+                    self._setup_done = self._setup is None
+                    self._pid = pid
+        return self._client
+
+    def __bool__(self):
+        return self.breaker.available()
+
+    def __getattr__(self, name):
+        return _guard(self, getattr(self.client, name))
+
+    def __getitem__(self, key):
+        return _guard(self, self.client[key])
+
+    def _ensure_setup(self):
+        client = self.client
+        # One thread runs the setup; the others go ahead rather than queue behind it
+        if self._setup_done or not self._setup_lock.acquire(blocking=False):
+            return
+        try:
+            if self._setup_done:
+                return
+            try:
+                self._setup(client)
+            except Exception as e:
+                if self._is_failure(e):
+                    raise
+                # Not a connectivity problem: log it, as it would fail the same way again
+                print(f"{self.name} setup error: {e}")
+            self._setup_done = True
+        finally:
+            self._setup_lock.release()
+
+    def _failed(self, error, attempt, retry=True):
+        """Count a failed attempt; True if it should be retried"""
+        if not self._is_failure(error):
+            # The backend answered (e.g. a 404 or a duplicate key)
+            self.breaker.record_success()
+            return False
+        self.breaker.record_failure()
+        if not retry or attempt >= BACKEND_MAX_RETRIES or not self._is_retryable(error) or self.breaker.state != CLOSED:
+            return False
+        if not self.retry_budget.can_retry():
+            metrics.increment(f'backend.{self.name}.retry_budget_exhausted')
+            return False
+        metrics.increment(f'backend.{self.name}.retries')
+        return True
+
+    def call(self, method, *args, **kwargs):
+        """
+        Call a method of the client (or of a part of it) through the breaker
+
+        Raises:
+            BackendUnavailable: If the circuit is open
+            Exception: What the method raised, once retries are exhausted
+        """
+        return self._call(method, args, kwargs, retry=True)
+
+    def call_once(self, method, *args, **kwargs):
+        """call() without retries, for calls that cannot be repeated safely"""
+        return self._call(method, args, kwargs, retry=False)
+
+    def _call(self, method, args, kwargs, retry):
+        self.retry_budget.record_call()
+        for attempt in itertools.count():
+            self.breaker.allow()
+            try:
+                self._ensure_setup()
+                result = method(*args, **kwargs)
+            except Exception as e:
+                if not self._failed(e, attempt, retry):
+                    raise
+                time.sleep(_backoff(attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, method, *args, **kwargs):
+        """call() for a coroutine method of an asyncio client of the same service"""
+        import asyncio
+
+        self.retry_budget.record_call()
+        for attempt in itertools.count():
+            self.breaker.allow()
+            try:
+                result = await method(*args, **kwargs)
+            except Exception as e:
+                if not self._failed(e, attempt):
+                    raise
+                await asyncio.sleep(_backoff(attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+
+class _Guarded:
+    """Part of a backend client (namespaced client, database, collection, cursor, pipeline, script)"""
+
+    __slots__ = ('_backend', '_target')
+
+    def __init__(self, backend, target):
+        self._backend = backend
+        self._target = target
+
+    def __getattr__(self, name):
+        return _guard(self._backend, getattr(self._target, name))
+
+    def __getitem__(self, key):
+        return _guard(self._backend, self._target[key])
+
+    def __call__(self, *args, **kwargs):
+        # Registered scripts
+        call = self._backend.call_once if self._backend._no_retry(self._target) else self._backend.call
+        return call(self._target, *args, **kwargs)
+
+    def __iter__(self):
+        # Cursors: fetch in batches, each one a call (a cursor cannot rewind to retry)
+        iterator = iter(self._target)
+        while True:
+            batch = self._backend.call_once(_take, iterator, ITER_BATCH)
+            yield from batch
+            if len(batch) < ITER_BATCH:
+                return
+
+    def __repr__(self):
+        return f'Guarded({self._target!r})'
+
+
+def _call_directly(method, *args, **kwargs):
+    return method(*args, **kwargs)
+
+
+def _take(iterator, count):
+    return list(itertools.islice(iterator, count))
+
+
+def _guard(backend, value):
+    """Route calls on `value` through the backend's breaker"""
+    if backend._wrap(value):
+        return _Guarded(backend, value)
+    if callable(value):
+        if backend._local(value):
+            call = _call_directly
+        else:
+            call = backend.call_once if backend._no_retry(value) else backend.call
+
+        def guarded(*args, **kwargs):
+            result = call(value, *args, **kwargs)
+            return _Guarded(backend, result) if backend._wrap(result) else result
+        return guarded
+    return value
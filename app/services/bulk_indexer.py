@@ -0,0 +1,258 @@
+"""
+Adaptive bulk indexing with backpressure
+
+Sends bulk requests whose size and concurrency follow the cluster's
+response times. Batches and in-flight requests grow while `took` stays
+under the target. When Elasticsearch rejects work (HTTP 429 /
+es_rejected_execution_exception), concurrency is halved. Whenever items
+have to be retried (rejections, 502/503/504, connection errors), new
+requests pause with exponential backoff, which is only reset by a clean
+response to a request sent after the pause. Only the failed items of a
+bulk response are re-sent.
+"""
+import os
+import json
+import time
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from elasticsearch import ApiError, TransportError
+
+
+# Limits for the adaptive batch size / concurrency
+INGEST_MIN_CHUNK_SIZE = int(os.getenv('INGEST_MIN_CHUNK_SIZE', 100))
+INGEST_MAX_CHUNK_SIZE = int(os.getenv('INGEST_MAX_CHUNK_SIZE', 10000))
+INGEST_MAX_THREAD_COUNT = int(os.getenv('INGEST_MAX_THREAD_COUNT', 8))
+INGEST_MAX_CHUNK_BYTES = int(os.getenv('INGEST_MAX_CHUNK_BYTES', 10 * 1024 * 1024))
+
+# Bulk requests faster than this (ES `took`) let the indexer grow
+INGEST_TARGET_TOOK_MS = int(os.getenv('INGEST_TARGET_TOOK_MS', 1000))
+INGEST_MAX_BACKOFF = float(os.getenv('INGEST_MAX_BACKOFF', 30.0))
+
+# Item / request statuses worth retrying (429 = ES thread pool rejection)
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+
+# Seconds of completed requests used for the throughput figure
+THROUGHPUT_WINDOW = 10.0
+
+
+def is_retryable(info):
+    """Check whether a failed bulk item should be retried"""
+    status = info.get('status')
+    return status in RETRYABLE_STATUSES or not isinstance(status, int)
+
+
+def is_rejection(info):
+    """Check whether a failed bulk item was rejected because ES is overloaded"""
+    error = info.get('error')
+    error_type = error.get('type') if isinstance(error, dict) else None
+    return info.get('status') == 429 or error_type == 'es_rejected_execution_exception'
+
+
+class AdaptiveBulkIndexer:
+    """
+    Bulk sender that adapts batch size and concurrency to the cluster
+
+    Actions are dicts with '_index', '_id' and '_source' (a dict or a
+    pre-serialized JSON string). All adaptation happens on the calling
+    thread; worker threads only send requests.
+    """
+
+    def __init__(self, es_client, chunk_size, thread_count, max_retries, retry_backoff,
+                 max_chunk_size=None, max_thread_count=None, target_took_ms=None):
+        self.es_client = es_client
+        self.max_chunk_size = max_chunk_size or INGEST_MAX_CHUNK_SIZE
+        self.max_thread_count = max(max_thread_count or INGEST_MAX_THREAD_COUNT, thread_count)
+        self.chunk_size = max(INGEST_MIN_CHUNK_SIZE, min(chunk_size, self.max_chunk_size))
+        self.thread_count = max(1, min(thread_count, self.max_thread_count))
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.target_took_ms = target_took_ms or INGEST_TARGET_TOOK_MS
+
+        self.backoff = 0.0
+        self.resume_at = 0.0
+        # Bumped on every backoff; failures of requests sent before it belong
+        # to the same overload and do not shrink or pause the indexer again
+        self.generation = 0
+        self.last_took_ms = None
+        self.requests = 0
+        self.rejections = 0
+        self.retried = 0
+        self.request_seconds = 0.0  # summed over concurrent requests
+        self._completed = deque()  # (monotonic time, documents indexed)
+
+    def stats(self):
+        """Current batch size, concurrency, throughput and rejection counters"""
+        now = time.monotonic()
+        while self._completed and now - self._completed[0][0] > THROUGHPUT_WINDOW:
+            self._completed.popleft()
+        span = now - self._completed[0][0] if self._completed else 0
+        indexed = sum(count for _, count in self._completed)
+        return {
+            'docs_per_sec': round(indexed / max(span, 1.0), 1),
+            'chunk_size': self.chunk_size,
+            'thread_count': self.thread_count,
+            'last_took_ms': self.last_took_ms,
+            'backoff_seconds': round(self.backoff, 2),
+            'requests': self.requests,
+            'rejections': self.rejections,
+            'retried': self.retried,
+            'request_ms': int(self.request_seconds * 1000)
+        }
+
+    def index(self, actions):
+        """
+        Index a stream of actions
+
+        Yields:
+            tuple: (documents indexed, list of failed item infos) for every
+                   completed bulk request; failed items are final
+        """
+        source = iter(actions)
+        retries = deque()  # (action, attempt), sent before new actions
+        in_flight = {}
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=self.max_thread_count) as pool:
+            while True:
+                while len(in_flight) < self.thread_count and time.monotonic() >= self.resume_at:
+                    batch, exhausted = self._next_batch(retries, source, exhausted)
+                    if not batch:
+                        break
+                    in_flight[pool.submit(self._send, batch)] = (batch, self.generation)
+
+                if not in_flight:
+                    if exhausted and not retries:
+                        return
+                    # Backing off before the next request
+                    time.sleep(max(self.resume_at - time.monotonic(), 0.01))
+                    continue
+
+                # Wake up when a backoff pause ends, to refill free slots
+                pause = self.resume_at - time.monotonic()
+                timeout = pause if pause > 0 else None
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch, generation = in_flight.pop(future)
+                    yield self._handle(batch, generation, *future.result(), retries)
+
+    def _next_batch(self, retries, source, exhausted):
+        """Take up to chunk_size actions (retries first), capped in bytes"""
+        batch = []
+        size = 0
+        while len(batch) < self.chunk_size and size < INGEST_MAX_CHUNK_BYTES:
+            if retries:
+                entry = retries.popleft()
+            elif not exhausted:
+                action = next(source, None)
+                if action is None:
+                    exhausted = True
+                    continue
+                if not isinstance(action['_source'], str):
+                    action['_source'] = json.dumps(action['_source'], separators=(',', ':'))
+                entry = (action, 0)
+            else:
+                break
+            batch.append(entry)
+            size += len(entry[0]['_source'])
+        return batch, exhausted
+
+    def _send(self, batch):
+        """Send one bulk request (worker thread), returning (body, error, seconds)"""
+        started = time.monotonic()
+        operations = []
+        for action, _ in batch:
+            operations.append({'index': {'_index': action['_index'], '_id': action['_id']}})
+            operations.append(action['_source'])
+        try:
+            response = self.es_client.bulk(
+                operations=operations,
+                filter_path='took,errors,items.*.status,items.*.error'
+            )
+            return response.body, None, time.monotonic() - started
+        except (ApiError, TransportError) as e:
+            return None, e, time.monotonic() - started
+
+    def _handle(self, batch, generation, body, error, seconds, retries):
+        """Count outcomes of a bulk request, queue retries and adapt"""
+        self.requests += 1
+        self.request_seconds += seconds
+        failed = []
+        indexed = 0
+        rejected = False
+        too_large = False
+        queued = len(retries)
+
+        if error is not None:
+            status = getattr(error, 'status_code', None)
+            too_large = status == 413
+            if too_large and self.chunk_size > INGEST_MIN_CHUNK_SIZE:
+                # Request too large: retry in smaller batches
+                self.chunk_size = max(INGEST_MIN_CHUNK_SIZE, self.chunk_size // 2)
+            info = {'status': status, 'error': str(error)}
+            rejected = is_rejection(info) or not isinstance(status, int)
+            for action, attempt in batch:
+                self._retry_or_fail(action, attempt, dict(info, _id=action['_id']), retries, failed, too_large)
+        else:
+            self.last_took_ms = body.get('took')
+            items = body.get('items', [])
+            for (action, attempt), item in zip(batch, items):
+                info = next(iter(item.values()), {})
+                if info.get('status', 500) < 300:
+                    indexed += 1
+                    continue
+                info['_id'] = action['_id']
+                rejected = rejected or is_rejection(info)
+                self._retry_or_fail(action, attempt, info, retries, failed)
+
+        current = generation == self.generation
+        if rejected:
+            if current:
+                self._slow_down()
+        elif len(retries) > queued and not too_large:
+            if current:
+                self._back_off()
+        elif error is None and current:
+            self._speed_up()
+
+        if indexed:
+            self._completed.append((time.monotonic(), indexed))
+        return indexed, failed
+
+    def _retry_or_fail(self, action, attempt, info, retries, failed, force_retry=False):
+        if attempt < self.max_retries and (force_retry or is_retryable(info)):
+            self.retried += 1
+            retries.append((action, attempt + 1))
+        else:
+            failed.append(info)
+
+    def _slow_down(self):
+        """Halve concurrency (then batch size) and pause new requests"""
+        self.rejections += 1
+        if self.thread_count > 1:
+            self.thread_count //= 2
+        else:
+            self.chunk_size = max(INGEST_MIN_CHUNK_SIZE, self.chunk_size // 2)
+        self._back_off()
+
+    def _back_off(self):
+        """Pause new requests, twice as long as the previous pause"""
+        self.generation += 1
+        self.backoff = min(self.backoff * 2 if self.backoff else self.retry_backoff, INGEST_MAX_BACKOFF)
+        # Jitter keeps parallel workers from retrying in lockstep
+        self.resume_at = time.monotonic() + self.backoff * random.uniform(0.5, 1.0)
+
+    def _speed_up(self):
+        """Grow batch size, then concurrency, while requests stay fast"""
+        # Sent after the last pause and nothing to retry: the overload is over
+        self.backoff = 0.0
+        took = self.last_took_ms
+        if took is None:
+            return
+        if took < self.target_took_ms:
+            if self.chunk_size < self.max_chunk_size:
+                self.chunk_size = min(self.max_chunk_size, int(self.chunk_size * 1.5))
+            elif self.thread_count < self.max_thread_count:
+                self.thread_count += 1
+        elif took > 2 * self.target_took_ms:
+            self.chunk_size = max(INGEST_MIN_CHUNK_SIZE, int(self.chunk_size * 0.75))
@@ -0,0 +1,170 @@
+"""
+Bulk-load mode for large ingests
+
+While a large upload is indexed, its target daily indices run with
+`refresh_interval: -1` and no replicas. The original settings are
+recorded in the MongoDB `bulk_load_indices` collection before anything is
+changed, and restored (followed by a refresh) when the last ingest using
+the index finishes. Each ingest holds a lease on the index; leases left
+behind by crashed workers expire and are restored by recover_stale().
+"""
+import os
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+
+from .batch_parser import INDEX_PREFIX
+
+
+# Uploads with at least this many rows are ingested in bulk-load mode (0 disables)
+BULK_LOAD_MIN_ROWS = int(os.getenv('INGEST_BULK_LOAD_MIN_ROWS', 100000))
+# Force-merge indices of past days once their bulk load is over
+BULK_LOAD_FORCE_MERGE = os.getenv('INGEST_BULK_LOAD_FORCE_MERGE', 'false').lower() == 'true'
+# Seconds an ingest may go without renewing its lease before it is considered dead
+BULK_LOAD_LEASE = int(os.getenv('INGEST_BULK_LOAD_LEASE', 3600))
+
+BULK_LOAD_SETTINGS = {'refresh_interval': '-1', 'number_of_replicas': 0}
+
+
+def should_use(log_count):
+    """Check whether an upload is large enough for bulk-load mode"""
+    return BULK_LOAD_MIN_ROWS > 0 and (log_count or 0) >= BULK_LOAD_MIN_ROWS
+
+
+def _now():
+    return datetime.utcnow()
+
+
+def _read_settings(es_client, index):
+    """Current refresh_interval / number_of_replicas of an index"""
+    response = es_client.indices.get_settings(
+        index=index,
+        include_defaults=True,
+        flat_settings=True,
+        filter_path='*.settings,*.defaults'
+    )
+    data = next(iter(response.body.values()), {})
+    merged = {**data.get('defaults', {}), **data.get('settings', {})}
+    refresh_interval = merged.get('index.refresh_interval')
+    if refresh_interval == BULK_LOAD_SETTINGS['refresh_interval']:
+        # Still tuned by a bulk load that has just finished: restore the default
+        refresh_interval = None
+    replicas = merged.get('index.number_of_replicas')
+    return {
+        'refresh_interval': refresh_interval,
+        'number_of_replicas': int(replicas) if replicas is not None else None
+    }
+
+
+def _restore(es_client, index, original):
+    """Put back the original settings, refresh and optionally force-merge"""
+    es_client.indices.put_settings(index=index, settings={'index': original})
+    es_client.indices.refresh(index=index)
+    if BULK_LOAD_FORCE_MERGE and index < f"{INDEX_PREFIX}-{_now().strftime('%Y.%m.%d')}":
+        # Past days no longer receive live logs
+        es_client.indices.forcemerge(index=index, max_num_segments=1, wait_for_completion=False)
+
+
+class BulkLoadSession:
+    """Bulk-load mode for the indices one ingest writes to"""
+
+    def __init__(self, es_client, state_collection, file_id):
+        self.es_client = es_client
+        self.state_collection = state_collection
+        self.file_id = file_id
+        self.indices = set()
+
+    def prepare(self, index):
+        """Switch an index to bulk-load settings before the first write to it"""
+        if index in self.indices:
+            return
+        self.indices.add(index)
+
+        try:
+            state = self.state_collection.find_one_and_update(
+                {'_id': index},
+                {
+                    '$set': {f'holders.{self.file_id}': _now() + timedelta(seconds=BULK_LOAD_LEASE)},
+                    '$setOnInsert': {'started_at': _now()}
+                },
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+            if state is not None:
+                # Already in bulk-load mode for another ingest
+                return
+
+            # Create the index so templates and defaults apply, then record
+            # its settings before changing them
+            self.es_client.options(ignore_status=400).indices.create(index=index)
+            original = _read_settings(self.es_client, index)
+            self.state_collection.update_one({'_id': index}, {'$set': {'original': original}})
+            self.es_client.indices.put_settings(index=index, settings={'index': BULK_LOAD_SETTINGS})
+        except Exception as e:
+            # Bulk-load mode is an optimization only: keep indexing
+            print(f"Bulk-load mode error for {index}: {e}")
+
+    def touch(self):
+        """Renew this ingest's lease on its indices"""
+        if not self.indices:
+            return
+        try:
+            self.state_collection.update_many(
+                {'_id': {'$in': list(self.indices)}, f'holders.{self.file_id}': {'$exists': True}},
+                {'$set': {f'holders.{self.file_id}': _now() + timedelta(seconds=BULK_LOAD_LEASE)}}
+            )
+        except Exception as e:
+            print(f"Bulk-load lease error for {self.file_id}: {e}")
+
+    def finish(self):
+        """Release the indices, restoring those no other ingest still holds"""
+        restored = 0
+        for index in sorted(self.indices):
+            try:
+                self.state_collection.update_one({'_id': index}, {'$unset': {f'holders.{self.file_id}': ''}})
+                restored += release(self.es_client, self.state_collection, index)
+            except Exception as e:
+                print(f"Bulk-load restore error for {index}: {e}")
+        if restored:
+            print(f"Bulk-load mode ended for {restored} index(es) of {self.file_id}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish()
+        return False
+
+
+def release(es_client, state_collection, index):
+    """Restore an index if it has no holders left"""
+    state = state_collection.find_one({'_id': index})
+    if not state or state.get('holders'):
+        return False
+    if 'original' in state:
+        _restore(es_client, index, state['original'])
+    state_collection.delete_one({'_id': index, 'holders': state.get('holders', {})})
+    return True
+
+
+def recover_stale(es_client, state_collection):
+    """
+    Drop expired leases and restore indices no live ingest holds
+
+    Returns:
+        int: Number of indices restored
+    """
+    restored = 0
+    now = _now()
+    for state in state_collection.find({}):
+        expired = {
+            f'holders.{file_id}': '' for file_id, lease in state.get('holders', {}).items()
+            if lease < now
+        }
+        try:
+            if expired:
+                state_collection.update_one({'_id': state['_id']}, {'$unset': expired})
+            if release(es_client, state_collection, state['_id']):
+                restored += 1
+        except Exception as e:
+            print(f"Bulk-load recovery error for {state['_id']}: {e}")
+    return restored
@@ -0,0 +1,294 @@
+"""
+Resumable chunked uploads
+
+Large files are uploaded in fixed-size chunks addressed by byte offset.
+Each chunk is written straight into the pre-allocated target file with
+positional writes, so chunks may arrive in any order and in parallel.
+Each chunk is hashed as it is written (dedup.DIGEST_BLOCK_SIZE blocks),
+so completing an upload combines the stored block digests instead of
+re-reading the file. Upload state (metadata, the set of received chunks
+and their block digests) lives in Redis.
+
+Partial files are tracked in the EXPIRY_KEY sorted set, scored by when
+their session expires; remove_expired() deletes the files of sessions
+that were abandoned (it runs when a session is created and from the
+ingestion worker's supervisor).
+"""
+import os
+import time
+import uuid
+
+from . import json_codec
+from .dedup import ContentDigest, DIGEST_BLOCK_SIZE, combine_block_digests
+
+
+CHUNK_SIZE = int(os.getenv('CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))  # 8MB
+# Chunks hold whole digest blocks
+CHUNK_SIZE = max(1, -(-CHUNK_SIZE // DIGEST_BLOCK_SIZE)) * DIGEST_BLOCK_SIZE
+MAX_UPLOAD_SIZE = int(os.getenv('CHUNKED_UPLOAD_MAX_SIZE', 10 * 1024 * 1024 * 1024))  # 10GB
+SESSION_TTL = int(os.getenv('CHUNKED_UPLOAD_TTL', 24 * 60 * 60))  # 24 hours
+
+# Size of the blocks streamed from the request body to disk
+WRITE_BLOCK_SIZE = 1024 * 1024
+
+# Partial file path -> time its session expires
+EXPIRY_KEY = 'chunked_upload:expiry'
+# Expired files removed per remove_expired() call
+EXPIRED_BATCH = 100
+
+
+def _meta_key(upload_id):
+    return f'chunked_upload:{upload_id}'
+
+
+def _chunks_key(upload_id):
+    return f'chunked_upload:{upload_id}:chunks'
+
+
+def _digests_key(upload_id):
+    return f'chunked_upload:{upload_id}:digests'
+
+
+def _completing_key(upload_id):
+    return f'chunked_upload:{upload_id}:completing'
+
+
+class CompletionInProgress(Exception):
+    """Another request is already completing the same upload"""
+
+
+def chunk_count(total_size, chunk_size):
+    """Number of chunks needed for a file of `total_size` bytes"""
+    return max(1, (total_size + chunk_size - 1) // chunk_size)
+
+
+def create_session(redis_client, upload_folder, original_filename, total_size, sha256=None):
+    """
+    Start a chunked upload and pre-allocate the target file
+
+    Args:
+        redis_client (redis.Redis): Redis connection
+        upload_folder (str): Directory uploads are stored in
+        original_filename (str): Sanitised client filename
+        total_size (int): Final file size in bytes
+        sha256 (str): Optional content digest (see dedup) verified on completion
+
+    Returns:
+        dict: Upload session metadata
+
+    Raises:
+        ValueError: If the declared size is invalid
+    """
+    if total_size <= 0:
+        raise ValueError('total_size must be a positive number of bytes')
+    if total_size > MAX_UPLOAD_SIZE:
+        raise ValueError(f'File exceeds the maximum upload size of {MAX_UPLOAD_SIZE} bytes')
+
+    try:
+        remove_expired(redis_client)
+    except Exception as e:
+        print(f"Expired chunked upload cleanup error: {e}")
+
+    upload_id = str(uuid.uuid4())
+    # The upload ID keeps same-named uploads started in the same second apart
+    saved_filename = f"{int(time.time())}_{upload_id}_{original_filename}"
+    file_path = os.path.join(upload_folder, saved_filename)
+
+    # Track the file before creating it, so it is cleaned up if abandoned
+    redis_client.zadd(EXPIRY_KEY, {file_path: time.time() + SESSION_TTL})
+
+    # Pre-allocate (sparse) so chunks can be written at any offset
+    with open(file_path, 'wb') as f:
+        f.truncate(total_size)
+
+    session_data = {
+        'upload_id': upload_id,
+        'filename': original_filename,
+        'saved_as': saved_filename,
+        'file_path': file_path,
+        'total_size': total_size,
+        'chunk_size': CHUNK_SIZE,
+        'total_chunks': chunk_count(total_size, CHUNK_SIZE),
+        'sha256': sha256.lower() if sha256 else None,
+        'created_at': time.time()
+    }
+    redis_client.setex(_meta_key(upload_id), SESSION_TTL, json_codec.dumps(session_data))
+
+    return session_data
+
+
+def get_session(redis_client, upload_id):
+    """
+    Get upload session metadata
+
+    Returns:
+        dict: Session metadata or None if unknown/expired
+    """
+    raw = redis_client.get(_meta_key(upload_id))
+    return json_codec.loads(raw) if raw else None
+
+
+def received_chunks(redis_client, session_data):
+    """List the indexes of chunks that have been fully written"""
+    members = redis_client.smembers(_chunks_key(session_data['upload_id']))
+    return sorted(int(index) for index in members)
+
+
+def status(redis_client, session_data):
+    """
+    Describe upload progress so clients can resume
+
+    Returns:
+        dict: Progress including the list of missing chunk offsets
+    """
+    received = set(received_chunks(redis_client, session_data))
+    chunk_size = session_data['chunk_size']
+    missing = [index * chunk_size for index in range(session_data['total_chunks'])
+               if index not in received]
+    return {
+        'upload_id': session_data['upload_id'],
+        'filename': session_data['filename'],
+        'total_size': session_data['total_size'],
+        'chunk_size': chunk_size,
+        'total_chunks': session_data['total_chunks'],
+        'received_chunks': len(received),
+        'missing_offsets': missing,
+        'complete': not missing
+    }
+
+
+def write_chunk(redis_client, session_data, offset, stream, content_length):
+    """
+    Write one chunk at its offset in the target file
+
+    The request body is streamed to disk in blocks with os.pwrite, so
+    concurrent chunk requests never share a file position.
+
+    Args:
+        redis_client (redis.Redis): Redis connection
+        session_data (dict): Session from get_session()
+        offset (int): Byte offset of the chunk (multiple of chunk_size)
+        stream: Readable request body stream
+        content_length (int): Declared length of the chunk body
+
+    Returns:
+        int: Index of the chunk written
+
+    Raises:
+        ValueError: On misaligned offsets or wrong chunk length
+    """
+    chunk_size = session_data['chunk_size']
+    total_size = session_data['total_size']
+
+    if offset < 0 or offset >= total_size or offset % chunk_size:
+        raise ValueError(f'offset must be a multiple of {chunk_size} below {total_size}')
+
+    expected_length = min(chunk_size, total_size - offset)
+    if content_length != expected_length:
+        raise ValueError(f'Chunk at offset {offset} must be {expected_length} bytes')
+
+    written = 0
+    digest = ContentDigest()
+    fd = os.open(session_data['file_path'], os.O_WRONLY)
+    try:
+        while written < expected_length:
+            block = stream.read(min(WRITE_BLOCK_SIZE, expected_length - written))
+            if not block:
+                break
+            os.pwrite(fd, block, offset + written)
+            digest.update(block)
+            written += len(block)
+    finally:
+        os.close(fd)
+
+    if written != expected_length:
+        raise ValueError(f'Chunk at offset {offset} was truncated ({written}/{expected_length} bytes)')
+
+    chunk_index = offset // chunk_size
+    pipe = redis_client.pipeline()
+    pipe.hset(_digests_key(session_data['upload_id']), chunk_index, ','.join(digest.block_digests()))
+    pipe.expire(_digests_key(session_data['upload_id']), SESSION_TTL)
+    pipe.sadd(_chunks_key(session_data['upload_id']), chunk_index)
+    pipe.expire(_chunks_key(session_data['upload_id']), SESSION_TTL)
+    pipe.expire(_meta_key(session_data['upload_id']), SESSION_TTL)
+    pipe.zadd(EXPIRY_KEY, {session_data['file_path']: time.time() + SESSION_TTL})
+    pipe.execute()
+
+    return chunk_index
+
+
+def finalize(redis_client, session_data):
+    """
+    Verify a chunked upload is complete and its checksum matches
+
+    Only one request completes an upload: the file then belongs to it
+    (to register, or to delete if it turns out to be a duplicate).
+
+    Returns:
+        str: Content digest of the assembled file, from the chunk digests
+
+    Raises:
+        CompletionInProgress: If another request is completing the upload
+        ValueError: If chunks are missing or the checksum does not match
+    """
+    upload_id = session_data['upload_id']
+    if not redis_client.set(_completing_key(upload_id), 1, nx=True, ex=SESSION_TTL):
+        raise CompletionInProgress(f'Upload {upload_id} is already being completed')
+    try:
+        upload_status = status(redis_client, session_data)
+        if not upload_status['complete']:
+            raise ValueError(f"{len(upload_status['missing_offsets'])} chunk(s) still missing")
+
+        chunk_digests = redis_client.hgetall(_digests_key(upload_id))
+        if len(chunk_digests) != session_data['total_chunks']:
+            raise ValueError('Chunk digests missing, upload the chunks again')
+        sha256 = combine_block_digests(
+            block
+            for index in range(session_data['total_chunks'])
+            for block in chunk_digests[str(index)].split(',')
+        )
+        if session_data.get('sha256') and sha256 != session_data['sha256']:
+            raise ValueError('Checksum mismatch: the assembled file does not match the declared sha256')
+    except BaseException:
+        redis_client.delete(_completing_key(upload_id))
+        raise
+
+    discard(redis_client, session_data, remove_file=False)
+    return sha256
+
+
+def discard(redis_client, session_data, remove_file=True):
+    """Drop upload state from Redis and optionally delete the partial file"""
+    pipe = redis_client.pipeline()
+    pipe.delete(
+        _meta_key(session_data['upload_id']),
+        _chunks_key(session_data['upload_id']),
+        _digests_key(session_data['upload_id']),
+        _completing_key(session_data['upload_id'])
+    )
+    pipe.zrem(EXPIRY_KEY, session_data['file_path'])
+    pipe.execute()
+    if remove_file and os.path.exists(session_data['file_path']):
+        os.remove(session_data['file_path'])
+
+
+def remove_expired(redis_client, now=None):
+    """
+    Delete the partial files of sessions that expired without completing
+
+    Returns:
+        int: Number of files removed
+    """
+    now = time.time() if now is None else now
+    expired = redis_client.zrangebyscore(EXPIRY_KEY, '-inf', now, start=0, num=EXPIRED_BATCH)
+    removed = 0
+    for file_path in expired:
+        # Another process may sweep the same entry
+        if not redis_client.zrem(EXPIRY_KEY, file_path):
+            continue
+        try:
+            os.remove(file_path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
@@ -0,0 +1,73 @@
+"""
+Shared MongoDB connection pool
+
+One MongoClient per process, used by the web app, the User model and the
+ingestion workers. Pool size, wait queue timeout, read preference and
+wire compression come from the environment (read when the client is
+first created, after .env has been loaded):
+
+    MONGODB_MAX_POOL_SIZE            connections per process (default 50)
+    MONGODB_MIN_POOL_SIZE            connections kept open (default 0)
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS    wait for a free connection (default 5000)
+    MONGODB_READ_PREFERENCE          e.g. primary, primaryPreferred, secondaryPreferred
+    MONGODB_COMPRESSORS              e.g. zstd,snappy,zlib (default: none)
+
+MongoClient is not fork-safe: a process forked after the client was
+created gets a new one on first use.
+"""
+import os
+import threading
+from pymongo import MongoClient
+
+
+_lock = threading.Lock()
+_client = {'pid': None, 'client': None}
+
+
+def database_name():
+    return os.getenv('MONGODB_DATABASE', 'saas_logs')
+
+
+def client_options():
+    """MongoClient keyword arguments from the environment"""
+    options = {
+        'host': os.getenv('MONGODB_HOST', 'localhost'),
+        'port': int(os.getenv('MONGODB_PORT', 27017)),
+        'username': os.getenv('MONGODB_USER', 'admin'),
+        'password': os.getenv('MONGODB_PASSWORD', 'password123'),
+        'serverSelectionTimeoutMS': int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+        'maxPoolSize': int(os.getenv('MONGODB_MAX_POOL_SIZE', 50)),
+        'minPoolSize': int(os.getenv('MONGODB_MIN_POOL_SIZE', 0)),
+        'waitQueueTimeoutMS': int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+        'readPreference': os.getenv('MONGODB_READ_PREFERENCE', 'primary'),
+    }
+    compressors = os.getenv('MONGODB_COMPRESSORS', '').strip()
+    if compressors:
+        options['compressors'] = compressors
+    return options
+
+
+def get_client():
+    """This process's MongoClient (created on first use)"""
+    pid = os.getpid()
+    if _client['pid'] == pid:
+        return _client['client']
+    with _lock:
+        if _client['pid'] != pid:
+            _client['client'] = MongoClient(**client_options())
+            _client['pid'] = pid
+    return _client['client']
+
+
+def get_database():
+    """The application database on the shared client"""
+    return get_client()[database_name()]
+
+
+def reset():
+    """Close this process's client; the next get_client() connects again"""
+    with _lock:
+        client = _client['client'] if _client['pid'] == os.getpid() else None
+        _client.update(pid=None, client=None)
+    if client is not None:
+        client.close()
@@ -0,0 +1,270 @@
+"""
+Content-addressed upload deduplication
+
+Uploads are identified by a content digest computed while the request
+body is received: the SHA-256 of the SHA-256s of consecutive
+DIGEST_BLOCK_SIZE blocks. Block digests can be computed independently, so
+chunked uploads hash each chunk as it arrives instead of re-reading the
+whole file on completion. The `files` collection has a unique index on
+the digest (`content_sha256`) so an exact re-upload resolves to the
+existing file ID. Uploads
+whose ingestion failed are left out (of the index too), so the same file
+can be uploaded again and retried. An
+optional near-duplicate mode fingerprints content-defined row ranges and
+reports uploads that largely overlap an earlier one.
+"""
+import os
+import json
+import uuid
+import hashlib
+from flask import Request, current_app
+from pymongo import ASCENDING
+
+from .ingestion import iter_records
+
+
+# 'exact' only, or 'near' to also fingerprint row ranges
+DEDUP_MODE = os.getenv('UPLOAD_DEDUP_MODE', 'exact')
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('UPLOAD_NEAR_DUPLICATE_THRESHOLD', 0.9))
+
+# Bytes per hashed block of the content digest (chunk sizes are multiples of it)
+DIGEST_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Upload statuses that make later uploads of the same content duplicates
+DEDUP_STATUSES = ['pending', 'processing', 'completed']
+CONTENT_INDEX = 'content_sha256_unique_active'
+# Unique on every status, replaced by CONTENT_INDEX (migration 0004)
+LEGACY_CONTENT_INDEX = 'content_sha256_unique'
+
+# Content-defined row ranges: a range ends after a row whose hash has the
+# low bits below set, so inserted/removed rows only change nearby ranges
+ROW_RANGE_MASK = 256 - 1
+ROW_RANGE_MIN = 16
+ROW_RANGE_MAX = 4096
+
+
+class ContentDigest:
+    """Incremental content digest (SHA-256 over per-block SHA-256s)"""
+
+    def __init__(self):
+        self._blocks = []
+        self._block = hashlib.sha256()
+        self._block_filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while len(view):
+            take = min(len(view), DIGEST_BLOCK_SIZE - self._block_filled)
+            self._block.update(view[:take])
+            self._block_filled += take
+            view = view[take:]
+            if self._block_filled == DIGEST_BLOCK_SIZE:
+                self._blocks.append(self._block.hexdigest())
+                self._block = hashlib.sha256()
+                self._block_filled = 0
+
+    def block_digests(self):
+        """Hex SHA-256 of each block written so far (the last may be partial)"""
+        if self._block_filled or not self._blocks:
+            return self._blocks + [self._block.hexdigest()]
+        return list(self._blocks)
+
+    def hexdigest(self):
+        """Content digest of everything written so far"""
+        return combine_block_digests(self.block_digests())
+
+
+def combine_block_digests(digests):
+    """Content digest of a file from the hex digests of its blocks, in order"""
+    combined = hashlib.sha256()
+    for digest in digests:
+        combined.update(bytes.fromhex(digest))
+    return combined.hexdigest()
+
+
+class HashingFile:
+    """
+    Upload spool file that hashes bytes as they are written
+
+    The file is created directly in the uploads folder under a temporary
+    name, so keeping it is a rename rather than a copy.
+    """
+
+    def __init__(self, folder):
+        self.temp_path = os.path.join(folder, f'.{uuid.uuid4().hex}.part')
+        self._file = open(self.temp_path, 'w+b')
+        self._digest = ContentDigest()
+        self._committed = False
+
+    def write(self, data):
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        """Content digest of everything written so far"""
+        return self._digest.hexdigest()
+
+    def commit(self, file_path):
+        """Move the spooled upload to its final path"""
+        self._file.flush()
+        os.replace(self.temp_path, file_path)
+        self._committed = True
+
+    def close(self):
+        """Close the spool file, deleting it unless it was committed"""
+        if not self._file.closed:
+            self._file.close()
+        if not self._committed and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def __getattr__(self, name):
+        # read/seek/readline/tell etc. go to the underlying file
+        return getattr(self._file, name)
+
+
+class HashingRequest(Request):
+    """Request class that spools uploaded files through HashingFile"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFile(current_app.config['UPLOAD_FOLDER'])
+
+
+def save_upload(file_storage, file_path):
+    """
+    Save an uploaded FileStorage, hashing it on the way
+
+    Returns:
+        str: Content digest of the file
+    """
+    stream = file_storage.stream
+    if isinstance(stream, HashingFile):
+        stream.commit(file_path)
+        return stream.hexdigest()
+
+    # Not spooled by HashingRequest: hash while copying
+    digest = ContentDigest()
+    with open(file_path, 'wb') as f:
+        for block in iter(lambda: stream.read(1024 * 1024), b''):
+            digest.update(block)
+            f.write(block)
+    return digest.hexdigest()
+
+
+def uploaded_sha256(file_storage):
+    """Content digest of an upload spooled by HashingRequest, or None"""
+    stream = file_storage.stream
+    return stream.hexdigest() if isinstance(stream, HashingFile) else None
+
+
+def find_duplicate(files_collection, sha256):
+    """
+    Find an earlier upload with identical content whose ingestion did not fail
+
+    Returns:
+        dict: The existing files document or None
+    """
+    if files_collection is None or not sha256:
+        return None
+    return files_collection.find_one(
+        {'content_sha256': sha256.lower(), 'status': {'$in': DEDUP_STATUSES}},
+        {'file_path': 0}
+    )
+
+
+def duplicate_response(file_doc):
+    """Upload response payload pointing at an existing upload"""
+    return {
+        'success': True,
+        'duplicate': True,
+        'file_id': file_doc['_id'],
+        'message': 'File already uploaded',
+        'filename': file_doc.get('filename'),
+        'saved_as': file_doc.get('saved_as'),
+        'file_size': file_doc.get('file_size', 0),
+        'log_count': file_doc.get('log_count', 0),
+        'status': file_doc.get('status'),
+        'indexed_count': file_doc.get('indexed_count', 0),
+        'failed_count': file_doc.get('failed_count', 0)
+    }
+
+
+def row_range_fingerprints(file_path, file_type):
+    """
+    Fingerprint a file as a list of content-defined row range hashes
+
+    Returns:
+        list: 64-bit hex digests, one per row range
+    """
+    fingerprints = []
+    range_digest = hashlib.blake2b(digest_size=8)
+    rows_in_range = 0
+
+    for record in iter_records(file_path, file_type):
+        row = json.dumps(record, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        row_hash = hashlib.blake2b(row, digest_size=8).digest()
+        range_digest.update(row_hash)
+        rows_in_range += 1
+
+        boundary = int.from_bytes(row_hash[:4], 'big') & ROW_RANGE_MASK == 0
+        if (boundary and rows_in_range >= ROW_RANGE_MIN) or rows_in_range >= ROW_RANGE_MAX:
+            fingerprints.append(range_digest.hexdigest())
+            range_digest = hashlib.blake2b(digest_size=8)
+            rows_in_range = 0
+
+    if rows_in_range:
+        fingerprints.append(range_digest.hexdigest())
+    return fingerprints
+
+
+def find_near_duplicate(files_collection, fingerprints, threshold=None):
+    """
+    Find the earlier upload sharing the most row ranges with `fingerprints`
+
+    Returns:
+        dict: {'file_id', 'filename', 'overlap'} if the overlap reaches the
+              threshold, otherwise None
+    """
+    threshold = NEAR_DUPLICATE_THRESHOLD if threshold is None else threshold
+    if files_collection is None or not fingerprints:
+        return None
+
+    wanted = set(fingerprints)
+    best = None
+    candidates = files_collection.find(
+        {'row_ranges': {'$in': list(wanted)}, 'status': {'$in': DEDUP_STATUSES}},
+        {'filename': 1, 'row_ranges': 1}
+    )
+    for candidate in candidates:
+        shared = len(wanted.intersection(candidate.get('row_ranges', [])))
+        overlap = shared / len(wanted)
+        if overlap >= threshold and (best is None or overlap > best['overlap']):
+            best = {
+                'file_id': candidate['_id'],
+                'filename': candidate.get('filename'),
+                'overlap': round(overlap, 4)
+            }
+    return best
+
+
+def ensure_indexes(files_collection):
+    """Create the content hash (unique unless failed) and row range indexes"""
+    files_collection.create_index(
+        [('content_sha256', ASCENDING)],
+        name=CONTENT_INDEX,
+        unique=True,
+        partialFilterExpression={
+            'content_sha256': {'$type': 'string'},
+            'status': {'$in': DEDUP_STATUSES}
+        }
+    )
+    files_collection.create_index(
+        [('row_ranges', ASCENDING)],
+        name='row_ranges',
+        sparse=True
+    )
+
+
+def drop_legacy_index(files_collection):
+    """Drop the content hash index that also covered failed uploads"""
+    if LEGACY_CONTENT_INDEX in files_collection.index_information():
+        files_collection.drop_index(LEGACY_CONTENT_INDEX)
@@ -0,0 +1,140 @@
+"""
+Uploaded file formats and streaming decompression
+
+Uploads may be plain CSV/JSON/NDJSON, gzip-compressed (.csv.gz, .json.gz,
+.ndjson.gz) or a .zip archive of such files. Compressed files are stored
+as-is and decompressed as a stream whenever they are read, so they are
+never inflated fully in memory or on disk.
+"""
+import io
+import gzip
+import zipfile
+
+
+# Data extensions and the record format they are parsed as
+DATA_EXTENSIONS = {'csv': 'csv', 'json': 'json', 'ndjson': 'json'}
+
+ALLOWED_EXTENSIONS = {'csv', 'json', 'ndjson', 'csv.gz', 'json.gz', 'ndjson.gz', 'zip'}
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def extension_of(filename):
+    """
+    Full upload extension of a filename, including the compression suffix
+
+    Examples: 'logs.csv' -> 'csv', 'logs.ndjson.gz' -> 'ndjson.gz'
+    """
+    parts = filename.lower().rsplit('.', 2)
+    if len(parts) == 3 and parts[2] == 'gz':
+        return f'{parts[1]}.gz'
+    return parts[-1] if len(parts) > 1 else ''
+
+
+def allowed_file(filename):
+    """Check if the file extension (with compression suffix) is allowed"""
+    return extension_of(filename) in ALLOWED_EXTENSIONS
+
+
+def compression_of(file_path):
+    """Compression of a stored upload: 'gzip', 'zip' or None"""
+    extension = extension_of(file_path)
+    if extension.endswith('.gz'):
+        return 'gzip'
+    if extension == 'zip':
+        return 'zip'
+    return None
+
+
+def _zip_data_members(archive):
+    """Names of the log files inside a zip archive"""
+    return [
+        info.filename for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith('__MACOSX/')
+        and extension_of(info.filename) in DATA_EXTENSIONS
+    ]
+
+
+def detect_file_type(file_path):
+    """
+    Determine the record format of a stored upload
+
+    Zip archives are inspected through their central directory only.
+
+    Returns:
+        str: 'csv' or 'json'
+
+    Raises:
+        ValueError: If the file (or archive content) is not a supported log format
+    """
+    if compression_of(file_path) == 'zip':
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                members = _zip_data_members(archive)
+        except zipfile.BadZipFile:
+            raise ValueError('Invalid zip archive')
+        types = {DATA_EXTENSIONS[extension_of(name)] for name in members}
+        if not types:
+            raise ValueError('Zip archive contains no CSV, JSON or NDJSON files')
+        if len(types) > 1:
+            raise ValueError('Zip archive must contain only CSV or only JSON/NDJSON files')
+        return types.pop()
+
+    extension = extension_of(file_path)
+    data_extension = extension[:-3] if extension.endswith('.gz') else extension
+    if data_extension not in DATA_EXTENSIONS:
+        raise ValueError(f'Unsupported file type: {extension}')
+    return DATA_EXTENSIONS[data_extension]
+
+
+def iter_binary_streams(file_path):
+    """
+    Yield decompressed binary streams for a stored upload
+
+    Plain and gzip files yield one stream; zip archives yield one stream
+    per log file member. Each stream is closed once the caller moves on.
+    """
+    compression = compression_of(file_path)
+    if compression == 'gzip':
+        with gzip.open(file_path, 'rb') as stream:
+            yield stream
+    elif compression == 'zip':
+        with zipfile.ZipFile(file_path) as archive:
+            for name in _zip_data_members(archive):
+                with archive.open(name) as stream:
+                    yield stream
+    else:
+        with open(file_path, 'rb') as stream:
+            yield stream
+
+
+def iter_text_streams(file_path):
+    """Yield decompressed UTF-8 text streams for a stored upload"""
+    for stream in iter_binary_streams(file_path):
+        text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        try:
+            yield text
+        finally:
+            # Leave closing the underlying stream to iter_binary_streams
+            text.detach()
+
+
+def count_lines(file_path):
+    """
+    Count lines per stream, decompressing on the fly
+
+    Returns:
+        list: Line count of each stream (a final unterminated line counts)
+    """
+    counts = []
+    for stream in iter_binary_streams(file_path):
+        lines = 0
+        last = b''
+        for block in iter(lambda: stream.read(READ_BLOCK_SIZE), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+        if last and last != b'\n':
+            lines += 1
+        counts.append(lines)
+    return counts
@@ -0,0 +1,111 @@
+"""
+Per-upload document tagging and removal
+
+Every document indexed from an upload carries its `file_id`. Large
+uploads are routed to their own index (saas-logs-file-<file_id>), which
+still matches the saas-logs-* pattern used by all queries, so deleting
+them is an index drop. Documents of smaller uploads live in the daily
+indices and are removed with a sliced, asynchronous delete-by-query
+tracked in the MongoDB `delete_jobs` collection.
+"""
+import os
+import uuid
+from datetime import datetime
+
+from .batch_parser import INDEX_PREFIX
+
+
+# Uploads with at least this many rows get a dedicated index (0 disables)
+DEDICATED_INDEX_MIN_ROWS = int(os.getenv('INGEST_DEDICATED_INDEX_MIN_ROWS', 500000))
+
+TEMPLATE_NAME = 'saas-logs-file-id'
+
+
+def dedicated_index_for(file_doc):
+    """
+    Name of the upload's own index, or None if it goes to the daily indices
+    """
+    if file_doc.get('index_name'):
+        return file_doc['index_name']
+    if DEDICATED_INDEX_MIN_ROWS > 0 and (file_doc.get('log_count') or 0) >= DEDICATED_INDEX_MIN_ROWS:
+        return f"{INDEX_PREFIX}-file-{file_doc['_id']}"
+    return None
+
+
+def ensure_template(es_client):
+    """Map `file_id` as a keyword on all saas-logs-* indices"""
+    es_client.indices.put_index_template(
+        name=TEMPLATE_NAME,
+        index_patterns=[f'{INDEX_PREFIX}-*'],
+        priority=10,
+        template={'mappings': {'properties': {'file_id': {'type': 'keyword'}}}}
+    )
+
+
+def delete_documents(es_client, jobs_collection, file_doc):
+    """
+    Remove every indexed document of an upload
+
+    Returns:
+        dict: {'method': 'index_drop', 'index'} or
+              {'method': 'delete_by_query', 'job_id'} for the async job
+    """
+    file_id = file_doc['_id']
+    index_name = file_doc.get('index_name')
+    if index_name:
+        es_client.options(ignore_status=404).indices.delete(index=index_name)
+        return {'method': 'index_drop', 'index': index_name}
+
+    response = es_client.delete_by_query(
+        index=f'{INDEX_PREFIX}-*',
+        # match_phrase also matches daily indices created before file_id was a keyword
+        query={'match_phrase': {'file_id': file_id}},
+        slices='auto',
+        conflicts='proceed',
+        wait_for_completion=False
+    )
+    job = {
+        '_id': str(uuid.uuid4()),
+        'file_id': file_id,
+        'filename': file_doc.get('filename'),
+        'task_id': response['task'],
+        'status': 'running',
+        'created_at': datetime.utcnow().isoformat() + 'Z'
+    }
+    if jobs_collection is not None:
+        jobs_collection.insert_one(job)
+    return {'method': 'delete_by_query', 'job_id': job['_id']}
+
+
+def refresh_job(es_client, jobs_collection, job):
+    """
+    Update a running delete job from its Elasticsearch task
+
+    Returns:
+        dict: The (updated) job document
+    """
+    if job.get('status') != 'running':
+        return job
+
+    task = es_client.tasks.get(task_id=job['task_id'])
+    if not task.get('completed'):
+        status = task.get('task', {}).get('status', {})
+        job['progress'] = {
+            'total': status.get('total', 0),
+            'deleted': status.get('deleted', 0)
+        }
+        return job
+
+    response = task.get('response', {})
+    failures = response.get('failures', [])
+    job.update({
+        'status': 'failed' if task.get('error') or failures else 'completed',
+        'deleted': response.get('deleted', 0),
+        'failures': [str(failure) for failure in failures[:10]],
+        'completed_at': datetime.utcnow().isoformat() + 'Z'
+    })
+    if task.get('error'):
+        job['error'] = str(task['error'])
+    job.pop('progress', None)
+    jobs_collection.replace_one({'_id': job['_id']}, job)
+    return job
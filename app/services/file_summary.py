@@ -0,0 +1,189 @@
+"""
+Per-file summary statistics
+
+Built during ingestion from the same parsed batches that are indexed, so
+an upload's contents can be described from its files document without
+running Elasticsearch aggregations: counts by level and status class, a
+response time histogram, the time span covered, the busiest endpoints and
+an approximate number of distinct users (HyperLogLog).
+"""
+import hashlib
+from collections import Counter
+from datetime import datetime
+import numpy as np
+
+
+# Upper bounds (ms) of the response time histogram buckets; a last bucket
+# holds everything slower
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+TOP_ENDPOINTS = 10
+# Endpoint counters are trimmed to the busiest half beyond this size
+MAX_TRACKED_ENDPOINTS = 10000
+
+# HyperLogLog with 2^14 registers: ~0.8% standard error
+HLL_PRECISION = 14
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class SummaryBuilder:
+    """Accumulates summary statistics batch by batch"""
+
+    def __init__(self):
+        self.rows = 0
+        self.levels = Counter()
+        self.status_classes = Counter()
+        self.endpoints = Counter()
+        self.latency_counts = np.zeros(len(LATENCY_BUCKETS_MS) + 1, dtype=np.int64)
+        self.latency_sum = 0.0
+        self.latency_min = None
+        self.latency_max = None
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.user_registers = np.zeros(1 << HLL_PRECISION, dtype=np.uint8)
+
+    def add_batch(self, batch):
+        """Add a batch_parser.ColumnBatch"""
+        def column(name):
+            if name not in batch.columns:
+                return np.empty(0, dtype=object)
+            return batch.columns[name][batch.present[name]]
+
+        def numbers(name):
+            return batch.numeric.get(name, np.empty(0))
+
+        self._add(
+            batch.size,
+            levels=column('level'),
+            status_codes=numbers('status_code'),
+            latencies=numbers('response_time_ms'),
+            timestamps=batch.timestamps,
+            endpoints=column('endpoint'),
+            users=column('user_id')
+        )
+
+    def add_documents(self, documents):
+        """Add documents produced by ingestion.to_document()"""
+        def field(name):
+            return np.array(
+                [str(doc[name]) for doc in documents if doc.get(name) not in (None, '')],
+                dtype=object
+            )
+
+        def numbers(name):
+            return np.array([_to_float(doc.get(name)) for doc in documents], dtype=np.float64)
+
+        self._add(
+            len(documents),
+            levels=field('level'),
+            status_codes=numbers('status_code'),
+            latencies=numbers('response_time_ms'),
+            timestamps=np.array([doc['@timestamp'].rstrip('Z') for doc in documents], dtype='datetime64[ms]'),
+            endpoints=field('endpoint'),
+            users=field('user_id')
+        )
+
+    def _add(self, rows, levels, status_codes, latencies, timestamps, endpoints, users):
+        self.rows += rows
+        self.levels.update(self._counts(levels))
+        self.endpoints.update(self._counts(endpoints))
+        if len(self.endpoints) > MAX_TRACKED_ENDPOINTS:
+            self.endpoints = Counter(dict(self.endpoints.most_common(MAX_TRACKED_ENDPOINTS // 2)))
+
+        status_codes = status_codes[~np.isnan(status_codes)]
+        classes, counts = np.unique((status_codes // 100).astype(np.int64), return_counts=True)
+        self.status_classes.update({f'{cls}xx': int(count) for cls, count in zip(classes.tolist(), counts.tolist())})
+
+        latencies = latencies[~np.isnan(latencies)]
+        if len(latencies):
+            buckets = np.searchsorted(LATENCY_BUCKETS_MS, latencies, side='left')
+            self.latency_counts += np.bincount(buckets, minlength=len(self.latency_counts))
+            self.latency_sum += float(latencies.sum())
+            low, high = float(latencies.min()), float(latencies.max())
+            self.latency_min = low if self.latency_min is None else min(self.latency_min, low)
+            self.latency_max = high if self.latency_max is None else max(self.latency_max, high)
+
+        if len(timestamps):
+            first, last = timestamps.min(), timestamps.max()
+            self.first_timestamp = first if self.first_timestamp is None else min(self.first_timestamp, first)
+            self.last_timestamp = last if self.last_timestamp is None else max(self.last_timestamp, last)
+
+        self._add_users(users)
+
+    @staticmethod
+    def _counts(values):
+        return Counter(map(str, values.tolist()))
+
+    def _add_users(self, users):
+        """Update the HyperLogLog registers with a batch of user IDs"""
+        if not len(users):
+            return
+        unique = set(map(str, users.tolist()))
+        hashes = np.fromiter(map(_hash64, unique), dtype=np.uint64, count=len(unique))
+        index_bits = np.uint64(64 - HLL_PRECISION)
+        registers = (hashes >> index_bits).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - HLL_PRECISION)) - 1)
+        # Position of the leftmost 1-bit in the remaining 50 bits (exact in float64)
+        with np.errstate(divide='ignore'):
+            highest_bit = np.floor(np.log2(rest.astype(np.float64)))
+        rank = np.where(rest == 0, 64 - HLL_PRECISION + 1, (64 - HLL_PRECISION) - highest_bit)
+        np.maximum.at(self.user_registers, registers, rank.astype(np.uint8))
+
+    def distinct_users(self):
+        """HyperLogLog estimate of the number of distinct user IDs"""
+        m = len(self.user_registers)
+        zeros = int(np.count_nonzero(self.user_registers == 0))
+        if zeros == m:
+            return 0
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.sum(np.ldexp(1.0, -self.user_registers.astype(np.int64))))
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction (linear counting)
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def result(self):
+        """Summary document stored as `summary` on the files document"""
+        latency_count = int(self.latency_counts.sum())
+        histogram = [
+            {'le': bound, 'count': int(count)}
+            for bound, count in zip(list(LATENCY_BUCKETS_MS) + [None], self.latency_counts.tolist())
+        ]
+
+        time_span = None
+        if self.first_timestamp is not None:
+            time_span = {
+                'start': str(np.datetime_as_string(self.first_timestamp, unit='s')) + 'Z',
+                'end': str(np.datetime_as_string(self.last_timestamp, unit='s')) + 'Z',
+                'seconds': int((self.last_timestamp - self.first_timestamp) / np.timedelta64(1, 's'))
+            }
+
+        return {
+            'rows': self.rows,
+            'levels': [{'level': level, 'count': count} for level, count in self.levels.most_common()],
+            'status_classes': dict(sorted(self.status_classes.items())),
+            'latency_ms': {
+                'count': latency_count,
+                'min': self.latency_min,
+                'max': self.latency_max,
+                'avg': round(self.latency_sum / latency_count, 2) if latency_count else None,
+                'histogram': histogram
+            },
+            'time_span': time_span,
+            'top_endpoints': [
+                {'endpoint': endpoint, 'count': count}
+                for endpoint, count in self.endpoints.most_common(TOP_ENDPOINTS)
+            ],
+            'distinct_users': self.distinct_users(),
+            'computed_at': datetime.utcnow().isoformat() + 'Z'
+        }
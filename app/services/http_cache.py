@@ -0,0 +1,106 @@
+"""
+Response compression and conditional requests for the JSON/CSV APIs
+
+Responses of COMPRESSIBLE_TYPES larger than COMPRESS_MIN_SIZE bytes are
+compressed with brotli (if the Brotli package is installed and the
+client accepts it) or gzip. Streamed and file responses are passed
+through as they are.
+
+Log endpoints are tagged with a weak ETag derived from the request, the
+log data generation (services.log_queries.GENERATION_KEY, bumped when
+uploads are ingested or deleted) and the current ETAG_TTL-second time
+slot, which bounds how stale a 304 can be for logs shipped by Logstash.
+A repeated poll whose If-None-Match still matches is answered with
+304 Not Modified before any query runs. Responses built from degraded or
+cached data (e.g. stats while a backend is down) are not tagged, so the
+next poll fetches fresh data once the backends recover.
+"""
+import os
+import gzip
+import time
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))  # bytes
+COMPRESSIBLE_TYPES = ('application/json', 'text/csv')
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4  # fast enough for per-request compression
+
+ETAG_TTL = int(os.getenv('ETAG_TTL', 30))  # seconds
+
+
+def choose_encoding(accept_encoding):
+    """
+    Preferred content coding accepted by the client
+
+    Args:
+        accept_encoding (str): Accept-Encoding request header
+
+    Returns:
+        str: 'br', 'gzip' or None
+    """
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    wildcard = accepted.get('*', 0.0)
+    if brotli is not None and accepted.get('br', wildcard) > 0:
+        return 'br'
+    if accepted.get('gzip', wildcard) > 0:
+        return 'gzip'
+    return None
+
+
+def should_compress(mimetype, size, encoding):
+    """Whether a response body is worth compressing for this client"""
+    return bool(encoding) and mimetype in COMPRESSIBLE_TYPES and size >= COMPRESS_MIN_SIZE
+
+
+def compress(body, encoding):
+    """Compress a response body with 'br' or 'gzip'"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def etag(generation, *parts):
+    """
+    Weak ETag value (without W/ and quotes) for a log endpoint response
+
+    Args:
+        generation: Current log data generation (None if unknown)
+        *parts: What else the response depends on (path, query, body)
+    """
+    digest = hashlib.blake2b(digest_size=12)
+    for part in (generation, int(time.time() // ETAG_TTL), *parts):
+        if not isinstance(part, bytes):
+            part = str(part).encode('utf-8')
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def matches(if_none_match, value):
+    """Whether an If-None-Match header matches the (weak) ETag value"""
+    for candidate in (if_none_match or '').split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate.strip('"') == value:
+            return True
+    return False
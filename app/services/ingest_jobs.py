@@ -0,0 +1,118 @@
+"""
+Ingestion job execution
+
+Runs the ingestion engine for one uploaded file and records status,
+progress and the final indexed/failed counts on its files document.
+Used by the queue workers and by the web app when no queue is available.
+Records are counted here (`log_count`), not while the upload request is
+open.
+Large uploads are indexed in bulk-load mode (see bulk_load), and a
+summary of the file's contents is stored as `summary` (see file_summary).
+"""
+from datetime import datetime
+
+from .ingestion import ingest_file, count_records
+from .ingest_queue import ProgressTracker
+from .bulk_load import BulkLoadSession, should_use as should_bulk_load
+from .file_indices import dedicated_index_for
+from .file_summary import SummaryBuilder
+
+
+def run_ingest_job(es_client, files_collection, file_doc, on_progress=None):
+    """
+    Ingest an uploaded file and record the outcome
+
+    Args:
+        es_client (Elasticsearch): Connected client (None marks the job failed)
+        files_collection (Collection): MongoDB `files` collection, may be None
+        file_doc (dict): The upload's files document
+        on_progress (callable): Called each time progress is written
+
+    Returns:
+        dict: Ingestion result with 'status', 'log_count', 'indexed', 'failed', 'errors'
+    """
+    file_id = file_doc['_id']
+    log_count = file_doc.get('log_count')
+    if log_count is None:
+        # Sizes the progress total, bulk-load mode and dedicated index
+        try:
+            log_count = count_records(file_doc['file_path'], file_doc['file_type'])
+        except Exception as e:
+            print(f"Could not count records of {file_id}: {e}")
+        file_doc = {**file_doc, 'log_count': log_count}
+        if on_progress:
+            on_progress()
+    index_name = dedicated_index_for(file_doc)
+    bulk_load = None
+    if es_client and files_collection is not None and should_bulk_load(file_doc.get('log_count')):
+        bulk_load = BulkLoadSession(es_client, files_collection.database['bulk_load_indices'], file_id)
+
+    def flushed():
+        if bulk_load:
+            bulk_load.touch()
+        if on_progress:
+            on_progress()
+
+    tracker = ProgressTracker(files_collection, file_id, file_doc.get('log_count'), flushed)
+    result = {'indexed': 0, 'failed': 0, 'errors': [], 'duration_ms': 0}
+    summary = SummaryBuilder()
+    fields = {}
+
+    _set_fields(files_collection, file_id, {
+        'status': 'processing',
+        'log_count': log_count,
+        'ingest_started_at': datetime.utcnow().isoformat() + 'Z',
+        'bulk_load': bool(bulk_load),
+        'index_name': index_name
+    })
+
+    try:
+        if not es_client:
+            raise Exception("Elasticsearch client not initialized")
+        try:
+            result = ingest_file(
+                es_client,
+                file_doc['file_path'],
+                file_doc['file_type'],
+                file_id,
+                progress=tracker,
+                on_index=bulk_load.prepare if bulk_load else None,
+                index_name=index_name,
+                summary=summary
+            )
+        finally:
+            if bulk_load:
+                # Restores settings and refreshes, so documents are searchable
+                bulk_load.finish()
+        status = 'failed' if result['failed'] and not result['indexed'] else 'completed'
+        fields['summary'] = summary.result()
+    except Exception as e:
+        print(f"Ingestion error for {file_id}: {e}")
+        result['errors'].append({'error': str(e)})
+        status = 'failed'
+
+    tracker(result['indexed'], result['failed'], force=True, bulk=result.get('bulk'))
+    result['status'] = status
+    result['log_count'] = log_count
+    fields.update({
+        'status': status,
+        'indexed_count': result['indexed'],
+        'failed_count': result['failed'],
+        'ingest_errors': result['errors'],
+        'ingest_duration_ms': result['duration_ms'],
+        'ingest_stages_ms': result.get('stages_ms'),
+        'indexed_at': datetime.utcnow().isoformat() + 'Z'
+    })
+    _set_fields(files_collection, file_id, fields)
+
+    return result
+
+
+def _set_fields(files_collection, file_id, fields):
+    """Update the files document, logging (not raising) on failure"""
+    if files_collection is None:
+        return
+    try:
+        files_collection.update_one({'_id': file_id}, {'$set': fields})
+    except Exception as e:
+        print(f"MongoDB ingestion status error: {e}")
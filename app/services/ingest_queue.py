@@ -0,0 +1,203 @@
+"""
+Redis-backed ingestion job queue
+
+Uploads are enqueued by file ID on a sorted set scored by priority and
+enqueue time, and consumed by the worker processes in worker.py. Jobs
+being processed are tracked with a heartbeat so jobs from crashed
+workers can be re-queued.
+
+A job is taken off the queue and entered in the processing set by one
+Lua script, so a worker dying in between cannot lose it. Workers waiting
+for jobs block on the READY_KEY list, which enqueue() pushes a wake-up
+to, and poll the queue at least every WAIT_POLL_SECONDS.
+"""
+import os
+import time
+from datetime import datetime
+
+
+QUEUE_KEY = 'ingest:queue'
+PROCESSING_KEY = 'ingest:processing'
+# Wake-ups for waiting workers (hints only: the queue is the source of truth)
+READY_KEY = 'ingest:ready'
+READY_MAX = 100
+WAIT_POLL_SECONDS = 1.0
+
+# Lower score is served first
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+_PRIORITY_SPAN = 10 ** 13  # Larger than any millisecond timestamp
+
+JOB_STALE_SECONDS = int(os.getenv('INGEST_JOB_STALE_SECONDS', 600))
+PROGRESS_INTERVAL = float(os.getenv('INGEST_PROGRESS_INTERVAL', 2.0))
+
+
+def enqueue(redis_client, file_id, priority='normal'):
+    """
+    Add an upload to the ingestion queue
+
+    Args:
+        redis_client (redis.Redis): Redis connection
+        file_id (str): ID of the files document to ingest
+        priority (str): 'high', 'normal' or 'low'
+
+    Raises:
+        ValueError: If the priority is unknown
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+    score = PRIORITIES[priority] * _PRIORITY_SPAN + int(time.time() * 1000)
+    pipe = redis_client.pipeline()
+    pipe.zadd(QUEUE_KEY, {file_id: score})
+    pipe.lpush(READY_KEY, 1)
+    pipe.ltrim(READY_KEY, 0, READY_MAX - 1)
+    pipe.execute()
+
+
+# KEYS: queue, processing set; ARGV: heartbeat time
+# Returns the claimed file ID, or false if the queue is empty
+_CLAIM = """
+local item = redis.call('ZPOPMIN', KEYS[1])
+if #item == 0 then
+    return false
+end
+redis.call('ZADD', KEYS[2], ARGV[1], item[1])
+return item[1]
+"""
+
+_scripts = {}
+
+
+def _claim(redis_client):
+    """Move the first job from the queue to the processing set, atomically"""
+    script = _scripts.get(id(redis_client))
+    if script is None:
+        script = _scripts[id(redis_client)] = redis_client.register_script(_CLAIM)
+    return script(keys=[QUEUE_KEY, PROCESSING_KEY], args=[time.time()])
+
+
+def dequeue(redis_client, timeout=5):
+    """
+    Block until a job is available and mark it as processing
+
+    Returns:
+        str: File ID, or None if the timeout expired
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        file_id = _claim(redis_client)
+        if file_id:
+            return file_id
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        redis_client.blpop(READY_KEY, timeout=min(remaining, WAIT_POLL_SECONDS))
+
+
+def heartbeat(redis_client, file_id):
+    """Record that a job is still being processed"""
+    redis_client.zadd(PROCESSING_KEY, {file_id: time.time()})
+
+
+def ack(redis_client, file_id):
+    """Mark a job as finished"""
+    redis_client.zrem(PROCESSING_KEY, file_id)
+
+
+def remove(redis_client, file_id):
+    """
+    Drop a job that has not started yet
+
+    Returns:
+        bool: True if the job was waiting in the queue
+    """
+    return bool(redis_client.zrem(QUEUE_KEY, file_id))
+
+
+def is_processing(redis_client, file_id):
+    """Whether a worker has claimed the job and not acknowledged it yet"""
+    return redis_client.zscore(PROCESSING_KEY, file_id) is not None
+
+
+def requeue_stale(redis_client, stale_seconds=None):
+    """
+    Put jobs whose worker stopped sending heartbeats back on the queue
+
+    Returns:
+        int: Number of jobs re-queued
+    """
+    stale_seconds = JOB_STALE_SECONDS if stale_seconds is None else stale_seconds
+    requeued = 0
+    for file_id in redis_client.zrangebyscore(PROCESSING_KEY, '-inf', time.time() - stale_seconds):
+        # Only the caller that removes the entry re-queues it
+        if redis_client.zrem(PROCESSING_KEY, file_id):
+            enqueue(redis_client, file_id, 'high')
+            requeued += 1
+    return requeued
+
+
+def queue_position(redis_client, file_id):
+    """Zero-based position of a job in the queue, or None if not queued"""
+    return redis_client.zrank(QUEUE_KEY, file_id)
+
+
+def queue_length(redis_client):
+    """Number of jobs waiting in the queue"""
+    return redis_client.zcard(QUEUE_KEY)
+
+
+class ProgressTracker:
+    """Throttled progress reporting onto the files document"""
+
+    def __init__(self, files_collection, file_id, total_rows, on_flush=None, interval=None):
+        self.files_collection = files_collection
+        self.file_id = file_id
+        self.total_rows = total_rows or 0
+        self.on_flush = on_flush
+        self.interval = PROGRESS_INTERVAL if interval is None else interval
+        self.started = time.monotonic()
+        self.last_flush = 0.0
+        self.progress = {}
+
+    def __call__(self, indexed, failed, force=False, bulk=None):
+        """
+        Update progress counters, writing them out at most once per interval
+
+        Args:
+            indexed (int): Documents indexed so far
+            failed (int): Documents failed so far
+            force (bool): Write regardless of the interval
+            bulk (dict): Current bulk indexer stats (throughput, batch size...)
+        """
+        now = time.monotonic()
+        elapsed = max(now - self.started, 1e-6)
+        processed = indexed + failed
+        rows_per_sec = processed / elapsed
+        remaining = max(self.total_rows - processed, 0)
+
+        self.progress = {
+            'rows_processed': processed,
+            'indexed': indexed,
+            'failed': failed,
+            'rows_per_sec': round(rows_per_sec, 1),
+            'eta_seconds': round(remaining / rows_per_sec, 1) if rows_per_sec else None,
+            'percent': round(min(processed / self.total_rows, 1.0) * 100, 1) if self.total_rows else None,
+            'elapsed_seconds': round(elapsed, 1),
+            'updated_at': datetime.utcnow().isoformat() + 'Z'
+        }
+        if bulk is not None:
+            self.progress['bulk'] = bulk
+
+        if not force and now - self.last_flush < self.interval:
+            return
+        self.last_flush = now
+
+        if self.files_collection is not None:
+            try:
+                self.files_collection.update_one(
+                    {'_id': self.file_id},
+                    {'$set': {'progress': self.progress}}
+                )
+            except Exception as e:
+                print(f"Progress update error for {self.file_id}: {e}")
+        if self.on_flush:
+            self.on_flush()
@@ -0,0 +1,354 @@
+"""
+Ingestion engine for uploaded log files
+
+Converts uploaded CSV/JSON files (plain or compressed) into typed Elasticsearch documents and
+indexes them directly through the bulk API, replacing the Logstash file
+tailing path for files received by /api/upload.
+"""
+import os
+import csv
+import json
+import math
+import re
+import time
+from datetime import datetime, timezone
+
+from .file_formats import iter_text_streams, count_lines
+from .batch_parser import INTEGER_FIELDS, INTEGER_LIMIT, FLOAT_FIELDS, INDEX_PREFIX, iter_csv_batches
+from .bulk_indexer import AdaptiveBulkIndexer
+
+
+# Ingestion tuning from environment (starting values for the adaptive indexer)
+INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', 1000))
+INGEST_THREAD_COUNT = int(os.getenv('INGEST_THREAD_COUNT', 4))
+INGEST_MAX_RETRIES = int(os.getenv('INGEST_MAX_RETRIES', 3))
+INGEST_RETRY_BACKOFF = float(os.getenv('INGEST_RETRY_BACKOFF', 1.0))
+
+# Maximum number of error samples stored on the file document
+MAX_ERROR_SAMPLES = 10
+
+_WHITESPACE = re.compile(r'\s*')
+
+
+def iter_records(file_path, file_type):
+    """
+    Stream raw records from an uploaded file
+
+    Compressed uploads (.gz, .zip) are decompressed on the fly.
+
+    Args:
+        file_path (str): Path of the uploaded file
+        file_type (str): 'csv' or 'json'
+
+    Yields:
+        dict: One raw record per log line / JSON object
+    """
+    if file_type not in ('csv', 'json'):
+        raise ValueError(f'Unsupported file type: {file_type}')
+
+    for f in iter_text_streams(file_path):
+        if file_type == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            yield from iter_json_records(f)
+
+
+def iter_json_records(f, block_size=64 * 1024):
+    """
+    Incrementally decode a JSON array, a single object or NDJSON
+
+    The file is read in blocks so large arrays are never loaded fully
+    into memory.
+
+    Args:
+        f: Text file object
+        block_size (int): Number of characters read per block
+
+    Yields:
+        dict: Decoded JSON objects
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(block_size)
+    pos = _WHITESPACE.match(buffer).end()
+    in_array = buffer[pos:pos + 1] == '['
+    if in_array:
+        pos += 1
+
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if in_array and buffer[pos:pos + 1] == ',':
+            pos = _WHITESPACE.match(buffer, pos + 1).end()
+        if in_array and buffer[pos:pos + 1] == ']':
+            return
+
+        if pos >= len(buffer):
+            chunk = f.read(block_size)
+            if not chunk:
+                return
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Object spans the block boundary: read more and retry
+            chunk = f.read(block_size)
+            if not chunk:
+                raise
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        pos = end
+        if isinstance(obj, dict):
+            yield obj
+
+
+def count_records(file_path, file_type):
+    """
+    Count the log records in an uploaded file without loading it into memory
+
+    Returns:
+        int: Number of records (CSV data rows or JSON objects)
+    """
+    if file_type == 'csv':
+        # One header line per file (or per zip member)
+        return sum(max(lines - 1, 0) for lines in count_lines(file_path))
+    return sum(1 for _ in iter_records(file_path, file_type))
+
+
+def parse_timestamp(value):
+    """
+    Parse a log timestamp into an aware UTC datetime
+
+    Accepts the same formats as the Logstash `date` filter: ISO8601,
+    'yyyy-MM-dd HH:mm:ss' and 'yyyy-MM-ddTHH:mm:ssZ'.
+
+    Returns:
+        datetime or None if the value cannot be parsed
+    """
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def _to_number(value, cast):
+    """Convert a raw field value, returning None for empty/invalid/infinite (or out of range integer) values"""
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(number):
+        return None
+    if cast is int:
+        return int(number) if -INTEGER_LIMIT <= number < INTEGER_LIMIT else None
+    return cast(value)
+
+
+def to_document(record, data_source):
+    """
+    Convert a raw record into a typed Elasticsearch document
+
+    Args:
+        record (dict): Raw record from iter_records()
+        data_source (str): Source type stored on the document ('csv'/'json')
+
+    Returns:
+        dict: Typed document including '@timestamp'
+    """
+    # Skip empty columns, like the Logstash csv filter
+    doc = {key: value for key, value in record.items()
+           if key is not None and value not in ('', None)}
+
+    for field in INTEGER_FIELDS:
+        if field in doc:
+            doc[field] = _to_number(doc[field], int)
+    for field in FLOAT_FIELDS:
+        if field in doc:
+            doc[field] = _to_number(doc[field], float)
+
+    event_time = parse_timestamp(doc.get('timestamp')) or parse_timestamp(doc.get('@timestamp'))
+    if event_time is None:
+        event_time = datetime.now(timezone.utc)
+    doc['@timestamp'] = event_time.isoformat().replace('+00:00', 'Z')
+    doc['data_source'] = data_source
+
+    return doc
+
+
+def index_for(doc):
+    """Daily index name for a document, e.g. saas-logs-2025.10.02"""
+    return f"{INDEX_PREFIX}-{doc['@timestamp'][:10].replace('-', '.')}"
+
+
+def iter_document_batches(file_path, file_type, batch_size=None, extra_fields=None, collector=None, timings=None):
+    """
+    Parse a file into batches of typed document sources
+
+    Sources are pre-serialized JSON. CSV files go through the vectorized
+    column parser; JSON records are converted one by one since their
+    fields are not fixed. `extra_fields` are added to every document.
+
+    A `collector` (e.g. file_summary.SummaryBuilder) also receives every
+    parsed batch: add_batch(ColumnBatch) for CSV, add_documents(documents)
+    for JSON.
+
+    If `timings` is given, seconds spent in each stage are added to its
+    'parse', 'summary' and 'serialize' keys.
+
+    Yields:
+        tuple: (list of document sources, list of their daily index names)
+    """
+    timings = {} if timings is None else timings
+    for stage in ('parse', 'summary', 'serialize'):
+        timings.setdefault(stage, 0.0)
+    clock = time.perf_counter
+
+    if file_type == 'csv':
+        batches = iter_csv_batches(file_path, batch_size)
+    else:
+        records = _window(iter_records(file_path, file_type), batch_size or INGEST_CHUNK_SIZE)
+        batches = (
+            [{**to_document(record, file_type), **(extra_fields or {})} for record in chunk]
+            for chunk in records
+        )
+
+    while True:
+        started = clock()
+        batch = next(batches, None)
+        if batch is None:
+            break
+        parsed = clock()
+        if collector is not None:
+            if file_type == 'csv':
+                collector.add_batch(batch)
+            else:
+                collector.add_documents(batch)
+        collected = clock()
+        if file_type == 'csv':
+            sources, indices = batch.json_sources(extra_fields), batch.index_names()
+        else:
+            sources = [json.dumps(doc, separators=(',', ':')) for doc in batch]
+            indices = [index_for(doc) for doc in batch]
+        timings['parse'] += parsed - started
+        timings['summary'] += collected - parsed
+        timings['serialize'] += clock() - collected
+        yield sources, indices
+
+
+def iter_actions(file_path, file_type, file_id, index_name=None, summary=None, timings=None):
+    """
+    Build bulk index actions for every record in a file
+
+    Documents are stamped with `file_id`. Document IDs are derived from the
+    file ID and record position so that retries and re-ingestion of the
+    same file never create duplicates. Documents go to their daily index
+    unless `index_name` is given.
+    """
+    position = 0
+    batches = iter_document_batches(
+        file_path, file_type, extra_fields={'file_id': file_id}, collector=summary, timings=timings
+    )
+    for sources, indices in batches:
+        for source, index in zip(sources, indices):
+            yield {
+                '_op_type': 'index',
+                '_index': index_name or index,
+                '_id': f'{file_id}-{position}',
+                '_source': source
+            }
+            position += 1
+
+
+def _announce_indices(actions, on_index):
+    """Pass actions through, calling on_index for each new target index"""
+    seen = set()
+    for action in actions:
+        if action['_index'] not in seen:
+            seen.add(action['_index'])
+            on_index(action['_index'])
+        yield action
+
+
+def _window(iterable, size):
+    """Group an iterable into lists of at most `size` items"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest_file(es_client, file_path, file_type, file_id,
+                chunk_size=None, thread_count=None, max_retries=None, progress=None,
+                on_index=None, index_name=None, summary=None):
+    """
+    Index an uploaded file into Elasticsearch with adaptive bulk requests
+
+    Batch size and concurrency start at `chunk_size` / `thread_count` and
+    adapt to the cluster (see AdaptiveBulkIndexer). Rejected items are
+    re-sent with exponential backoff, up to `max_retries` times.
+
+    Args:
+        es_client (Elasticsearch): Connected client
+        file_path (str): Path of the uploaded file
+        file_type (str): 'csv' or 'json'
+        file_id (str): Upload ID, used to derive document IDs
+        chunk_size (int): Initial documents per bulk request
+        thread_count (int): Initial concurrent bulk requests
+        max_retries (int): Retries for rejected documents
+        progress (callable): Called as progress(indexed, failed, bulk=stats)
+            after each bulk request
+        on_index (callable): Called with each target index name before the
+            first document is sent to it
+        index_name (str): Index for all documents instead of the daily indices
+        summary (SummaryBuilder): Collects file statistics while parsing
+
+    Returns:
+        dict: {'indexed', 'failed', 'errors', 'duration_ms', 'bulk', 'stages_ms'};
+              'stages_ms' splits the time into parse, summary, serialize and
+              bulk (summed over concurrent requests)
+    """
+    indexer = AdaptiveBulkIndexer(
+        es_client,
+        chunk_size=chunk_size or INGEST_CHUNK_SIZE,
+        thread_count=thread_count or INGEST_THREAD_COUNT,
+        max_retries=INGEST_MAX_RETRIES if max_retries is None else max_retries,
+        retry_backoff=INGEST_RETRY_BACKOFF
+    )
+
+    result = {'indexed': 0, 'failed': 0, 'errors': [], 'duration_ms': 0}
+    started = time.monotonic()
+    timings = {}
+
+    actions = iter_actions(file_path, file_type, file_id, index_name, summary, timings)
+    if on_index:
+        actions = _announce_indices(actions, on_index)
+
+    for indexed, failed in indexer.index(actions):
+        result['indexed'] += indexed
+        result['failed'] += len(failed)
+        for info in failed[:MAX_ERROR_SAMPLES - len(result['errors'])]:
+            result['errors'].append({
+                'id': info.get('_id'),
+                'status': info.get('status'),
+                'error': str(info.get('error', 'unknown'))
+            })
+        if progress:
+            progress(result['indexed'], result['failed'], bulk=indexer.stats())
+
+    result['duration_ms'] = int((time.monotonic() - started) * 1000)
+    result['bulk'] = indexer.stats()
+    result['stages_ms'] = {stage: int(seconds * 1000) for stage, seconds in timings.items()}
+    result['stages_ms']['bulk'] = result['bulk']['request_ms']
+    return result
@@ -0,0 +1,115 @@
+"""
+JSON encoding for API responses and Redis cache entries
+
+Uses orjson when it is installed and the stdlib json module otherwise.
+Both encode MongoDB documents as they come: ObjectIds, UUIDs and Decimals
+become strings, datetimes and dates ISO 8601 strings (naive datetimes are
+UTC, as stored by the app, and get a +00:00 offset) and numpy values
+plain numbers and lists.
+
+JSONProvider plugs the codec into Flask (app.json), so jsonify(), the
+request JSON and the session cookie use it too.
+"""
+import json
+import uuid
+import decimal
+import dataclasses
+from datetime import date, datetime, timezone
+
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # stdlib json
+    orjson = None
+
+
+def _default(obj):
+    """Encode the types neither json nor orjson handle themselves"""
+    if isinstance(obj, (ObjectId, uuid.UUID, decimal.Decimal)):
+        return str(obj)
+    if isinstance(obj, datetime):
+        if obj.tzinfo is None:
+            obj = obj.replace(tzinfo=timezone.utc)
+        return obj.isoformat()
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, 'tolist'):  # numpy arrays and scalars
+        return obj.tolist()
+    if hasattr(obj, '__html__'):  # markupsafe.Markup
+        return str(obj.__html__())
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _stdlib_dumps(obj, sort_keys, indent):
+    if indent:
+        return json.dumps(obj, default=_default, sort_keys=sort_keys, indent=2)
+    return json.dumps(obj, default=_default, sort_keys=sort_keys, separators=(',', ':'))
+
+
+def dumpb(obj, sort_keys=False, indent=False):
+    """
+    Encode a value as UTF-8 JSON
+
+    Args:
+        obj: Value to encode
+        sort_keys (bool): Sort object keys
+        indent (bool): Pretty-print with two-space indentation
+
+    Returns:
+        bytes: Encoded JSON
+
+    Raises:
+        TypeError: If the value contains something that cannot be encoded
+    """
+    if orjson is not None:
+        option = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=_default, option=option)
+        except orjson.JSONEncodeError:
+            # Integers beyond 64 bits, nesting deeper than orjson allows
+            pass
+    return _stdlib_dumps(obj, sort_keys, indent).encode('utf-8')
+
+
+def dumps(obj, sort_keys=False, indent=False):
+    """dumpb() as a str (e.g. for Redis)"""
+    if orjson is None:
+        return _stdlib_dumps(obj, sort_keys, indent)
+    return dumpb(obj, sort_keys, indent).decode('utf-8')
+
+
+def loads(data):
+    """
+    Decode JSON from str or bytes
+
+    Raises:
+        json.JSONDecodeError: If the data is not valid JSON
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by dumpb() / loads()"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, sort_keys=kwargs.get('sort_keys', self.sort_keys), indent=bool(kwargs.get('indent')))
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            dumpb(obj, sort_keys=self.sort_keys, indent=indent) + b'\n', mimetype=self.mimetype
+        )
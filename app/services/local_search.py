@@ -0,0 +1,451 @@
+"""
+Local columnar search over uploaded files
+
+Fallback for /api/search when Elasticsearch is unavailable. Each upload
+is converted once into NumPy column files cached next to the uploads and
+opened memory-mapped. The ingestion worker builds them after indexing; a
+search builds at most MAX_BUILDS_PER_SEARCH missing ones and leaves the
+other uploads out (reported as pending):
+
+    timestamp.npy        epoch ms, sorted ascending (the time index)
+    row.npy              original row number of each sorted position
+    position.npy         sorted position of each original row
+    level/endpoint/server.npy    dictionary codes (-1 when missing)
+    status_code.npy, response_time_ms.npy    float64, NaN when missing
+    text.bin + text_offsets.npy  lower-cased message/endpoint/user agent
+    rows.bin + rows_offsets.npy  the documents as JSON lines
+
+Date ranges are binary searches on the time index; the other filters are
+vectorized scans of the selected range. Text matches rows containing any
+of the query's words, like the Elasticsearch multi_match query.
+"""
+import os
+import json
+import re
+import mmap
+import shutil
+import uuid
+from datetime import datetime
+from functools import lru_cache
+import numpy as np
+
+from .batch_parser import _parse_one
+from .ingestion import iter_document_batches
+
+
+FORMAT_VERSION = 1
+
+# Column stores a search builds for uploads that have none yet
+MAX_BUILDS_PER_SEARCH = int(os.getenv('LOCAL_SEARCH_MAX_BUILDS_PER_SEARCH', 1))
+
+CATEGORY_FIELDS = ('level', 'endpoint', 'server')
+NUMERIC_FIELDS = ('status_code', 'response_time_ms')
+TEXT_FIELDS = ('message', 'endpoint', 'user_agent')
+
+# Separators in the text and document blobs
+FIELD_SEPARATOR = '\x1f'
+ROW_SEPARATOR = '\x1e'
+
+# Words of a text query (standard analyzer-like: runs of letters/digits)
+WORD = re.compile(r'\w+')
+
+SORT_FIELDS = ('timestamp', 'level', 'endpoint', 'status_code', 'response_time_ms')
+
+
+class ColumnWriter:
+    """Collects parsed batches of one file and writes its column files"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.timestamps = []
+        self.categories = {name: [] for name in CATEGORY_FIELDS}
+        self.numbers = {name: [] for name in NUMERIC_FIELDS}
+        self.text_file = open(os.path.join(directory, 'text.bin'), 'wb')
+        self.rows_file = open(os.path.join(directory, 'rows.bin'), 'wb')
+        self.text_offsets = [np.zeros(1, dtype=np.int64)]
+        self.rows_offsets = [np.zeros(1, dtype=np.int64)]
+
+    def add_batch(self, batch):
+        """Add a batch_parser.ColumnBatch"""
+        def strings(name):
+            if name not in batch.columns:
+                return np.full(batch.size, '', dtype=object)
+            return batch.columns[name]
+
+        def numbers(name):
+            return batch.numeric.get(name, np.full(batch.size, np.nan))
+
+        self._add(
+            batch.timestamps,
+            {name: strings(name) for name in CATEGORY_FIELDS},
+            {name: numbers(name) for name in NUMERIC_FIELDS},
+            [strings(name).tolist() for name in TEXT_FIELDS]
+        )
+
+    def add_documents(self, documents):
+        """Add documents produced by ingestion.to_document()"""
+        def strings(name):
+            return np.array([str(doc.get(name, '')) for doc in documents], dtype=object)
+
+        def numbers(name):
+            values = [doc.get(name) for doc in documents]
+            return np.array([v if isinstance(v, (int, float)) else np.nan for v in values], dtype=np.float64)
+
+        self._add(
+            np.array([doc['@timestamp'].rstrip('Z') for doc in documents], dtype='datetime64[ms]'),
+            {name: strings(name) for name in CATEGORY_FIELDS},
+            {name: numbers(name) for name in NUMERIC_FIELDS},
+            [strings(name).tolist() for name in TEXT_FIELDS]
+        )
+
+    def _add(self, timestamps, categories, numbers, text_columns):
+        self.timestamps.append(timestamps.astype('datetime64[ms]').astype(np.int64))
+        for name, values in categories.items():
+            self.categories[name].append(values)
+        for name, values in numbers.items():
+            self.numbers[name].append(values)
+
+        rows = [FIELD_SEPARATOR.join(values) for values in zip(*text_columns)]
+        self._append_blob(self.text_file, self.text_offsets, rows, lower=True)
+
+    def add_sources(self, sources):
+        """Add the JSON documents of the last batch"""
+        self._append_blob(self.rows_file, self.rows_offsets, sources)
+
+    @staticmethod
+    def _append_blob(f, offsets, rows, lower=False):
+        text = ROW_SEPARATOR.join(rows) + ROW_SEPARATOR
+        if text.count(ROW_SEPARATOR) != len(rows):
+            text = ROW_SEPARATOR.join(row.replace(ROW_SEPARATOR, ' ') for row in rows) + ROW_SEPARATOR
+        data = (text.lower() if lower else text).encode('utf-8')
+        # Row boundaries come from the separator positions in the encoded bytes
+        ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord(ROW_SEPARATOR)) + 1
+        offsets.append(ends + offsets[-1][-1])
+        f.write(data)
+
+    def finish(self, meta):
+        """Sort by timestamp and write the column files"""
+        self.text_file.close()
+        self.rows_file.close()
+
+        timestamps = np.concatenate(self.timestamps) if self.timestamps else np.empty(0, dtype=np.int64)
+        order = np.argsort(timestamps, kind='stable')
+        position = np.empty_like(order)
+        position[order] = np.arange(len(order))
+
+        self._save('timestamp', timestamps[order])
+        self._save('row', order)
+        self._save('position', position)
+        self._save('text_offsets', np.concatenate(self.text_offsets))
+        self._save('rows_offsets', np.concatenate(self.rows_offsets))
+
+        dictionaries = {}
+        for name, chunks in self.categories.items():
+            values = np.concatenate(chunks).astype(str) if chunks else np.empty(0, dtype=str)
+            vocabulary, codes = np.unique(values, return_inverse=True)
+            codes = codes.reshape(-1).astype(np.int32)
+            vocabulary = vocabulary.tolist()
+            if vocabulary and vocabulary[0] == '':
+                # Missing values sort first as ''; store them as -1
+                codes -= 1
+                vocabulary = vocabulary[1:]
+            dictionaries[name] = vocabulary
+            self._save(name, codes[order])
+
+        for name, chunks in self.numbers.items():
+            values = np.concatenate(chunks).astype(np.float64) if chunks else np.empty(0)
+            self._save(name, values[order])
+
+        meta.update({'version': FORMAT_VERSION, 'rows': int(len(timestamps)), 'dictionaries': dictionaries})
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def _save(self, name, array):
+        np.save(os.path.join(self.directory, f'{name}.npy'), array)
+
+
+def is_built(cache_dir, file_id):
+    """Whether an upload's column files exist in the current format"""
+    return _is_current(os.path.join(cache_dir, file_id))
+
+
+def build(cache_dir, file_doc):
+    """
+    Convert an upload into column files (no-op if already built)
+
+    The columns are written to a temporary directory that is renamed into
+    place, so readers never see a partial build.
+
+    Returns:
+        str: Directory of the column files
+    """
+    directory = os.path.join(cache_dir, file_doc['_id'])
+    if _is_current(directory):
+        return directory
+
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_dir = os.path.join(cache_dir, f'.{file_doc["_id"]}.{uuid.uuid4().hex}.tmp')
+    os.makedirs(temp_dir)
+    try:
+        writer = ColumnWriter(temp_dir)
+        for sources, _ in iter_document_batches(file_doc['file_path'], file_doc['file_type'], collector=writer):
+            writer.add_sources(sources)
+        writer.finish({'file_id': file_doc['_id'], 'built_at': datetime.utcnow().isoformat() + 'Z'})
+
+        if os.path.isdir(directory):
+            # Outdated format
+            shutil.rmtree(directory, ignore_errors=True)
+        try:
+            os.rename(temp_dir, directory)
+        except OSError:
+            # Built concurrently by another request
+            if not _is_current(directory):
+                raise
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return directory
+
+
+def discard(cache_dir, file_id):
+    """Delete the column files of an upload"""
+    shutil.rmtree(os.path.join(cache_dir, file_id), ignore_errors=True)
+    _open.cache_clear()
+
+
+def _is_current(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            return json.load(f).get('version') == FORMAT_VERSION
+    except (OSError, ValueError):
+        return False
+
+
+class ColumnStore:
+    """Memory-mapped column files of one upload"""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.file_id = self.meta['file_id']
+        self.dictionaries = self.meta['dictionaries']
+        self.columns = {
+            name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+            for name in ('timestamp', 'row', 'position', 'text_offsets', 'rows_offsets')
+            + CATEGORY_FIELDS + NUMERIC_FIELDS
+        }
+        self.text = _map(os.path.join(directory, 'text.bin'))
+        self.rows = _map(os.path.join(directory, 'rows.bin'))
+
+    def match(self, filters):
+        """
+        Sorted positions of the rows matching all filters
+
+        Args:
+            filters (dict): level, endpoint, server (exact), status_class
+                (2/4/5), status_code, date_from/date_to (epoch ms), terms
+                (lower-case words, any of which must occur)
+        """
+        timestamps = self.columns['timestamp']
+        low = np.searchsorted(timestamps, filters['date_from'], 'left') if filters.get('date_from') is not None else 0
+        high = np.searchsorted(timestamps, filters['date_to'], 'right') if filters.get('date_to') is not None else len(timestamps)
+        if low >= high:
+            return np.empty(0, dtype=np.int64)
+
+        mask = np.ones(high - low, dtype=bool)
+        for name in CATEGORY_FIELDS:
+            value = filters.get(name)
+            if value:
+                try:
+                    code = self.dictionaries[name].index(value)
+                except ValueError:
+                    return np.empty(0, dtype=np.int64)
+                mask &= self.columns[name][low:high] == code
+
+        status = self.columns['status_code'][low:high]
+        if filters.get('status_class'):
+            mask &= (status >= filters['status_class'] * 100) & (status < (filters['status_class'] + 1) * 100)
+        if filters.get('status_code'):
+            mask &= status == filters['status_code']
+
+        if filters.get('terms') and mask.any():
+            positions = self.columns['position'][self._text_rows(filters['terms'])]
+            positions = positions[(positions >= low) & (positions < high)]
+            text_mask = np.zeros(high - low, dtype=bool)
+            text_mask[positions - low] = True
+            mask &= text_mask
+
+        return low + np.flatnonzero(mask)
+
+    def _text_rows(self, terms):
+        """Original row numbers whose text contains any of `terms` as a word"""
+        if self.text is None:
+            return np.empty(0, dtype=np.int64)
+        offsets = self.columns['text_offsets']
+        rows = set()
+        for term in terms:
+            needle = term.encode('utf-8')
+            found = self.text.find(needle)
+            while found != -1:
+                end = found + len(needle)
+                row = int(np.searchsorted(offsets, found, 'right')) - 1
+                if _word_boundary(self.text, found - 1) and _word_boundary(self.text, end):
+                    rows.add(row)
+                    # Continue with the next row
+                    found = self.text.find(needle, int(offsets[row + 1]))
+                else:
+                    found = self.text.find(needle, found + 1)
+        return np.array(sorted(rows), dtype=np.int64)
+
+    def sort_keys(self, name, positions):
+        """Raw sort values of `positions`"""
+        if name in CATEGORY_FIELDS:
+            return np.asarray(self.columns[name][positions])
+        return np.asarray(self.columns[name][positions]).astype(np.float64)
+
+    def document(self, position):
+        """The JSON document at a sorted position, with its ES-style _id"""
+        row = int(self.columns['row'][position])
+        offsets = self.columns['rows_offsets']
+        raw = self.rows[int(offsets[row]):int(offsets[row + 1]) - 1]
+        doc = json.loads(raw)
+        doc['_id'] = f'{self.file_id}-{row}'
+        return doc
+
+
+def _word_boundary(text, index):
+    """Whether the byte at `index` does not continue a word"""
+    if index < 0 or index >= len(text):
+        return True
+    byte = text[index]
+    # Non-ASCII bytes belong to multi-byte letters
+    return byte < 0x80 and not (chr(byte).isalnum() or byte == ord('_'))
+
+
+def _map(path):
+    """Read-only mmap of a blob, or None if it is empty"""
+    if not os.path.getsize(path):
+        return None
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@lru_cache(maxsize=64)
+def _open(directory, built_at):
+    return ColumnStore(directory)
+
+
+def open_store(cache_dir, file_doc):
+    """Build (if needed) and open the column store of an upload"""
+    directory = build(cache_dir, file_doc)
+    with open(os.path.join(directory, 'meta.json')) as f:
+        built_at = json.load(f)['built_at']
+    return _open(directory, built_at)
+
+
+def parse_filters(level='', date_from='', date_to='', endpoint='', status_code='', server='', text=''):
+    """
+    Convert /api/search parameters into ColumnStore filters
+
+    Raises:
+        ValueError: On an invalid date or status code
+    """
+    filters = {
+        'level': level if level and level != 'ALL' else None,
+        'endpoint': endpoint or None,
+        'server': server or None,
+        'terms': WORD.findall(text.lower()) if text else None
+    }
+    if status_code in ('2xx', '4xx', '5xx'):
+        filters['status_class'] = int(status_code[0])
+    elif status_code:
+        try:
+            filters['status_code'] = int(status_code)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid status_code: {status_code}')
+
+    for name, value in (('date_from', date_from), ('date_to', date_to)):
+        if not value:
+            continue
+        moment = _parse_one(value)
+        if np.isnat(moment):
+            raise ValueError(f'Invalid {name}: {value}')
+        if name == 'date_to' and len(value.strip()) == 10:
+            # A bare date includes the whole day
+            moment = moment + np.timedelta64(1, 'D') - np.timedelta64(1, 'ms')
+        filters[name] = int(moment.astype(np.int64))
+    return filters
+
+
+def search(cache_dir, file_docs, filters, page=1, per_page=50, sort_field='timestamp', sort_order='desc'):
+    """
+    Search uploaded files with the column stores
+
+    Uploads without column files are built (at most MAX_BUILDS_PER_SEARCH
+    of them) or left out and counted as pending.
+
+    Returns:
+        dict: {'results', 'total', 'pending'} for the requested page
+    """
+    sort_field = sort_field if sort_field in SORT_FIELDS else 'timestamp'
+    descending = sort_order == 'desc'
+
+    stores = []
+    matches = []
+    builds = pending = 0
+    for file_doc in file_docs:
+        if not is_built(cache_dir, file_doc['_id']):
+            if builds >= MAX_BUILDS_PER_SEARCH:
+                pending += 1
+                continue
+            builds += 1
+        try:
+            store = open_store(cache_dir, file_doc)
+        except Exception as e:
+            print(f"Local search skipped {file_doc.get('_id')}: {e}")
+            continue
+        positions = store.match(filters)
+        if len(positions):
+            stores.append(store)
+            matches.append(positions)
+
+    total = int(sum(len(positions) for positions in matches))
+    if not total:
+        return {'results': [], 'total': 0, 'pending': pending}
+
+    keys = _sort_keys(stores, matches, sort_field, descending)
+    store_index = np.concatenate([np.full(len(p), i) for i, p in enumerate(matches)])
+    positions = np.concatenate(matches)
+
+    start = (page - 1) * per_page
+    if start >= total:
+        return {'results': [], 'total': total, 'pending': pending}
+    end = min(start + per_page, total)
+    if end < total:
+        # Only the requested page needs to be in order
+        candidates = np.argpartition(keys, end - 1)[:end]
+        page_order = candidates[np.argsort(keys[candidates], kind='stable')][start:end]
+    else:
+        page_order = np.argsort(keys, kind='stable')[start:end]
+
+    results = [stores[store_index[i]].document(positions[i]) for i in page_order.tolist()]
+    return {'results': results, 'total': total, 'pending': pending}
+
+
+def _sort_keys(stores, matches, sort_field, descending):
+    """One float key per match; ascending order of the keys is the result order"""
+    if sort_field in CATEGORY_FIELDS:
+        # Rank of each store's dictionary values in the combined vocabulary
+        vocabulary = sorted(set().union(*(store.dictionaries[sort_field] for store in stores)))
+        ranks = {value: rank for rank, value in enumerate(vocabulary)}
+        parts = []
+        for store, positions in zip(stores, matches):
+            lookup = np.array([ranks[value] for value in store.dictionaries[sort_field]] + [np.nan])
+            # Code -1 (missing) maps to the trailing NaN
+            parts.append(lookup[store.sort_keys(sort_field, positions)])
+        keys = np.concatenate(parts)
+    else:
+        keys = np.concatenate([store.sort_keys(sort_field, p) for store, p in zip(stores, matches)])
+
+    # Missing values sort last in both directions, as in Elasticsearch
+    keys = -keys if descending else keys
+    return np.where(np.isnan(keys), np.inf, keys)
@@ -0,0 +1,559 @@
+"""
+Elasticsearch queries behind the dashboard, search and log endpoints
+
+Request bodies are built and responses shaped here so that the Flask
+views (app.py) and the asyncio views (asgi.py) send the same queries and
+return the same JSON; only the client calls differ.
+"""
+from datetime import datetime, timedelta
+
+
+LOG_INDEX = 'saas-logs-*'
+
+STATS_CACHE_KEY = 'stats:dashboard'
+STATS_CACHE_TTL = 30  # seconds
+
+# Incremented whenever the app adds or removes logs (ETags of log endpoints)
+GENERATION_KEY = 'generation:logs'
+
+SEARCH_SORT_FIELDS = {
+    'timestamp': 'timestamp',
+    'level': 'level.keyword',
+    'endpoint': 'endpoint.keyword',
+    'status_code': 'status_code',
+    'response_time_ms': 'response_time_ms'
+}
+
+
+def bump_generation(redis_client):
+    """Mark the log data as changed (uploads ingested or deleted)"""
+    redis_client.incr(GENERATION_KEY)
+
+
+def empty_stats():
+    """/api/stats response before any query has run"""
+    return {
+        'timestamp': datetime.utcnow().isoformat(),
+        'total_logs': 0,
+        'total_logs_24h': 0,
+        'error_rate': 0,
+        'avg_response_time': 0,
+        'top_slowest_endpoints': [],
+        'active_users': 0,
+        'latest_error': None,
+        'files_uploaded': 0,
+        'system_status': {
+            'elasticsearch': 'unknown',
+            'mongodb': 'unknown',
+            'redis': 'unknown',
+            'overall': 'degraded'
+        },
+        'indices': [],
+        'hourly_trends': {
+            'logs': [],
+            'errors': [],
+            'response_times': []
+        },
+        'error': None
+    }
+
+
+def stats_requests(now=None):
+    """
+    Elasticsearch requests behind /api/stats
+
+    They are independent of each other and can be sent concurrently.
+
+    Returns:
+        dict: name -> (client method, 'count' or 'search', request body)
+    """
+    now = now or datetime.utcnow()
+    last_24h_str = (now - timedelta(hours=24)).isoformat()
+    last_24h = {"range": {"timestamp": {"gte": last_24h_str}}}
+
+    return {
+        # Total logs (all time)
+        'total': ('count', None),
+        # Total logs (last 24 hours)
+        'total_24h': ('count', {"query": last_24h}),
+        # 5xx errors (last 24 hours)
+        'errors_24h': ('count', {
+            "query": {
+                "bool": {
+                    "must": [
+                        last_24h,
+                        {"range": {"status_code": {"gte": 500, "lt": 600}}}
+                    ]
+                }
+            }
+        }),
+        # Average response time (last 24h)
+        'avg_response': ('search', {
+            "query": last_24h,
+            "aggs": {
+                "avg_response": {
+                    "avg": {
+                        "field": "response_time_ms"
+                    }
+                }
+            },
+            "size": 0
+        }),
+        # Top 3 slowest endpoints
+        'slowest_endpoints': ('search', {
+            "query": last_24h,
+            "aggs": {
+                "endpoints": {
+                    "terms": {
+                        "field": "endpoint.keyword",
+                        "size": 3,
+                        "order": {
+                            "avg_response": "desc"
+                        }
+                    },
+                    "aggs": {
+                        "avg_response": {
+                            "avg": {
+                                "field": "response_time_ms"
+                            }
+                        }
+                    }
+                }
+            },
+            "size": 0
+        }),
+        # Active users (unique user_ids, last 24h)
+        'active_users': ('search', {
+            "query": {
+                "bool": {
+                    "must": [
+                        last_24h,
+                        {"exists": {"field": "user_id"}}
+                    ]
+                }
+            },
+            "aggs": {
+                "unique_users": {
+                    "cardinality": {
+                        "field": "user_id.keyword"
+                    }
+                }
+            },
+            "size": 0
+        }),
+        # Latest error (most recent ERROR or CRITICAL log)
+        'latest_error': ('search', {
+            "query": {
+                "bool": {
+                    "should": [
+                        {"term": {"level.keyword": "ERROR"}},
+                        {"term": {"level.keyword": "CRITICAL"}}
+                    ],
+                    "minimum_should_match": 1
+                }
+            },
+            "sort": [{"timestamp": {"order": "desc"}}],
+            "size": 1
+        }),
+        # Hourly trends for the last 24 hours (sparkline charts)
+        'hourly_trends': ('search', {
+            "query": last_24h,
+            "aggs": {
+                "hourly": {
+                    "date_histogram": {
+                        "field": "timestamp",
+                        "fixed_interval": "1h",
+                        "min_doc_count": 0,
+                        "extended_bounds": {
+                            "min": last_24h_str,
+                            "max": now.isoformat()
+                        }
+                    },
+                    "aggs": {
+                        "error_count": {
+                            "filter": {
+                                "range": {
+                                    "status_code": {
+                                        "gte": 500,
+                                        "lt": 600
+                                    }
+                                }
+                            }
+                        },
+                        "avg_response": {
+                            "avg": {
+                                "field": "response_time_ms"
+                            }
+                        }
+                    }
+                }
+            },
+            "size": 0
+        }),
+    }
+
+
+def apply_stats_results(stats, results):
+    """
+    Fill the /api/stats response from the responses to stats_requests()
+
+    Args:
+        stats (dict): Response from empty_stats()
+        results (dict): name -> Elasticsearch response
+    """
+    stats['total_logs'] = results['total'].get('count', 0)
+    stats['total_logs_24h'] = results['total_24h'].get('count', 0)
+
+    # Error rate: (5xx errors / total requests) * 100
+    error_count = results['errors_24h'].get('count', 0)
+    if stats['total_logs_24h'] > 0:
+        stats['error_rate'] = round((error_count / stats['total_logs_24h']) * 100, 2)
+
+    avg_value = results['avg_response'].get('aggregations', {}).get('avg_response', {}).get('value')
+    stats['avg_response_time'] = round(avg_value, 0) if avg_value else 0
+
+    for bucket in results['slowest_endpoints'].get('aggregations', {}).get('endpoints', {}).get('buckets', []):
+        stats['top_slowest_endpoints'].append({
+            'endpoint': bucket.get('key'),
+            'avg_response_time': round(bucket.get('avg_response', {}).get('value', 0), 0),
+            'count': bucket.get('doc_count', 0)
+        })
+
+    stats['active_users'] = results['active_users'].get('aggregations', {}).get('unique_users', {}).get('value', 0)
+
+    latest_error = results['latest_error']['hits']['hits']
+    if latest_error:
+        error_log = latest_error[0]['_source']
+        stats['latest_error'] = {
+            'timestamp': error_log.get('timestamp'),
+            'level': error_log.get('level'),
+            'message': error_log.get('message'),
+            'endpoint': error_log.get('endpoint'),
+            'status_code': error_log.get('status_code')
+        }
+
+    for bucket in results['hourly_trends'].get('aggregations', {}).get('hourly', {}).get('buckets', []):
+        stats['hourly_trends']['logs'].append(bucket.get('doc_count', 0))
+        stats['hourly_trends']['errors'].append(bucket.get('error_count', {}).get('doc_count', 0))
+        avg_resp = bucket.get('avg_response', {}).get('value')
+        stats['hourly_trends']['response_times'].append(round(avg_resp, 0) if avg_resp else 0)
+
+
+def apply_system_status(stats):
+    """Set the overall status from the Elasticsearch, MongoDB and Redis ones"""
+    system_status = stats['system_status']
+    all_healthy = all(
+        system_status[service] == 'healthy'
+        for service in ('elasticsearch', 'mongodb', 'redis')
+    )
+    system_status['overall'] = 'healthy' if all_healthy else 'degraded'
+
+
+def index_summaries(indices):
+    """Name, document count and size of each log index (from cat.indices)"""
+    return [
+        {
+            'name': index.get('index'),
+            'docs_count': index.get('docs.count', 0),
+            'size': index.get('store.size', 'N/A')
+        }
+        for index in indices
+    ]
+
+
+def parse_search_params(data):
+    """
+    /api/search parameters from the JSON request body
+
+    Raises:
+        ValueError: If page, per_page or status_code are not numbers
+    """
+    return {
+        'q': data.get('q', '').strip(),
+        'level': data.get('level', ''),
+        'date_from': data.get('date_from', ''),
+        'date_to': data.get('date_to', ''),
+        'endpoint': data.get('endpoint', ''),
+        'status_code': data.get('status_code', ''),
+        'server': data.get('server', ''),
+        'page': int(data.get('page', 1)),
+        'per_page': int(data.get('per_page', 50)),
+        'sort_field': data.get('sort_field', 'timestamp'),
+        'sort_order': data.get('sort_order', 'desc'),
+    }
+
+
+def local_search_params(params):
+    """Filters for local_search.parse_filters() from /api/search parameters"""
+    return {
+        'level': params['level'], 'date_from': params['date_from'], 'date_to': params['date_to'],
+        'endpoint': params['endpoint'], 'status_code': params['status_code'], 'server': params['server'],
+        'text': params['q']
+    }
+
+
+def search_body(params):
+    """
+    Elasticsearch request body for /api/search
+
+    Raises:
+        ValueError: If status_code is not a number or class (2xx, 4xx, 5xx)
+    """
+    must_conditions = []
+    filter_conditions = []
+
+    # Search query in message field
+    if params['q']:
+        must_conditions.append({
+            "multi_match": {
+                "query": params['q'],
+                "fields": ["message", "endpoint", "user_agent"],
+                "type": "best_fields",
+                "operator": "or"
+            }
+        })
+
+    # Log level filter
+    if params['level'] and params['level'] != 'ALL':
+        filter_conditions.append({
+            "term": {"level.keyword": params['level']}
+        })
+
+    # Date range filter
+    if params['date_from'] or params['date_to']:
+        date_range = {}
+        if params['date_from']:
+            date_range["gte"] = params['date_from']
+        if params['date_to']:
+            date_range["lte"] = params['date_to']
+        filter_conditions.append({
+            "range": {"timestamp": date_range}
+        })
+
+    # Endpoint filter
+    if params['endpoint']:
+        filter_conditions.append({
+            "term": {"endpoint.keyword": params['endpoint']}
+        })
+
+    # Status code filter
+    status_code = params['status_code']
+    if status_code:
+        if status_code == '2xx':
+            filter_conditions.append({"range": {"status_code": {"gte": 200, "lt": 300}}})
+        elif status_code == '4xx':
+            filter_conditions.append({"range": {"status_code": {"gte": 400, "lt": 500}}})
+        elif status_code == '5xx':
+            filter_conditions.append({"range": {"status_code": {"gte": 500, "lt": 600}}})
+        else:
+            filter_conditions.append({"term": {"status_code": int(status_code)}})
+
+    # Server filter
+    if params['server']:
+        filter_conditions.append({
+            "term": {"server.keyword": params['server']}
+        })
+
+    if must_conditions or filter_conditions:
+        query = {
+            "query": {
+                "bool": {
+                    "must": must_conditions if must_conditions else [{"match_all": {}}],
+                    "filter": filter_conditions
+                }
+            }
+        }
+    else:
+        query = {
+            "query": {"match_all": {}}
+        }
+
+    sort_es_field = SEARCH_SORT_FIELDS.get(params['sort_field'], 'timestamp')
+    query["sort"] = [{sort_es_field: {"order": params['sort_order']}}]
+
+    query["from"] = (params['page'] - 1) * params['per_page']
+    query["size"] = params['per_page']
+    return query
+
+
+def search_payload(result, page, per_page):
+    """/api/search response from the Elasticsearch response"""
+    results = hits_to_logs(result, with_index=False)
+    total = result['hits']['total']['value']
+    return {
+        'success': True,
+        'results': results,
+        'total': total,
+        'page': page,
+        'pages': (total + per_page - 1) // per_page,
+        'per_page': per_page
+    }
+
+
+def hits_to_logs(result, with_index=True):
+    """Log documents of a search response, with their _id (and _index)"""
+    logs = []
+    for hit in result['hits']['hits']:
+        log_entry = hit['_source']
+        log_entry['_id'] = hit['_id']
+        if with_index:
+            log_entry['_index'] = hit['_index']
+        logs.append(log_entry)
+    return logs
+
+
+def endpoints_body():
+    """Unique endpoints for the search filter dropdown"""
+    return {
+        "size": 0,
+        "aggs": {
+            "unique_endpoints": {
+                "terms": {
+                    "field": "endpoint.keyword",
+                    "size": 100
+                }
+            }
+        }
+    }
+
+
+def endpoints_payload(result):
+    return {
+        'success': True,
+        'endpoints': [bucket['key'] for bucket in result['aggregations']['unique_endpoints']['buckets']]
+    }
+
+
+def recent_logs_body():
+    """The 50 most recent logs"""
+    return {
+        "query": {"match_all": {}},
+        "sort": [{"@timestamp": {"order": "desc"}}],
+        "size": 50
+    }
+
+
+def recent_logs_payload(result):
+    return {
+        'total': result['hits']['total']['value'],
+        'logs': hits_to_logs(result)
+    }
+
+
+def levels_body():
+    """Log count per level"""
+    return {
+        "size": 0,
+        "aggs": {
+            "levels": {
+                "terms": {
+                    "field": "level.keyword",
+                    "size": 10
+                }
+            }
+        }
+    }
+
+
+def levels_payload(result):
+    return {
+        'levels': [
+            {'level': bucket['key'], 'count': bucket['doc_count']}
+            for bucket in result['aggregations']['levels']['buckets']
+        ]
+    }
+
+
+def parse_log_search_args(args):
+    """
+    /api/logs/search parameters from the query string
+
+    Raises:
+        ValueError: If page or per_page are not numbers
+    """
+    return {
+        'page': int(args.get('page', 1)),
+        'per_page': int(args.get('per_page', 50)),
+        'level': args.get('level', ''),
+        'start_date': args.get('start_date', ''),
+        'end_date': args.get('end_date', ''),
+        'endpoint': args.get('endpoint', ''),
+        'q': args.get('q', ''),
+    }
+
+
+def log_search_body(params):
+    """Elasticsearch request body for /api/logs/search"""
+    must_conditions = []
+
+    # Add log level filter
+    if params['level']:
+        must_conditions.append({
+            "term": {"level.keyword": params['level']}
+        })
+
+    # Add endpoint filter
+    if params['endpoint']:
+        must_conditions.append({
+            "match": {"endpoint": params['endpoint']}
+        })
+
+    # Add date range filter
+    if params['start_date'] or params['end_date']:
+        date_range = {}
+        if params['start_date']:
+            date_range["gte"] = params['start_date']
+        if params['end_date']:
+            date_range["lte"] = params['end_date']
+
+        must_conditions.append({
+            "range": {"@timestamp": date_range}
+        })
+
+    # Add text search
+    if params['q']:
+        must_conditions.append({
+            "multi_match": {
+                "query": params['q'],
+                "fields": ["message", "endpoint", "user_id"]
+            }
+        })
+
+    return {
+        "query": {
+            "bool": {
+                "must": must_conditions if must_conditions else [{"match_all": {}}]
+            }
+        },
+        "sort": [{"@timestamp": {"order": "desc"}}],
+        "from": (params['page'] - 1) * params['per_page'],
+        "size": params['per_page']
+    }
+
+
+def log_search_payload(result, page, per_page):
+    """/api/logs/search response from the Elasticsearch response"""
+    total = result['hits']['total']['value']
+    total_pages = (total + per_page - 1) // per_page
+    return {
+        'success': True,
+        'logs': hits_to_logs(result),
+        'pagination': {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'total_pages': total_pages,
+            'has_next': page < total_pages,
+            'has_prev': page > 1
+        }
+    }
+
+
+def falls_back_to_local(error):
+    """
+    Whether a failed /api/search should be answered from the local column stores
+
+    Connection failures and cluster errors (5xx) do; bad requests do not.
+    """
+    status_code = getattr(error, 'status_code', None)
+    return not isinstance(status_code, int) or status_code >= 500
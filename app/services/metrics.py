@@ -0,0 +1,88 @@
+"""
+In-process metrics
+
+Thread-safe counters, gauges and timers kept per process and served by
+/api/metrics. Timers record a count, total, maximum and a histogram of
+durations in milliseconds.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+
+# Upper bounds (ms) of the timer histogram buckets; a last bucket holds the rest
+TIMER_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timers = {}
+
+
+def increment(name, value=1):
+    """Add `value` to a counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    """Set a gauge to its current value"""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, seconds):
+    """Record one duration for a timer"""
+    ms = seconds * 1000.0
+    with _lock:
+        timer = _timers.get(name)
+        if timer is None:
+            timer = _timers[name] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                     'buckets': [0] * (len(TIMER_BUCKETS_MS) + 1)}
+        timer['count'] += 1
+        timer['total_ms'] += ms
+        timer['max_ms'] = max(timer['max_ms'], ms)
+        bucket = next((i for i, bound in enumerate(TIMER_BUCKETS_MS) if ms <= bound), len(TIMER_BUCKETS_MS))
+        timer['buckets'][bucket] += 1
+
+
+@contextmanager
+def timed(name):
+    """Time the enclosed block into a timer"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def snapshot():
+    """
+    Current values of all metrics
+
+    Returns:
+        dict: {'counters', 'gauges', 'timers'}
+    """
+    with _lock:
+        timers = {
+            name: {
+                'count': timer['count'],
+                'total_ms': round(timer['total_ms'], 1),
+                'avg_ms': round(timer['total_ms'] / timer['count'], 2) if timer['count'] else None,
+                'max_ms': round(timer['max_ms'], 1),
+                'histogram': [
+                    {'le': bound, 'count': count}
+                    for bound, count in zip(list(TIMER_BUCKETS_MS) + [None], timer['buckets'])
+                ]
+            }
+            for name, timer in _timers.items()
+        }
+        return {'counters': dict(_counters), 'gauges': dict(_gauges), 'timers': timers}
+
+
+def reset():
+    """Clear all metrics"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timers.clear()
@@ -0,0 +1,104 @@
+"""
+Startup database migrations
+
+Index creation for the `users` and `files` collections, run once per
+process before its first MongoDB query (or explicitly before starting
+the app) instead of on every request. Applied migrations are recorded
+in the `migrations` collection and skipped afterwards; a failed
+migration is logged, left unrecorded and retried at the next start.
+
+Usage:
+    python -m services.migrations
+"""
+import os
+import threading
+from datetime import datetime
+from pymongo import ASCENDING
+
+from . import dedup, upload_catalog
+
+
+def users_unique_indexes(db):
+    """Unique usernames and emails (bulk imports rely on them for duplicates)"""
+    db['users'].create_index([('username', ASCENDING)], unique=True)
+    db['users'].create_index([('email', ASCENDING)], unique=True)
+
+
+def files_dedup_indexes(db):
+    dedup.ensure_indexes(db['files'])
+
+
+def files_catalog_indexes(db):
+    upload_catalog.ensure_indexes(db['files'])
+
+
+def files_dedup_retry_failed(db):
+    """Let uploads whose ingestion failed be uploaded again"""
+    dedup.drop_legacy_index(db['files'])
+    dedup.ensure_indexes(db['files'])
+
+
+# Applied in order; never rename an entry, add new ones at the end
+MIGRATIONS = [
+    ('0001_users_unique_indexes', users_unique_indexes),
+    ('0002_files_dedup_indexes', files_dedup_indexes),
+    ('0003_files_catalog_indexes', files_catalog_indexes),
+    ('0004_files_dedup_retry_failed', files_dedup_retry_failed),
+]
+
+
+def run(db):
+    """
+    Apply the migrations not yet recorded in `db`
+
+    Returns:
+        list: Names of the migrations applied now
+    """
+    records = db['migrations']
+    done = {record['_id'] for record in records.find({}, {'_id': 1})}
+    applied = []
+    for name, migration in MIGRATIONS:
+        if name in done:
+            continue
+        try:
+            migration(db)
+        except Exception as e:
+            print(f"Migration {name} failed: {e}")
+            continue
+        records.update_one(
+            {'_id': name},
+            {'$setOnInsert': {'applied_at': datetime.utcnow().isoformat() + 'Z'}},
+            upsert=True
+        )
+        applied.append(name)
+    if applied:
+        print(f"Applied migrations: {', '.join(applied)}")
+    return applied
+
+
+_applied = {'pid': None}
+_lock = threading.Lock()
+
+
+def run_once(db):
+    """
+    run() on the first call in this process (and again after it raised)
+
+    Raises:
+        pymongo.errors.PyMongoError: If the applied migrations cannot be read
+    """
+    pid = os.getpid()
+    if _applied['pid'] == pid:
+        return
+    with _lock:
+        if _applied['pid'] != pid:
+            run(db)
+            _applied['pid'] = pid
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from .database import get_database
+
+    load_dotenv()
+    run(get_database())
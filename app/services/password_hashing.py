@@ -0,0 +1,266 @@
+"""
+Password hashing off the request threads
+
+bcrypt hashing and verification run in a dedicated process pool so that a
+burst of logins does not hold every request worker for 100-300ms of CPU
+each. The number of jobs waiting or running is bounded: when the pool is
+saturated new jobs are refused at once with HashingBusy, which the API
+turns into a 503. The bcrypt cost is configurable; hashes made with
+another cost are replaced at the next successful login (see User).
+
+The pool and its limits are per process: every gunicorn worker has its
+own PASSWORD_HASH_WORKERS processes and PASSWORD_HASH_MAX_QUEUE slots, so
+a host runs up to GUNICORN_WORKERS x PASSWORD_HASH_WORKERS bcrypt
+processes. Size both with the worker count in mind (e.g. one or two
+hashing processes per worker when there are as many workers as cores).
+"""
+import os
+import time
+import threading
+import bcrypt
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from . import metrics
+
+
+# bcrypt cost factor (log2 rounds) for new hashes
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+# Hashing processes per web worker process (0 hashes on the request thread)
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', min(os.cpu_count() or 1, 4)))
+# Jobs allowed to wait or run at once in each worker process before new ones are refused
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', 32))
+# Seconds a request waits for its hash before giving up
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+# Job slots a bulk user import may take at once (the rest stay free for logins)
+PASSWORD_BULK_HASH_SLOTS = int(os.getenv('PASSWORD_BULK_HASH_SLOTS', max(1, PASSWORD_HASH_MAX_QUEUE // 2)))
+
+# Suggested client delay when the pool is saturated
+RETRY_AFTER_SECONDS = 1
+
+
+class HashingBusy(Exception):
+    """The hashing pool is saturated; the request should be retried later"""
+
+
+def _hash(password, rounds):
+    """Hash a password (pool process), returning (hash, seconds)"""
+    started = time.perf_counter()
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+    return hashed, time.perf_counter() - started
+
+
+def _check(password, hashed):
+    """Verify a password (pool process), returning (matches, seconds)"""
+    started = time.perf_counter()
+    matches = bcrypt.checkpw(password, hashed)
+    return matches, time.perf_counter() - started
+
+
+_lock = threading.Lock()
+_pool = None
+_pending = 0
+# One bulk import hashes at a time in each process
+_bulk_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # A pool inherited from the parent process is unusable in the child
+    global _lock, _pool, _pending, _bulk_lock
+    _lock = threading.Lock()
+    _pool = None
+    _pending = 0
+    _bulk_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    return _pool
+
+
+def _acquire(count):
+    """Take up to `count` job slots, returning how many were free"""
+    global _pending
+    with _lock:
+        taken = max(0, min(count, PASSWORD_HASH_MAX_QUEUE - _pending))
+        _pending += taken
+        metrics.set_gauge('password_hash.pending', _pending)
+    if not taken:
+        metrics.increment('password_hash.rejected')
+    return taken
+
+
+def _release(_=None, count=1):
+    """Free job slots (also the done callback of a pool job)"""
+    global _pending
+    with _lock:
+        _pending -= count
+        metrics.set_gauge('password_hash.pending', _pending)
+
+
+def _discard_pool(pool):
+    """Start a new pool for the next jobs after a pool process died"""
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    metrics.increment('password_hash.pool_restarts')
+
+
+def _submit(operation, *args):
+    """
+    Submit a job holding a slot taken with _acquire()
+
+    The slot is released when the job is done or cancelled, so jobs left
+    running after a timeout still count against PASSWORD_HASH_MAX_QUEUE.
+
+    Returns:
+        tuple: (pool, future)
+    """
+    with _lock:
+        pool = _get_pool()
+    try:
+        future = pool.submit(operation, *args)
+    except BrokenProcessPool:
+        _release()
+        _discard_pool(pool)
+        raise HashingBusy('Password hashing unavailable, please retry')
+    future.add_done_callback(_release)
+    return pool, future
+
+
+def _wait(pool, future):
+    """(result, seconds) of a submitted job"""
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise HashingBusy('Password hashing unavailable, please retry')
+    except FutureTimeout:
+        # Drop the job if it is still queued; a running one frees its slot when done
+        future.cancel()
+        metrics.increment('password_hash.timeouts')
+        raise HashingBusy('Password hashing timed out, please retry')
+
+
+def _run(operation, *args):
+    """
+    Run a hashing operation in the pool, recording wait and hash times
+
+    Raises:
+        HashingBusy: If the pool is saturated or the job timed out
+    """
+    if PASSWORD_HASH_WORKERS <= 0:
+        result, seconds = operation(*args)
+        metrics.observe('password_hash.hash_time', seconds)
+        return result
+
+    if not _acquire(1):
+        raise HashingBusy('Too many authentication requests, please retry shortly')
+    submitted = time.perf_counter()
+    result, seconds = _wait(*_submit(operation, *args))
+
+    metrics.observe('password_hash.hash_time', seconds)
+    metrics.observe('password_hash.queue_wait', max(time.perf_counter() - submitted - seconds, 0.0))
+    return result
+
+
+def hash_password(password):
+    """
+    Hash a password with the configured bcrypt cost
+
+    Returns:
+        bytes: bcrypt hash
+
+    Raises:
+        HashingBusy: If the hashing pool is saturated
+    """
+    return _run(_hash, password.encode('utf-8'), BCRYPT_ROUNDS)
+
+
+def hash_passwords(passwords):
+    """
+    Hash many passwords (bulk user imports) in the shared hashing pool
+
+    Jobs are submitted in slices of at most PASSWORD_BULK_HASH_SLOTS (and
+    never more than the free slots), so logins keep the rest of the queue;
+    one import hashes at a time in each process.
+
+    Returns:
+        list: bcrypt hashes in the order of `passwords`
+
+    Raises:
+        HashingBusy: If another import is hashing or the pool is saturated
+    """
+    if not _bulk_lock.acquire(blocking=False):
+        metrics.increment('password_hash.rejected')
+        raise HashingBusy('Another user import is in progress, please retry shortly')
+    try:
+        encoded = [password.encode('utf-8') for password in passwords]
+        started = time.perf_counter()
+        if PASSWORD_HASH_WORKERS <= 0:
+            results = [_hash(password, BCRYPT_ROUNDS) for password in encoded]
+        else:
+            results = []
+            while len(results) < len(encoded):
+                batch = encoded[len(results):len(results) + PASSWORD_BULK_HASH_SLOTS]
+                results.extend(_hash_slice(batch))
+    finally:
+        _bulk_lock.release()
+    metrics.increment('password_hash.bulk_hashed', len(results))
+    metrics.observe('password_hash.bulk_time', time.perf_counter() - started)
+    return [hashed for hashed, _ in results]
+
+
+def _hash_slice(passwords):
+    """Hash as many of `passwords` as there are free slots, returning (hash, seconds) pairs"""
+    taken = _acquire(len(passwords))
+    if not taken:
+        raise HashingBusy('Too many authentication requests, please retry shortly')
+    unsubmitted = taken
+    jobs = []
+    try:
+        for password in passwords[:taken]:
+            unsubmitted -= 1
+            jobs.append(_submit(_hash, password, BCRYPT_ROUNDS))
+        return [_wait(pool, future) for pool, future in jobs]
+    except HashingBusy:
+        for _, future in jobs:
+            future.cancel()
+        raise
+    finally:
+        if unsubmitted:
+            _release(count=unsubmitted)
+
+
+def check_password(password, hashed):
+    """
+    Verify a password against a bcrypt hash
+
+    Raises:
+        HashingBusy: If the hashing pool is saturated
+    """
+    if isinstance(hashed, str):
+        hashed = hashed.encode('utf-8')
+    return _run(_check, password.encode('utf-8'), bytes(hashed))
+
+
+def cost_of(hashed):
+    """bcrypt cost factor of a hash ($2b$<cost>$...), or None"""
+    if isinstance(hashed, str):
+        hashed = hashed.encode('utf-8')
+    parts = bytes(hashed).split(b'$')
+    try:
+        return int(parts[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed):
+    """Check whether a hash was made with a cost other than BCRYPT_ROUNDS"""
+    return cost_of(hashed) != BCRYPT_ROUNDS
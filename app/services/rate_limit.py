@@ -0,0 +1,108 @@
+"""
+Redis token-bucket rate limiting
+
+Each bucket holds up to `burst` tokens and refills at `rate` tokens per
+second; a request takes one token from every bucket it is checked
+against (e.g. the client IP and the username), or from none if any of
+them is empty. The check is a single Lua script, so concurrent workers
+never overspend a bucket, and it uses the Redis clock so workers on
+different hosts agree on refills.
+"""
+import os
+import math
+from collections import namedtuple
+
+from . import metrics
+
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+
+Limit = namedtuple('Limit', ['burst', 'rate'])
+
+
+def _limit(name, burst, rate):
+    return Limit(
+        float(os.getenv(f'RATE_LIMIT_{name}_BURST', burst)),
+        float(os.getenv(f'RATE_LIMIT_{name}_RATE', rate))
+    )
+
+
+# Tokens per second: 0.5 = 30 per minute
+LIMITS = {
+    'login_ip': _limit('LOGIN_IP', 20, 0.5),
+    'login_user': _limit('LOGIN_USER', 5, 0.1),
+    'register_ip': _limit('REGISTER_IP', 5, 0.05),
+    'user_import': _limit('USER_IMPORT', 5, 0.05),
+}
+
+KEY_PREFIX = 'ratelimit'
+
+# KEYS: bucket keys; ARGV: burst_1, rate_1, burst_2, rate_2, ...
+# Returns {allowed (0/1), milliseconds until every bucket has a token}
+_TOKEN_BUCKET = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local burst = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(state[1])
+    if available == nil then
+        available = burst
+    else
+        available = math.min(burst, available + math.max(0, now - tonumber(state[2])) * rate / 1000)
+    end
+    tokens[i] = available
+    if available < 1 then
+        wait = math.max(wait, math.ceil((1 - available) * 1000 / rate))
+    end
+end
+local allowed = wait == 0 and 1 or 0
+for i, key in ipairs(KEYS) do
+    local burst = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    redis.call('HSET', key, 'tokens', tostring(tokens[i] - allowed), 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(burst * 1000 / rate) + 1000)
+end
+return {allowed, wait}
+"""
+
+_scripts = {}
+
+
+def check(redis_client, buckets):
+    """
+    Take a token from each bucket if all of them have one
+
+    Args:
+        redis_client (redis.Redis): Redis connection
+        buckets (list): (limit name in LIMITS, identifier) pairs, e.g.
+            [('login_ip', '10.0.0.1'), ('login_user', 'alice')]
+
+    Returns:
+        tuple: (allowed, seconds to wait before retrying)
+
+    Raises:
+        redis.RedisError: If Redis cannot be reached
+    """
+    if not RATE_LIMIT_ENABLED or not buckets:
+        return True, 0
+
+    script = _scripts.get(id(redis_client))
+    if script is None:
+        script = _scripts[id(redis_client)] = redis_client.register_script(_TOKEN_BUCKET)
+
+    keys = [f'{KEY_PREFIX}:{name}:{identifier}' for name, identifier in buckets]
+    args = []
+    for name, _ in buckets:
+        args.extend(LIMITS[name])
+    allowed, wait_ms = script(keys=keys, args=args)
+
+    scope = buckets[0][0].split('_')[0]
+    if allowed:
+        metrics.increment(f'rate_limit.{scope}.allowed')
+        return True, 0
+    metrics.increment(f'rate_limit.{scope}.rejected')
+    return False, max(1, math.ceil(int(wait_ms) / 1000))
@@ -0,0 +1,207 @@
+"""
+Server-side login sessions
+
+Sessions live in Redis as `session:<id>` (JSON, expiring after
+SESSION_TTL) and are indexed per user in `user_sessions:<user_id>` so all
+of a user's sessions can be revoked. The signed Flask cookie only carries
+the session ID; login_required validates it here on every request.
+
+Validated sessions are kept in a short-lived in-process cache so most
+requests skip the Redis round trip. Revocations are published on the
+`session:invalidate` channel and every process drops the session from its
+cache at once; if the subscription is down, cached entries still expire
+after SESSION_CACHE_TTL seconds.
+
+The same subscriber relays user changes published on `user:invalidate`
+(invalidate_user()) to the callbacks registered with
+on_user_invalidated(), so per-process user caches are dropped everywhere.
+"""
+import os
+import time
+import uuid
+import threading
+from datetime import datetime
+
+from . import json_codec
+from .ttl_cache import TTLCache
+
+
+SESSION_TTL = int(os.getenv('SESSION_TTL', 7 * 24 * 60 * 60))
+# Seconds a validated (or revoked) session is trusted without asking Redis
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', 30))
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 10000))
+
+INVALIDATE_CHANNEL = 'session:invalidate'
+# Published to drop every cached session (e.g. after a mass revocation)
+ALL_SESSIONS = '*'
+# User IDs changed (updated, deactivated, new password) by any process
+USER_INVALIDATE_CHANNEL = 'user:invalidate'
+
+_cache = TTLCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+_listener = {'pid': None, 'thread': None}
+_listener_lock = threading.Lock()
+_user_callbacks = []
+
+
+def _session_key(session_id):
+    return f'session:{session_id}'
+
+
+def _user_key(user_id):
+    return f'user_sessions:{user_id}'
+
+
+def create(redis_client, user):
+    """
+    Start a session for a user
+
+    Args:
+        redis_client (redis.Redis): Redis connection
+        user (dict): 'user_id', 'username' and 'email'
+
+    Returns:
+        tuple: (session ID, session data)
+    """
+    session_id = str(uuid.uuid4())
+    data = {
+        # A string (ObjectId or not), as it comes back from Redis and the cookie
+        'user_id': str(user['user_id']),
+        'username': user['username'],
+        'email': user['email'],
+        'login_time': datetime.utcnow().isoformat()
+    }
+    pipe = redis_client.pipeline()
+    pipe.setex(_session_key(session_id), SESSION_TTL, json_codec.dumps(data))
+    pipe.sadd(_user_key(data['user_id']), session_id)
+    pipe.expire(_user_key(data['user_id']), SESSION_TTL)
+    pipe.execute()
+    _cache.set(session_id, data)
+    return session_id, data
+
+
+def get(redis_client, session_id):
+    """
+    Data of a live session, or None if it expired or was revoked
+
+    Raises:
+        redis.RedisError: If Redis cannot be reached and the session is not cached
+    """
+    if not session_id:
+        return None
+    _ensure_listener(redis_client)
+
+    cached = _cache.get(session_id)
+    if cached is not None:
+        return cached or None
+
+    raw = redis_client.get(_session_key(session_id))
+    data = json_codec.loads(raw) if raw else None
+    # Unknown sessions are cached too (as False) so replayed cookies stay cheap
+    _cache.set(session_id, data or False)
+    return data
+
+
+def revoke(redis_client, session_id):
+    """End one session in every process"""
+    raw = redis_client.get(_session_key(session_id))
+    pipe = redis_client.pipeline()
+    pipe.delete(_session_key(session_id))
+    if raw:
+        pipe.srem(_user_key(json_codec.loads(raw)['user_id']), session_id)
+    pipe.publish(INVALIDATE_CHANNEL, session_id)
+    pipe.execute()
+    _cache.set(session_id, False)
+
+
+def revoke_user(redis_client, user_id):
+    """
+    End every session of a user
+
+    Returns:
+        int: Number of sessions revoked
+    """
+    session_ids = list(redis_client.smembers(_user_key(user_id)))
+    pipe = redis_client.pipeline()
+    for session_id in session_ids:
+        pipe.delete(_session_key(session_id))
+        pipe.publish(INVALIDATE_CHANNEL, session_id)
+    pipe.delete(_user_key(user_id))
+    pipe.execute()
+    for session_id in session_ids:
+        _cache.set(session_id, False)
+    return len(session_ids)
+
+
+def on_user_invalidated(callback):
+    """
+    Register callback(user_id) for user changes made by any process
+
+    The callback gets None when changes may have been missed (after
+    subscribing or a lost connection) and every cached user should go.
+    """
+    _user_callbacks.append(callback)
+
+
+def invalidate_user(redis_client, user_id):
+    """Tell every process (this one included) to drop a user from its caches"""
+    _ensure_listener(redis_client)
+    redis_client.publish(USER_INVALIDATE_CHANNEL, str(user_id))
+
+
+def listen(redis_client):
+    """Make sure this process receives session and user invalidations"""
+    _ensure_listener(redis_client)
+
+
+def _drop_users(user_id):
+    for callback in _user_callbacks:
+        try:
+            callback(user_id)
+        except Exception as e:
+            print(f"User invalidation callback error: {e}")
+
+
+def _ensure_listener(redis_client):
+    """Start this process's invalidation subscriber (once per process)"""
+    pid = os.getpid()
+    if _listener['pid'] == pid and _listener['thread'].is_alive():
+        return
+    with _listener_lock:
+        if _listener['pid'] == pid and _listener['thread'].is_alive():
+            return
+        if _listener['pid'] != pid:
+            # Forked: entries cached by the parent were never invalidated here
+            _cache.clear()
+        thread = threading.Thread(target=_listen, args=(redis_client,), name='session-invalidation', daemon=True)
+        _listener.update(pid=pid, thread=thread)
+        thread.start()
+
+
+def _listen(redis_client):
+    """Drop revoked sessions from the cache as revocations are published"""
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATE_CHANNEL, USER_INVALIDATE_CHANNEL)
+            # Revocations missed while unsubscribed are not replayed
+            _cache.clear()
+            _drop_users(None)
+            for message in pubsub.listen():
+                if message.get('type') != 'message':
+                    continue
+                if message['channel'] == USER_INVALIDATE_CHANNEL:
+                    _drop_users(message['data'])
+                elif message['data'] == ALL_SESSIONS:
+                    _cache.clear()
+                else:
+                    _cache.delete(message['data'])
+        except Exception as e:
+            print(f"Session invalidation listener error: {e}")
+            _cache.clear()
+            _drop_users(None)
+            time.sleep(1)
+
+
+def cache_stats():
+    """Hit/miss counters of the session cache"""
+    return _cache.stats()
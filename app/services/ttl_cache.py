@@ -0,0 +1,64 @@
+"""
+In-process LRU cache with per-entry expiry
+
+Thread-safe; used in front of Redis and MongoDB lookups that are repeated
+on most requests. Entries expire `ttl` seconds after they are stored, and
+the least recently used entries are evicted beyond `maxsize`.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """LRU mapping whose entries expire after `ttl` seconds"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Cached value of `key`, or `default` if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store a value, evicting the least recently used entries if full"""
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Size and hit/miss counters"""
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,108 @@
+"""
+Upload catalog queries
+
+Lists the `files` collection newest first with keyset pagination: the
+opaque cursor encodes the (upload_date, _id) of the last upload returned,
+so every page is an index range scan instead of a sort and skip over the
+whole collection.
+"""
+import json
+import base64
+import binascii
+from pymongo import ASCENDING, DESCENDING
+
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+STATUSES = ('pending', 'processing', 'completed', 'failed')
+FILE_TYPES = ('csv', 'json')
+
+# Internal fields never returned by the catalog; the per-file summary is
+# served by its own endpoint to keep listings small
+HIDDEN_FIELDS = {'file_path': 0, 'row_ranges': 0, 'summary': 0}
+
+_NEWEST_FIRST = [('upload_date', DESCENDING), ('_id', DESCENDING)]
+
+
+def ensure_indexes(files_collection):
+    """Create the indexes backing the catalog listing and its filters"""
+    files_collection.create_index(_NEWEST_FIRST, name='upload_date_id')
+    for field in ('status', 'user', 'file_type'):
+        files_collection.create_index(
+            [(field, ASCENDING)] + _NEWEST_FIRST,
+            name=f'{field}_upload_date_id'
+        )
+
+
+def encode_cursor(upload):
+    """Opaque cursor pointing after `upload`"""
+    raw = json.dumps([upload['upload_date'], str(upload['_id'])], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        upload_date, file_id = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(upload_date, str) or not isinstance(file_id, str):
+        raise ValueError('Invalid cursor')
+    return upload_date, file_id
+
+
+def build_filter(status=None, file_type=None, user=None):
+    """
+    MongoDB filter for the catalog filters
+
+    Raises:
+        ValueError: If status or file_type is not a known value
+    """
+    query = {}
+    if status:
+        if status not in STATUSES:
+            raise ValueError(f"status must be one of {', '.join(STATUSES)}")
+        query['status'] = status
+    if file_type:
+        if file_type not in FILE_TYPES:
+            raise ValueError(f"type must be one of {', '.join(FILE_TYPES)}")
+        query['file_type'] = file_type
+    if user:
+        query['user'] = user
+    return query
+
+
+def list_uploads(files_collection, limit=None, cursor=None, status=None, file_type=None, user=None):
+    """
+    One page of uploads, newest first
+
+    Returns:
+        tuple: (list of upload documents, cursor of the next page or None)
+
+    Raises:
+        ValueError: On an invalid cursor or filter value
+    """
+    try:
+        limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    query = build_filter(status, file_type, user)
+
+    if cursor:
+        upload_date, file_id = decode_cursor(cursor)
+        query['$or'] = [
+            {'upload_date': {'$lt': upload_date}},
+            {'upload_date': upload_date, '_id': {'$lt': file_id}}
+        ]
+
+    # One extra document tells whether there is a next page
+    uploads = list(files_collection.find(query, HIDDEN_FIELDS).sort(_NEWEST_FIRST).limit(limit + 1))
+    next_cursor = encode_cursor(uploads[limit - 1]) if len(uploads) > limit else None
+    return uploads[:limit], next_cursor
@@ -0,0 +1,147 @@
+"""
+Write-behind buffer for hot document updates
+
+Frequent, non-critical updates (such as a user's last_login) are merged
+in memory per document and written with one unordered bulk_write instead
+of a round trip per request. A background thread flushes the buffer
+every WRITE_BEHIND_MAX_DELAY seconds, or earlier once
+WRITE_BEHIND_MAX_PENDING documents are waiting, so readers see updates at
+most about WRITE_BEHIND_MAX_DELAY seconds late. The buffer is also
+flushed at interpreter exit.
+
+Updates are merged per operator: $set keeps the latest value, $max the
+largest and $inc the sum.
+"""
+import os
+import time
+import atexit
+import threading
+from pymongo import UpdateOne
+
+from . import metrics
+
+
+WRITE_BEHIND_MAX_DELAY = float(os.getenv('WRITE_BEHIND_MAX_DELAY', 5))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', 1000))
+
+
+class WriteBehindBuffer:
+    """Coalesces updates per document and flushes them in bulk"""
+
+    def __init__(self, max_delay=None, max_pending=None):
+        self.max_delay = WRITE_BEHIND_MAX_DELAY if max_delay is None else max_delay
+        self.max_pending = max_pending or WRITE_BEHIND_MAX_PENDING
+        self._lock = threading.Lock()
+        self._pending = {}  # (namespace, _id) -> (collection, {operator: {field: value}})
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Pending updates belong to (and are flushed by) the parent process
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._wakeup = threading.Event()
+
+    def update(self, collection, doc_id, set_fields=None, max_fields=None, inc_fields=None):
+        """Queue an update of one document"""
+        key = (collection.full_name, doc_id)
+        update = {'$set': set_fields or {}, '$max': max_fields or {}, '$inc': inc_fields or {}}
+        with self._lock:
+            _, operations = self._pending.setdefault(key, (collection, {}))
+            self._merge(operations, update)
+            pending = len(self._pending)
+        metrics.set_gauge('write_behind.pending', pending)
+
+        self._ensure_thread()
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    @staticmethod
+    def _merge(operations, newer):
+        """Merge a newer {operator: {field: value}} update into `operations`"""
+        for operator, fields in newer.items():
+            if not fields:
+                continue
+            merged = operations.setdefault(operator, {})
+            for field, value in fields.items():
+                current = merged.get(field)
+                if operator == '$max' and current is not None:
+                    value = max(current, value)
+                elif operator == '$inc' and current is not None:
+                    value = current + value
+                merged[field] = value
+
+    def flush(self):
+        """
+        Write all pending updates now
+
+        Returns:
+            int: Number of documents updated
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        by_collection = {}
+        for (namespace, doc_id), (collection, operations) in pending.items():
+            by_collection.setdefault(namespace, (collection, []))[1].append((doc_id, operations))
+
+        written = 0
+        started = time.perf_counter()
+        for namespace, (collection, updates) in by_collection.items():
+            try:
+                collection.bulk_write(
+                    [UpdateOne({'_id': doc_id}, operations) for doc_id, operations in updates],
+                    ordered=False
+                )
+                written += len(updates)
+            except Exception as e:
+                print(f"Write-behind flush error for {namespace}: {e}")
+                metrics.increment('write_behind.errors')
+                self._requeue(collection, updates)
+        metrics.observe('write_behind.flush_time', time.perf_counter() - started)
+        metrics.increment('write_behind.flushed', written)
+        metrics.set_gauge('write_behind.pending', len(self._pending))
+        return written
+
+    def _requeue(self, collection, updates):
+        """Put back updates of a failed flush, unless the buffer is already full"""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                print(f"Write-behind buffer full, dropping {len(updates)} update(s) for {collection.full_name}")
+                metrics.increment('write_behind.dropped', len(updates))
+                return
+            for doc_id, operations in updates:
+                # Updates queued since the failed flush are newer: apply them last
+                _, newer = self._pending.get((collection.full_name, doc_id), (collection, {}))
+                self._merge(operations, newer)
+                self._pending[(collection.full_name, doc_id)] = (collection, operations)
+
+    def _ensure_thread(self):
+        """Start the flusher thread (once per process)"""
+        pid = os.getpid()
+        if self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._pid = pid
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Write-behind flush error: {e}")
+
+
+# Shared buffer for user activity updates
+buffer = WriteBehindBuffer()
@@ -0,0 +1,173 @@
+"""
+Ingestion worker pool
+
+Consumes upload ingestion jobs from the Redis queue filled by
+/api/upload and indexes them into Elasticsearch. A supervisor process
+keeps INGEST_WORKER_PROCESSES worker processes alive, re-queues jobs
+abandoned by crashed workers, restores index settings left in
+bulk-load mode by them and deletes the partial files of abandoned
+chunked uploads. Indexed uploads also get their local search columns
+(the /api/search fallback) built here rather than on a search request.
+
+Usage:
+    python worker.py [--processes N]
+"""
+import os
+import signal
+import argparse
+import multiprocessing
+from elasticsearch import Elasticsearch
+import redis
+from dotenv import load_dotenv
+from services import ingest_queue, bulk_load, run_ingest_job, database, log_queries, chunked_upload, local_search
+
+# Load environment variables
+load_dotenv()
+
+ES_HOST = os.getenv('ELASTICSEARCH_HOST', 'http://localhost:9200')
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+
+WORKER_PROCESSES = int(os.getenv('INGEST_WORKER_PROCESSES', 2))
+# Same default as the web app (uploads folder /app/uploads)
+LOCAL_SEARCH_CACHE_DIR = os.getenv('LOCAL_SEARCH_CACHE_DIR', '/app/uploads/.columns')
+LOCAL_SEARCH_BUILD = os.getenv('LOCAL_SEARCH_BUILD_ON_INGEST', 'true').lower() == 'true'
+SUPERVISOR_INTERVAL = 10  # seconds between health checks of the pool
+
+
+def create_clients():
+    """Elasticsearch, MongoDB `files` collection and Redis clients"""
+    es_client = Elasticsearch([ES_HOST], verify_certs=False, request_timeout=60)
+    files_collection = database.get_database()['files']
+    redis_client = redis.Redis(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        decode_responses=True,
+        socket_connect_timeout=5
+    )
+    return es_client, files_collection, redis_client
+
+
+def build_local_search(files_collection, file_doc):
+    """Build an upload's local search columns (dropped again if it was deleted meanwhile)"""
+    try:
+        local_search.build(LOCAL_SEARCH_CACHE_DIR, file_doc)
+        if not files_collection.find_one({'_id': file_doc['_id']}, {'_id': 1}):
+            local_search.discard(LOCAL_SEARCH_CACHE_DIR, file_doc['_id'])
+    except Exception as e:
+        print(f"Local search build error for {file_doc['_id']}: {e}")
+
+
+def worker_loop(stop_event):
+    """Process ingestion jobs until stop_event is set"""
+    # Clients are created per process, after fork
+    es_client, files_collection, redis_client = create_clients()
+
+    # Let the supervisor handle Ctrl+C; stop after the current job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    pid = os.getpid()
+    print(f"Ingestion worker {pid} started")
+
+    while not stop_event.is_set():
+        try:
+            file_id = ingest_queue.dequeue(redis_client, timeout=5)
+        except Exception as e:
+            print(f"Worker {pid} queue error: {e}")
+            stop_event.wait(5)
+            continue
+
+        if not file_id:
+            continue
+
+        indexed_doc = None
+        try:
+            file_doc = files_collection.find_one({'_id': file_id})
+            if not file_doc:
+                print(f"Worker {pid}: file {file_id} no longer exists, skipping")
+                continue
+
+            print(f"Worker {pid} ingesting {file_doc.get('filename')} ({file_id})")
+            result = run_ingest_job(
+                es_client,
+                files_collection,
+                file_doc,
+                on_progress=lambda: ingest_queue.heartbeat(redis_client, file_id)
+            )
+            print(f"Worker {pid} finished {file_id}: {result['status']}, "
+                  f"{result['indexed']} indexed, {result['failed']} failed")
+            # New logs: ETags of the dashboard and log endpoints change
+            log_queries.bump_generation(redis_client)
+            if LOCAL_SEARCH_BUILD and result['status'] == 'completed':
+                indexed_doc = file_doc
+        except Exception as e:
+            print(f"Worker {pid} job error for {file_id}: {e}")
+        finally:
+            try:
+                ingest_queue.ack(redis_client, file_id)
+            except Exception as e:
+                print(f"Worker {pid} ack error for {file_id}: {e}")
+
+        # After the ack: a long build must not look like a stalled job
+        if indexed_doc:
+            build_local_search(files_collection, indexed_doc)
+
+    print(f"Ingestion worker {pid} stopped")
+
+
+def run_pool(processes):
+    """Start the worker processes and keep them running until SIGTERM/SIGINT"""
+    stop_event = multiprocessing.Event()
+
+    def request_stop(signum, frame):
+        print("Stopping ingestion workers after their current job...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    es_client, files_collection, redis_client = create_clients()
+    bulk_load_state = files_collection.database['bulk_load_indices']
+
+    workers = []
+    while not stop_event.is_set():
+        # Restart workers that died
+        workers = [w for w in workers if w.is_alive()]
+        while len(workers) < processes:
+            worker = multiprocessing.Process(target=worker_loop, args=(stop_event,), daemon=False)
+            worker.start()
+            workers.append(worker)
+
+        try:
+            requeued = ingest_queue.requeue_stale(redis_client)
+            if requeued:
+                print(f"Re-queued {requeued} stale ingestion job(s)")
+        except Exception as e:
+            print(f"Stale job check error: {e}")
+
+        try:
+            restored = bulk_load.recover_stale(es_client, bulk_load_state)
+            if restored:
+                print(f"Restored settings of {restored} index(es) left in bulk-load mode")
+        except Exception as e:
+            print(f"Bulk-load recovery error: {e}")
+
+        try:
+            removed = chunked_upload.remove_expired(redis_client)
+            if removed:
+                print(f"Removed {removed} abandoned chunked upload file(s)")
+        except Exception as e:
+            print(f"Chunked upload cleanup error: {e}")
+
+        stop_event.wait(SUPERVISOR_INTERVAL)
+
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the upload ingestion worker pool')
+    parser.add_argument('--processes', type=int, default=WORKER_PROCESSES,
+                        help='Number of worker processes')
+    args = parser.parse_args()
+    run_pool(args.processes)
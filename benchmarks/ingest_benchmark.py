@@ -0,0 +1,252 @@
+"""
+Ingestion throughput benchmark
+
+Generates a log file with the repository's generators, then pushes it
+through the same code the upload path uses: the multipart request is
+received by a Flask app with the production request class (spooling and
+hashing the upload), the file is saved, typed and counted, and finally
+ingested by run_ingest_job against a local Elasticsearch stand-in
+(stub_es.StubElasticsearch) with configurable latency and rejections.
+
+The report is a JSON document with rows/sec, MB/sec, peak RSS and the
+time spent in each stage (receive, parse, summary, serialize, bulk):
+
+    python benchmarks/ingest_benchmark.py --rows 200000 --format csv
+    python benchmarks/ingest_benchmark.py --rows 50000 --latency-ms 50 --reject-rate 0.05 --output report.json
+
+Bulk time is summed over concurrent requests, so stages can add up to
+more than the ingest wall time. MongoDB and Redis are not needed: the
+ingest runs inline, as the web app does when no queue is available. The
+usual INGEST_* environment variables tune the indexer.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+
+from flask import Flask, request  # noqa: E402
+from elasticsearch import Elasticsearch  # noqa: E402
+
+from services import count_records, run_ingest_job, dedup, file_formats  # noqa: E402
+from benchmarks.stub_es import StubElasticsearch  # noqa: E402
+
+GENERATORS = ('saas', 'logs')
+FORMATS = ('csv', 'json', 'ndjson')
+
+
+def iter_generated_logs(generator, rows, seed):
+    """Yield log entries from generate_saas_logs.py or generate_logs.py"""
+    random.seed(seed)
+    if generator == 'saas':
+        import generate_saas_logs as module
+        module.fake.seed_instance(seed)
+        for _ in range(rows):
+            yield module.generate_log_entry()
+        return
+
+    import generate_logs as module
+    module.fake.seed_instance(seed)
+    end_time = datetime.utcnow()
+    start_time = end_time - timedelta(days=7)
+    span = (end_time - start_time).total_seconds()
+    for _ in range(rows):
+        yield module.generate_log_entry(start_time + timedelta(seconds=random.random() * span))
+
+
+def generate_file(data_dir, generator, rows, file_format, seed):
+    """
+    Write (or reuse) a generated log file
+
+    Returns:
+        str: Path of the file
+    """
+    path = os.path.join(data_dir, f'{generator}-{rows}-{seed}.{file_format}')
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(data_dir, exist_ok=True)
+    partial = path + '.partial'
+    entries = iter_generated_logs(generator, rows, seed)
+    with open(partial, 'w', newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            first = next(entries, None)
+            if first is not None:
+                writer = csv.DictWriter(f, fieldnames=list(first.keys()))
+                writer.writeheader()
+                writer.writerow(first)
+                writer.writerows(entries)
+        elif file_format == 'ndjson':
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        else:
+            # Same layout as the generators' own JSON output
+            f.write('[\n')
+            for position, entry in enumerate(entries):
+                f.write((',\n' if position else '') + json.dumps(entry, indent=2))
+            f.write('\n]\n')
+    os.replace(partial, path)
+    return path
+
+
+def create_receiver(upload_folder):
+    """
+    Flask app receiving uploads like /api/upload does before queueing
+
+    The upload is spooled and hashed by the production request class, then
+    saved, typed and counted.
+    """
+    app = Flask(__name__)
+    app.request_class = dedup.HashingRequest
+    app.config['UPLOAD_FOLDER'] = upload_folder
+
+    @app.route('/upload', methods=['POST'])
+    def receive():
+        file = request.files['file']
+        file_path = os.path.join(upload_folder, f"{int(time.time())}_{file.filename}")
+        sha256 = dedup.save_upload(file, file_path)
+        file_type = file_formats.detect_file_type(file_path)
+        return {
+            'file_path': file_path,
+            'file_type': file_type,
+            'content_sha256': sha256,
+            'log_count': count_records(file_path, file_type)
+        }
+
+    return app
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run(file_path, stub):
+    """
+    Receive and ingest one file
+
+    Returns:
+        dict: Benchmark report
+    """
+    file_size = os.path.getsize(file_path)
+    upload_folder = tempfile.mkdtemp(prefix='ingest-benchmark-')
+    rss_before = peak_rss_mb()
+    try:
+        client = create_receiver(upload_folder).test_client()
+        started = time.perf_counter()
+        with open(file_path, 'rb') as f:
+            response = client.post(
+                '/upload',
+                data={'file': (f, os.path.basename(file_path))},
+                content_type='multipart/form-data'
+            )
+        received = time.perf_counter()
+        if response.status_code != 200:
+            raise RuntimeError(f'Receive failed ({response.status_code}): {response.get_data(as_text=True)[:500]}')
+        upload = response.get_json()
+
+        es_client = Elasticsearch(stub.url, request_timeout=60)
+        file_doc = {'_id': 'benchmark', **upload}
+
+        ingest_started = time.perf_counter()
+        result = run_ingest_job(es_client, None, file_doc)
+        finished = time.perf_counter()
+    finally:
+        shutil.rmtree(upload_folder, ignore_errors=True)
+
+    rows = result['indexed'] + result['failed']
+    total = finished - started
+    stages_ms = {'receive': int((received - started) * 1000)}
+    stages_ms.update(result.get('stages_ms') or {})
+    return {
+        'file': {
+            'path': file_path,
+            'type': upload['file_type'],
+            'bytes': file_size,
+            'rows': upload['log_count']
+        },
+        'status': result['status'],
+        'indexed': result['indexed'],
+        'failed': result['failed'],
+        'errors': result['errors'][:3],
+        'seconds': {
+            'total': round(total, 3),
+            'receive': round(received - started, 3),
+            'ingest': round(finished - ingest_started, 3)
+        },
+        'rows_per_sec': round(rows / total, 1) if total else None,
+        'mb_per_sec': round(file_size / (1024 * 1024) / total, 2) if total else None,
+        'ingest_rows_per_sec': round(rows / (finished - ingest_started), 1),
+        'stages_ms': stages_ms,
+        'bulk': result.get('bulk'),
+        'stub': stub.stats(),
+        'rss_mb': {'before': rss_before, 'peak': peak_rss_mb()}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the upload and ingestion path')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--generator', choices=GENERATORS, default='saas',
+                        help='saas: generate_saas_logs.py, logs: generate_logs.py')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--file', help='benchmark an existing file instead of generating one')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'ingest-benchmark-data'),
+                        help='where generated files are cached')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='stub bulk request latency')
+    parser.add_argument('--per-doc-us', type=float, default=0.0, help='stub latency per bulk document')
+    parser.add_argument('--reject-rate', type=float, default=0.0, help='fraction of bulk items rejected with 429')
+    parser.add_argument('--reject-requests', type=float, default=0.0, help='fraction of bulk requests rejected with 429')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    generate_started = time.perf_counter()
+    file_path = args.file or generate_file(args.data_dir, args.generator, args.rows, args.format, args.seed)
+    generate_seconds = time.perf_counter() - generate_started
+
+    with StubElasticsearch(latency_ms=args.latency_ms, per_doc_us=args.per_doc_us, reject_rate=args.reject_rate,
+                           reject_requests=args.reject_requests, seed=args.seed) as stub:
+        report = run(file_path, stub)
+
+    report['generate_seconds'] = round(generate_seconds, 3)
+    report['config'] = {
+        'generator': None if args.file else args.generator,
+        'format': None if args.file else args.format,
+        'seed': args.seed,
+        'latency_ms': args.latency_ms,
+        'per_doc_us': args.per_doc_us,
+        'reject_rate': args.reject_rate,
+        'reject_requests': args.reject_requests
+    }
+    report['environment'] = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': datetime.utcnow().isoformat() + 'Z'
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0 if report['status'] == 'completed' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""
+Local Elasticsearch stand-in for ingestion benchmarks
+
+Answers the requests the ingestion path makes (cluster info, index
+creation and settings, refresh, _bulk) without storing anything. Bulk
+requests can be slowed down and rejected to exercise the adaptive
+indexer's backpressure handling:
+
+    python benchmarks/stub_es.py --port 9299 --latency-ms 20 --reject-rate 0.05
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubElasticsearch:
+    """
+    Threaded HTTP server speaking enough of the Elasticsearch API for bulk indexing
+
+    Args:
+        port (int): Port to listen on (0 picks a free one)
+        latency_ms (float): Time every bulk request takes
+        per_doc_us (float): Additional time per document in a bulk request
+        reject_rate (float): Fraction of bulk items rejected with 429
+        reject_requests (float): Fraction of whole bulk requests rejected with 429
+        seed (int): Random seed for the rejections
+    """
+
+    def __init__(self, port=0, latency_ms=0.0, per_doc_us=0.0, reject_rate=0.0, reject_requests=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.per_doc_us = per_doc_us
+        self.reject_rate = reject_rate
+        self.reject_requests = reject_requests
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.settings = {}
+        self.counters = {
+            'bulk_requests': 0,
+            'rejected_requests': 0,
+            'documents': 0,
+            'rejected_documents': 0,
+            'bytes': 0
+        }
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve in a background thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def stats(self):
+        """Copy of the request / document counters"""
+        with self.lock:
+            return dict(self.counters)
+
+    def _count(self, **increments):
+        with self.lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def _reject(self, rate):
+        with self.lock:
+            return rate > 0 and self.random.random() < rate
+
+    def bulk(self, body):
+        """
+        Handle a _bulk body
+
+        Returns:
+            tuple: (HTTP status, response body)
+        """
+        lines = body.splitlines()
+        self._count(bulk_requests=1, bytes=len(body))
+        time.sleep((self.latency_ms + self.per_doc_us * len(lines) / 2000.0) / 1000.0)
+        took = int(self.latency_ms)
+
+        if self._reject(self.reject_requests):
+            self._count(rejected_requests=1)
+            return 429, {
+                'error': {'type': 'es_rejected_execution_exception', 'reason': 'rejected by stub'},
+                'status': 429
+            }
+
+        items = []
+        rejected = 0
+        # Action lines alternate with document lines
+        for line in lines[::2]:
+            if not line.strip():
+                continue
+            action = json.loads(line)
+            op, meta = next(iter(action.items()))
+            if self._reject(self.reject_rate):
+                rejected += 1
+                items.append({op: {'_id': meta.get('_id'), 'status': 429, 'error': {
+                    'type': 'es_rejected_execution_exception', 'reason': 'rejected by stub'
+                }}})
+            else:
+                items.append({op: {'_index': meta.get('_index'), '_id': meta.get('_id'), 'status': 201}})
+        self._count(documents=len(items) - rejected, rejected_documents=rejected)
+        return 200, {'took': took, 'errors': rejected > 0, 'items': items}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                # Required by the official client's product check
+                self.send_header('X-Elastic-Product', 'Elasticsearch')
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(data)
+
+            def _route(self):
+                path = self.path.split('?')[0]
+                parts = [part for part in path.split('/') if part]
+                body = self._body()
+
+                if parts and parts[-1] == '_bulk':
+                    return self._reply(*stub.bulk(body))
+                if len(parts) == 2 and parts[1] == '_settings':
+                    index = parts[0]
+                    if self.command == 'PUT':
+                        stub.settings.setdefault(index, {}).update(json.loads(body or b'{}').get('index', {}))
+                        return self._reply(200, {'acknowledged': True})
+                    flat = {f'index.{key}': str(value) for key, value in stub.settings.get(index, {}).items()}
+                    return self._reply(200, {index: {
+                        'settings': flat,
+                        'defaults': {'index.refresh_interval': '1s', 'index.number_of_replicas': '1'}
+                    }})
+                if not parts:
+                    return self._reply(200, {
+                        'name': 'stub',
+                        'cluster_name': 'benchmark',
+                        'version': {'number': '8.11.0'},
+                        'tagline': 'You Know, for Search'
+                    })
+                return self._reply(200, {'acknowledged': True, '_shards': {'total': 1, 'successful': 1, 'failed': 0}})
+
+            do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _route
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a stub Elasticsearch bulk endpoint')
+    parser.add_argument('--port', type=int, default=9299)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--per-doc-us', type=float, default=0.0)
+    parser.add_argument('--reject-rate', type=float, default=0.0, help='fraction of bulk items answered with 429')
+    parser.add_argument('--reject-requests', type=float, default=0.0, help='fraction of bulk requests answered with 429')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    stub = StubElasticsearch(args.port, args.latency_ms, args.per_doc_us, args.reject_rate, args.reject_requests, args.seed)
+    print(f"Stub Elasticsearch listening on {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(stub.stats()))
+
+
+if __name__ == '__main__':
+    main()